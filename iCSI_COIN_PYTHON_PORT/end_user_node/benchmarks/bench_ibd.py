@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Initial block download replay, with and without assume-valid.
+
+Every main-chain block of a source data directory (default: test_data) is fed
+through ChainManager.process_block() into a fresh data directory, once with full
+signature checks and once with assume-valid pointing at the source tip. Each
+run first passes every header through ChainManager.accept_headers(), as a
+headers message from a peer would; assume-valid only applies once its block is
+known. The signature cache is cleared before each run so neither benefits from
+the other.
+
+The bundled test_data chain is only the genesis block, so when the source has
+fewer than --generate blocks a signed chain of that length is built first
+(each block spends the previous coinbase's --inputs outputs). Mining that chain
+against scrypt would take seconds per block, so a generated chain is mined and
+replayed with double SHA-256 as the proof-of-work hash; header checks in both
+runs are slightly cheaper than on a real chain.
+
+Usage: python benchmarks/bench_ibd.py [--source test_data] [--generate 300] [--inputs 4]
+"""
+import os
+import sys
+import time
+import shutil
+import hashlib
+import logging
+import argparse
+import tempfile
+import contextlib
+from unittest import mock
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from ecdsa import SigningKey, SECP256k1
+from ecdsa.util import sigencode_der
+
+from icsicoin.core.primitives import Block, BlockHeader, Transaction, TxIn, TxOut
+from icsicoin.core.chain import ChainManager
+from icsicoin.consensus.assumevalid import AssumeValid
+from icsicoin.consensus.merkle import get_merkle_root
+from icsicoin.consensus.sighash import SighashCache
+from icsicoin.consensus.sigcache import signature_cache
+from icsicoin.consensus.validation import GENESIS_BITS, validate_block_header
+from icsicoin.core.hashing import double_sha256
+from icsicoin.storage.blockstore import BlockStore
+from icsicoin.storage.databases import BlockIndexDB, ChainStateDB
+
+def open_chain(data_dir):
+    return ChainManager(BlockStore(data_dir), BlockIndexDB(data_dir), ChainStateDB(data_dir))
+
+def generate_chain(data_dir, count, inputs):
+    sk = SigningKey.generate(curve=SECP256k1)
+    pubkey = sk.verifying_key.to_string()
+    script = b'\x76\xa9\x14' + hashlib.new('ripemd160', hashlib.sha256(pubkey).digest()).digest() + b'\x88\xac'
+
+    chain = open_chain(data_dir)
+    prev_hash = chain.genesis_block.get_hash().hex()
+    prev_coinbase = None
+    for height in range(1, count + 1):
+        vtx = [Transaction(vin=[TxIn(b'\x00' * 32, 0xffffffff, f"ibd{height}".encode(), 0xffffffff)],
+                           vout=[TxOut(50 * 100000000 // inputs, script) for _ in range(inputs)])]
+        if prev_coinbase:
+            tx = Transaction(vin=[TxIn(bytes.fromhex(prev_coinbase), i) for i in range(inputs)],
+                             vout=[TxOut(49 * 100000000 // inputs, script)])
+            sighash_cache = SighashCache(tx)
+            for i in range(inputs):
+                sig = sk.sign_digest(sighash_cache.signature_hash(i, script), sigencode=sigencode_der) + b'\x01'
+                tx.vin[i].script_sig = bytes([len(sig)]) + sig + bytes([len(pubkey)]) + pubkey
+            vtx.append(tx)
+        header = BlockHeader(prev_block=bytes.fromhex(prev_hash), merkle_root=get_merkle_root(vtx),
+                             timestamp=1700000000 + height * 30, bits=GENESIS_BITS)
+        while not validate_block_header(header, None):
+            header.nonce += 1
+        block = Block(header, vtx)
+        success, reason = chain.process_block(block)
+        assert success, reason
+        prev_hash = block.get_hash().hex()
+        prev_coinbase = vtx[0].get_hash().hex()
+
+def load_blocks(data_dir):
+    chain = open_chain(data_dir)
+    tip = chain.get_best_height()
+    return [chain.get_block_by_height(h) for h in range(1, tip + 1)]
+
+def replay(blocks, assume_valid):
+    data_dir = tempfile.mkdtemp()
+    try:
+        chain = open_chain(data_dir)
+        chain.assume_valid = assume_valid
+        signature_cache.clear()
+        start = time.perf_counter()
+        success, reason = chain.accept_headers([block.header for block in blocks])
+        assert success, reason
+        for block in blocks:
+            success, reason = chain.process_block(block)
+            assert success, reason
+        return time.perf_counter() - start
+    finally:
+        shutil.rmtree(data_dir)
+
+def main():
+    default_source = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'test_data'))
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--source", default=default_source, help="Data directory to replay")
+    parser.add_argument("--generate", type=int, default=300, help="Build a chain this long if the source is shorter")
+    parser.add_argument("--inputs", type=int, default=4, help="Signed inputs per generated block")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    # Work on a copy: opening a data directory migrates its databases
+    source = tempfile.mkdtemp()
+    cheap_pow = contextlib.ExitStack()
+    try:
+        shutil.copytree(args.source, source, dirs_exist_ok=True)
+        blocks = load_blocks(source)
+        if len(blocks) < args.generate:
+            print(f"{args.source} has {len(blocks)} blocks after genesis; generating {args.generate} "
+                  f"with {args.inputs} signed inputs each")
+            shutil.rmtree(source)
+            os.makedirs(source)
+            cheap_pow.enter_context(mock.patch('icsicoin.consensus.validation.hash_header', double_sha256))
+            generate_chain(source, args.generate, args.inputs)
+            blocks = load_blocks(source)
+    finally:
+        shutil.rmtree(source)
+
+    tip = blocks[-1]
+    inputs = sum(len(tx.vin) for b in blocks for tx in b.vtx if not tx.is_coinbase())
+    with cheap_pow:
+        full = replay(blocks, AssumeValid(None))
+        assumed = replay(blocks, AssumeValid(tip.get_hash().hex()))
+
+    print(f"{len(blocks)} blocks, {inputs} signed inputs")
+    print(f"  full validation : {full:7.2f} s  ({len(blocks) / full:7.1f} blocks/s)")
+    print(f"  assume-valid    : {assumed:7.2f} s  ({len(blocks) / assumed:7.1f} blocks/s, {full / assumed:.1f}x)")
+
+if __name__ == "__main__":
+    main()
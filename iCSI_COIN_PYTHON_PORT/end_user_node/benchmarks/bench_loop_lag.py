@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Event loop lag of the node process while the built-in miner runs.
+
+An asyncio loop serves a stand-in RPC endpoint (getblocktemplate with an
+unreachable target, getbestblockhash, submitblock) and records how late a
+10 ms timer fires, which is how late every peer message and web request is
+handled too. Measured for --duration seconds each with:
+
+  off     - no mining
+  thread  - scrypt hashed on a thread in the node process (the old MinerController)
+  process - MinerController hashing in worker processes
+
+Usage: python benchmarks/bench_loop_lag.py [--duration 10] [--workers 1]
+"""
+import os
+import sys
+import time
+import asyncio
+import logging
+import argparse
+import threading
+import statistics
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from aiohttp import web
+
+from icsicoin.consensus.validation import GENESIS_BITS
+from icsicoin.mining.controller import MinerController
+from icsicoin.consensus.proof_of_work import hash_header
+
+TIP = '11' * 32
+
+async def rpc_handler(request):
+    data = await request.json()
+    if data['method'] == 'getblocktemplate':
+        result = {'height': 1, 'target': '0' * 64, 'bits': GENESIS_BITS, 'previousblockhash': TIP,
+                  'merkle_root': '22' * 32, 'curtime': int(time.time()), 'version': 1, 'transactions': []}
+    elif data['method'] == 'getbestblockhash':
+        result = TIP
+    else:
+        result = 'rejected'
+    return web.json_response({'result': result, 'error': None, 'id': data.get('id')})
+
+def thread_miner(stop):
+    # Mirrors the old in-process loop: yield the GIL every 10k hashes
+    header = bytearray(80)
+    hashes = 0
+    while not stop.is_set():
+        header[76:80] = hashes.to_bytes(4, 'little')
+        hash_header(bytes(header))
+        hashes += 1
+        if hashes % 10000 == 0:
+            time.sleep(0)
+
+async def sample_lag(duration, interval=0.01):
+    lags = []
+    end = time.perf_counter() + duration
+    while time.perf_counter() < end:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - start - interval)
+    return lags
+
+async def run(mode, duration, workers, port):
+    stop = threading.Event()
+    miner = None
+    thread = None
+    if mode == 'thread':
+        thread = threading.Thread(target=thread_miner, args=(stop,), daemon=True)
+        thread.start()
+    elif mode == 'process':
+        miner = MinerController(f"http://127.0.0.1:{port}", "user", "pass", workers=workers)
+        miner.start_mining(None)
+        await asyncio.sleep(2.0) # Let the workers spawn and pick up work
+    try:
+        lags = await sample_lag(duration)
+    finally:
+        stop.set()
+        if miner:
+            await asyncio.get_running_loop().run_in_executor(None, miner.stop_mining)
+        if thread:
+            thread.join()
+    lags.sort()
+    return statistics.mean(lags), lags[int(len(lags) * 0.99)], lags[-1]
+
+async def main_async(args):
+    app = web.Application()
+    app.router.add_post('/', rpc_handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', args.port)
+    await site.start()
+    try:
+        print(f"{os.cpu_count()} CPUs visible, {args.workers} miner worker(s); timer lag in ms")
+        for mode in ('off', 'thread', 'process'):
+            mean, p99, worst = await run(mode, args.duration, args.workers, args.port)
+            print(f"  {mode:8s}: mean {mean * 1000:7.2f}  p99 {p99 * 1000:7.2f}  max {worst * 1000:7.2f}")
+    finally:
+        await runner.cleanup()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds to sample per mode")
+    parser.add_argument("--workers", type=int, default=1, help="Hashing processes for the process mode")
+    parser.add_argument("--port", type=int, default=19340, help="Port for the stand-in RPC server")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+    asyncio.run(main_async(args))
+
+if __name__ == "__main__":
+    main()
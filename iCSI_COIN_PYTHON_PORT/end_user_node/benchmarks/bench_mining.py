@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+Mining hashrate scaling across worker processes.
+
+Runs HashWorkers with 1, 2, 4, ... up to --max-workers processes on a header with
+an unreachable target for --duration seconds each, and reports aggregate and
+per-worker H/s and the speedup over a single worker. Scaling stops at the number
+of physical cores; beyond that the workers only share them.
+
+Usage: python benchmarks/bench_mining.py [--max-workers 4] [--duration 5]
+"""
+import os
+import sys
+import time
+import logging
+import argparse
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from icsicoin.core.primitives import BlockHeader
+from icsicoin.consensus.validation import GENESIS_BITS
+from icsicoin.mining.workers import HashWorkers
+
+def measure(workers, duration):
+    pool = HashWorkers(workers)
+    pool.start()
+    try:
+        header = BlockHeader(1, b'\x00' * 32, b'\x11' * 32, int(time.time()), GENESIS_BITS, 0)
+        pool.submit(header.serialize(), 0)
+        time.sleep(0.5) # Let every process get going before sampling
+        pool.get_hashrates()
+        time.sleep(duration)
+        return pool.get_hashrates()
+    finally:
+        pool.close()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--duration", type=float, default=5.0, help="Seconds to hash per worker count")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    counts = []
+    n = 1
+    while n < args.max_workers:
+        counts.append(n)
+        n *= 2
+    counts.append(args.max_workers)
+
+    print(f"{os.cpu_count()} CPUs visible")
+    base = None
+    for n in counts:
+        rates = measure(n, args.duration)
+        total = sum(rates)
+        base = base or total
+        per_worker = ", ".join(f"{r:.0f}" for r in rates)
+        print(f"  {n:3d} workers: {total:9.1f} H/s  ({total / base:4.2f}x)  [{per_worker}]")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Scrypt proof-of-work hashrate per backend, on one core.
+
+For every backend in icsicoin.consensus.proof_of_work that loads and passes its
+self-test, reports H/s for:
+
+  single - one hash_header() call per 80-byte header (how validation hashes)
+  batch  - scan_nonces() over a nonce range with an unreachable target (how
+           the miner's worker processes hash)
+
+and which backend 'auto' picks at startup.
+
+Usage: python benchmarks/bench_pow.py [--hashes 2000]
+"""
+import os
+import sys
+import time
+import struct
+import logging
+import argparse
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from icsicoin.consensus import proof_of_work
+
+def measure_single(hashes):
+    header = bytearray(80)
+    start = time.perf_counter()
+    for nonce in range(hashes):
+        struct.pack_into('<I', header, 76, nonce)
+        proof_of_work.hash_header(bytes(header))
+    return hashes / (time.perf_counter() - start)
+
+def measure_batch(hashes):
+    start = time.perf_counter()
+    proof_of_work.scan_nonces(bytes(76), 0, 0, hashes)
+    return hashes / (time.perf_counter() - start)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--hashes", type=int, default=2000, help="Hashes per measurement")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    print(f"scrypt N={proof_of_work.SCRYPT_N} r={proof_of_work.SCRYPT_R} p={proof_of_work.SCRYPT_P}, {args.hashes} hashes each")
+    for name in proof_of_work.BACKENDS:
+        if proof_of_work.load_backend(name) is None:
+            print(f"  {name:8s}: unavailable")
+            continue
+        proof_of_work.select_backend(name)
+        single = measure_single(args.hashes)
+        batch = measure_batch(args.hashes)
+        print(f"  {name:8s}: single {single:8.1f} H/s   batch {batch:8.1f} H/s")
+    print(f"  auto picks: {proof_of_work.select_backend('auto')}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Chain reorganization cost for forks of increasing depth.
+
+For each depth d a fresh data directory gets a main branch of d blocks and a
+competing branch of d+1 blocks from the same fork point; every block spends an
+earlier coinbase so disconnects exercise the undo data. The timed step is
+process_block() on the branch tip that tips it to more work.
+
+Usage: python benchmarks/bench_reorg.py [--depths 1,10,100]
+"""
+import os
+import sys
+import time
+import shutil
+import hashlib
+import logging
+import argparse
+import tempfile
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from ecdsa import SigningKey, SECP256k1
+from ecdsa.util import sigencode_der
+
+from icsicoin.core.primitives import Block, BlockHeader, Transaction, TxIn, TxOut
+from icsicoin.core.chain import ChainManager
+from icsicoin.consensus.merkle import get_merkle_root
+from icsicoin.consensus.sighash import SighashCache
+from icsicoin.consensus.validation import GENESIS_BITS
+from icsicoin.storage.blockstore import BlockStore
+from icsicoin.storage.databases import BlockIndexDB, ChainStateDB
+
+SK = SigningKey.generate(curve=SECP256k1)
+PUBKEY = SK.verifying_key.to_string()
+SCRIPT = b'\x76\xa9\x14' + hashlib.new('ripemd160', hashlib.sha256(PUBKEY).digest()).digest() + b'\x88\xac'
+
+def make_block(prev_hash, tag, spend=None):
+    vtx = [Transaction(vin=[TxIn(b'\x00' * 32, 0xffffffff, tag.encode(), 0xffffffff)],
+                       vout=[TxOut(50 * 100000000, SCRIPT)])]
+    if spend:
+        tx = Transaction(vin=[TxIn(bytes.fromhex(spend), 0)], vout=[TxOut(49 * 100000000, SCRIPT)])
+        sig = SK.sign_digest(SighashCache(tx).signature_hash(0, SCRIPT), sigencode=sigencode_der) + b'\x01'
+        tx.vin[0].script_sig = bytes([len(sig)]) + sig + bytes([len(PUBKEY)]) + PUBKEY
+        vtx.append(tx)
+    header = BlockHeader(prev_block=bytes.fromhex(prev_hash), merkle_root=get_merkle_root(vtx),
+                         timestamp=1700000000, bits=GENESIS_BITS)
+    return Block(header, vtx)
+
+def extend(chain, prev_hash, count, tag, spendable):
+    """Connect/store `count` blocks on prev_hash, each spending one coinbase from `spendable`."""
+    for i in range(count):
+        block = make_block(prev_hash, f"{tag}{i}", spendable[i] if i < len(spendable) else None)
+        success, reason = chain.process_block(block)
+        assert success, reason
+        prev_hash = block.get_hash().hex()
+    return block
+
+def run(depth, prefix):
+    data_dir = tempfile.mkdtemp()
+    try:
+        chain = ChainManager(BlockStore(data_dir), BlockIndexDB(data_dir), ChainStateDB(data_dir))
+        genesis = chain.genesis_block.get_hash().hex()
+
+        # Shared history whose coinbases both branches spend
+        fork = extend(chain, genesis, prefix, "base", [])
+        coinbases = []
+        entry = chain.block_tree.tip
+        while entry.height > 0:
+            coinbases.append(chain.get_block_by_hash(entry.hash).vtx[0].get_hash().hex())
+            entry = entry.parent
+        fork_hash = fork.get_hash().hex()
+
+        extend(chain, fork_hash, depth, "main", coinbases[:depth])
+        side_tip = extend(chain, fork_hash, depth, "side", coinbases[:depth])
+        trigger = make_block(side_tip.get_hash().hex(), "trigger")
+
+        start = time.perf_counter()
+        success, reason = chain.process_block(trigger)
+        elapsed = time.perf_counter() - start
+        assert (success, reason) == (True, "Reorg Success"), reason
+        assert chain.block_tree.tip.hash == trigger.get_hash().hex()
+        return elapsed
+    finally:
+        shutil.rmtree(data_dir)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--depths", default="1,10,100")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    print("depth  disconnect  connect   reorg time   per block")
+    for depth in [int(d) for d in args.depths.split(",")]:
+        elapsed = run(depth, prefix=max(depth, 1))
+        per_block = elapsed / (2 * depth + 1)
+        print(f"{depth:5d}  {depth:10d}  {depth + 1:7d}  {elapsed * 1000:9.1f} ms  {per_block * 1000:7.2f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Signature verification throughput (sigs/sec) vs. worker process count.
+
+Builds a batch of signed P2PKH inputs and runs them through the same
+run_script_checks() path validate_block uses.
+
+Usage: python benchmarks/bench_sigverify.py [--inputs 400] [--max-workers N]
+"""
+import os
+import sys
+import time
+import argparse
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import ecdsa
+from icsicoin.core.primitives import Transaction, TxIn, TxOut
+from icsicoin.consensus.script import signature_hash, hash160
+from icsicoin.consensus.validation import run_script_checks, _run_script_checks_inline
+
+def build_checks(n_inputs, inputs_per_tx=10):
+    sk = ecdsa.SigningKey.generate(curve=ecdsa.SECP256k1)
+    pub = sk.verifying_key.to_string()
+    script = b'\x76\xa9\x14' + hash160(pub) + b'\x88\xac'
+
+    checks = []
+    for t in range((n_inputs + inputs_per_tx - 1) // inputs_per_tx):
+        count = min(inputs_per_tx, n_inputs - t * inputs_per_tx)
+        prev = hashlib.sha256(str(t).encode()).digest()
+        tx = Transaction(vin=[TxIn(prev, i) for i in range(count)], vout=[TxOut(1000, script)])
+        for i in range(count):
+            sig = sk.sign_digest(signature_hash(tx, i, script), sigencode=ecdsa.util.sigencode_der_canonize) + b'\x01'
+            tx.vin[i].script_sig = bytes([len(sig)]) + sig + bytes([len(pub)]) + pub
+        checks.extend((tx, i, script) for i in range(count))
+    return checks
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--inputs", type=int, default=400)
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    print(f"Signing {args.inputs} inputs...")
+    checks = build_checks(args.inputs)
+
+    start = time.perf_counter()
+    ok, reason = _run_script_checks_inline(checks)
+    elapsed = time.perf_counter() - start
+    assert ok, reason
+    print(f"inline        : {len(checks) / elapsed:8.1f} sigs/sec")
+
+    worker_counts = sorted({2 ** i for i in range(args.max_workers.bit_length()) if 2 ** i <= args.max_workers} | {args.max_workers})
+    ctx = multiprocessing.get_context('spawn')
+    for workers in worker_counts:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+            run_script_checks(checks[:workers * 2], executor=pool, workers=workers)  # spawn + warm up
+            start = time.perf_counter()
+            ok, reason = run_script_checks(checks, executor=pool, workers=workers)
+            elapsed = time.perf_counter() - start
+        assert ok, reason
+        print(f"{workers:2d} worker(s)  : {len(checks) / elapsed:8.1f} sigs/sec")
+
+if __name__ == "__main__":
+    main()
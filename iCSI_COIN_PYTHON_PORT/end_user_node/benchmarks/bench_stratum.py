@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+Stratum server fan-out and share throughput.
+
+Starts a StratumServer over a fresh chain (temporary data directory) and
+connects --miners simulated miners on localhost. The miners run on their own
+thread and event loop so the server's loop only does the node's work. Measures:
+
+  fan-out  - time from a tip change until every miner has the new job
+  shares   - accepted shares/s with every miner keeping one submission in flight
+             (share difficulty 1, so each submission costs the node one scrypt)
+  loop lag - how late a 10 ms timer on the server's loop fires while the shares
+             come in, which is how late peer messages and RPC are handled too
+
+Usage: python benchmarks/bench_stratum.py [--miners 300] [--shares 3000]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import logging
+import argparse
+import tempfile
+import threading
+import statistics
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from icsicoin.core.chain import ChainManager
+from icsicoin.core.mempool import Mempool
+from icsicoin.mining.notify import WorkNotifier
+from icsicoin.mining.stratum import StratumServer
+from icsicoin.mining.template import TemplateCache
+from icsicoin.storage.blockstore import BlockStore
+from icsicoin.storage.databases import BlockIndexDB, ChainStateDB
+from icsicoin.wallet.wallet import Wallet
+
+class SimMiner:
+    def __init__(self, index):
+        self.index = index
+        self.reader = None
+        self.writer = None
+        self.job = None
+        self.job_received = asyncio.Event()
+        self.answered = asyncio.Event()
+        self.next_id = 0
+
+    async def connect(self, port):
+        self.reader, self.writer = await asyncio.open_connection('127.0.0.1', port)
+        self.send('mining.subscribe', [])
+        self.send('mining.authorize', [f"sim.{self.index}", "x"])
+        await self.writer.drain()
+
+    def send(self, method, params):
+        self.next_id += 1
+        self.writer.write((json.dumps({"id": self.next_id, "method": method, "params": params}) + "\n").encode())
+
+    async def read_loop(self, answers):
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                return
+            message = json.loads(line)
+            if message.get('method') == 'mining.notify':
+                self.job = message['params']
+                self.job_received.set()
+            elif message.get('id') and message['id'] > 2:
+                answers.append(message.get('result'))
+                self.answered.set()
+
+    async def submit(self, nonce):
+        self.answered.clear()
+        self.send('mining.submit', [f"sim.{self.index}", self.job[0], '00' * 4, self.job[7], nonce])
+        await self.writer.drain()
+        await self.answered.wait()
+
+async def drive(args, port, tip_changed, sampling):
+    """Client side, on its own loop: connect the miners, time the fan-out, then flood shares."""
+    miners = [SimMiner(i) for i in range(args.miners)]
+    answers = []
+    for miner in miners:
+        await miner.connect(port)
+    readers = [asyncio.create_task(m.read_loop(answers)) for m in miners]
+    await asyncio.gather(*(m.job_received.wait() for m in miners))
+
+    # Fan-out: a new tip reaches everyone
+    for miner in miners:
+        miner.job_received.clear()
+    start = time.perf_counter()
+    tip_changed()
+    await asyncio.gather(*(m.job_received.wait() for m in miners))
+    fanout = time.perf_counter() - start
+
+    # Shares: every miner keeps one submission in flight until --shares have been answered
+    nonces = iter(range(1, args.shares + 1))
+    async def mine(miner):
+        for nonce in nonces:
+            await miner.submit(nonce)
+    sampling.set()
+    start = time.perf_counter()
+    await asyncio.gather(*(mine(m) for m in miners))
+    elapsed = time.perf_counter() - start
+    sampling.clear()
+    accepted = sum(1 for a in answers if a)
+
+    for task in readers:
+        task.cancel()
+    for miner in miners:
+        miner.writer.close()
+    return fanout, accepted, len(answers), elapsed
+
+async def sample_lag(lags, sampling, interval=0.01):
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        if sampling.is_set():
+            lags.append(time.perf_counter() - start - interval)
+
+async def run(args, data_dir):
+    chain = ChainManager(BlockStore(data_dir), BlockIndexDB(data_dir), ChainStateDB(data_dir))
+    mempool = Mempool()
+    notifier = WorkNotifier()
+    notifier.start()
+    server = StratumServer(0, chain, TemplateCache(chain, mempool), notifier, Wallet(data_dir),
+                           bind_address='127.0.0.1', share_difficulty=1)
+    await server.start()
+    port = server.server.sockets[0].getsockname()[1]
+
+    loop = asyncio.get_running_loop()
+    done = loop.create_future()
+    sampling = threading.Event()
+    lags = []
+    sampler = asyncio.create_task(sample_lag(lags, sampling))
+
+    def client():
+        tip_changed = lambda: loop.call_soon_threadsafe(notifier.on_tip_changed, chain.block_tree.tip)
+        result = asyncio.run(drive(args, port, tip_changed, sampling))
+        loop.call_soon_threadsafe(done.set_result, result)
+    threading.Thread(target=client, daemon=True).start()
+    fanout, accepted, answered, elapsed = await done
+
+    sampler.cancel()
+    notifier.close()
+    await server.stop()
+    lags.sort()
+    return fanout, accepted, answered, elapsed, (statistics.mean(lags), lags[int(len(lags) * 0.99)], lags[-1])
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--miners", type=int, default=300)
+    parser.add_argument("--shares", type=int, default=3000, help="Share submissions to time")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    data_dir = tempfile.mkdtemp()
+    try:
+        fanout, accepted, answered, elapsed, (mean, p99, worst) = asyncio.run(run(args, data_dir))
+    finally:
+        shutil.rmtree(data_dir)
+    print(f"{args.miners} miners")
+    print(f"  job fan-out after new tip : {fanout * 1000:8.1f} ms")
+    print(f"  shares                    : {answered} answered ({accepted} accepted) in {elapsed:.2f} s, "
+          f"{answered / elapsed:.0f} shares/s")
+    print(f"  server loop lag (shares)  : mean {mean * 1000:.2f} ms, p99 {p99 * 1000:.2f} ms, max {worst * 1000:.2f} ms")
+
+if __name__ == "__main__":
+    main()
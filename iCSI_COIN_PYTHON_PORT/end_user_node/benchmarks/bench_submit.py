@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Cost of handing a solved block to the node: submitblock vs submitsolution.
+
+Builds a template over a mempool of --count transactions and, for one solved
+header, times both sides of each submission path (block validation excluded):
+
+  submitblock    - miner decodes the template's transactions and hex-encodes
+                   the full block; node hex-decodes and parses it again
+  submitsolution - miner sends (template_id, nonce, timestamp, extranonce);
+                   node rebuilds the block from its TemplateCache
+
+and the JSON request size of each.
+
+Usage: python benchmarks/bench_submit.py [--count 2000] [--rounds 20]
+"""
+import io
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import binascii
+from unittest.mock import MagicMock
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from icsicoin.core.primitives import Block, Transaction, TxIn, TxOut
+from icsicoin.core.mempool import Mempool
+from icsicoin.mining.template import TemplateCache
+from icsicoin.mining.work import WorkTemplate
+
+def timed(func, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        result = func()
+    return (time.perf_counter() - start) / rounds, result
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--count", type=int, default=2000, help="Mempool transactions in the template")
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    mempool = Mempool()
+    for i in range(args.count):
+        tx = Transaction(vin=[TxIn(i.to_bytes(32, 'little'), 0, b'\x51' * 100)], vout=[TxOut(1000, b'\x51' * 25)])
+        mempool.add_transaction(tx, fee=1000 + i)
+    chain_manager = MagicMock()
+    chain_manager.block_index.get_best_block.return_value = {'height': 100, 'block_hash': '00' * 32}
+    templates = TemplateCache(chain_manager, mempool)
+    template = templates.get_template('11' * 20)
+    # The miner sees the template as JSON, like over RPC
+    work = WorkTemplate(json.loads(json.dumps(template)))
+    header, coinbase = work.next_work()
+    header.nonce = 42
+
+    def miner_block():
+        block = work.build_block(header, coinbase)
+        return json.dumps({"method": "submitblock", "params": [binascii.hexlify(block.serialize()).decode()]})
+    def node_block(payload):
+        return Block.deserialize(io.BytesIO(binascii.unhexlify(json.loads(payload)['params'][0])))
+    def miner_solution():
+        return json.dumps({"method": "submitsolution", "params": work.solution_params(header, coinbase)})
+    def node_solution(payload):
+        template_id, nonce, timestamp, extranonce = json.loads(payload)['params']
+        return templates.build_block(template_id, nonce, timestamp, bytes.fromhex(extranonce))[0]
+
+    print(f"Template with {len(template['transactions'])} transactions")
+    for name, miner_side, node_side in (("submitblock", miner_block, node_block),
+                                        ("submitsolution", miner_solution, node_solution)):
+        miner_time, payload = timed(miner_side, args.rounds)
+        node_time, block = timed(lambda: node_side(payload), args.rounds)
+        assert block.get_hash() == Block(header, []).get_hash() and len(block.vtx) == len(template['transactions'])
+        print(f"  {name:15s}: request {len(payload):9d} bytes | miner {miner_time * 1000:7.2f} ms | "
+              f"node {node_time * 1000:7.2f} ms | total {(miner_time + node_time) * 1000:7.2f} ms")
+
+if __name__ == "__main__":
+    main()
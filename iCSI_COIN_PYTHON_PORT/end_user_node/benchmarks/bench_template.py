@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Block template assembly from a full mempool.
+
+Fills a Mempool with --count transactions with random fees, a share of them
+arranged as parent/child chains where a low-fee parent is paid for by its child.
+Times select_transactions() and compares the fees collected in a --block-size
+template with taking transactions in arrival order (the old behaviour).
+
+Usage: python benchmarks/bench_template.py [--count 20000] [--chain-share 0.3] [--block-size 200000]
+"""
+import os
+import sys
+import time
+import random
+import logging
+import argparse
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from icsicoin.core.primitives import Transaction, TxIn, TxOut
+from icsicoin.core.mempool import Mempool
+
+def fill(mempool, count, chain_share, rng):
+    i = 0
+    while i < count:
+        parent = Transaction(vin=[TxIn(i.to_bytes(32, 'little'), 0)], vout=[TxOut(1000, b'\x51')])
+        if rng.random() < chain_share:
+            mempool.add_transaction(parent, fee=rng.randint(0, 200))
+            child = Transaction(vin=[TxIn(parent.get_hash(), 0)], vout=[TxOut(900, b'\x51')])
+            mempool.add_transaction(child, fee=rng.randint(5000, 20000))
+            i += 2
+        else:
+            mempool.add_transaction(parent, fee=rng.randint(100, 10000))
+            i += 1
+
+def arrival_order_fees(mempool, max_size):
+    fees = 0
+    for entry in sorted(mempool.entries.values(), key=lambda e: e.sequence):
+        if entry.size > max_size:
+            break
+        max_size -= entry.size
+        fees += entry.fee
+    return fees
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--count", type=int, default=20000)
+    parser.add_argument("--chain-share", type=float, default=0.3, help="Fraction of parents given a fee-paying child")
+    parser.add_argument("--block-size", type=int, default=200000, help="Template size budget in bytes")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    mempool = Mempool()
+    fill(mempool, args.count, args.chain_share, random.Random(1))
+
+    start = time.perf_counter()
+    selected = mempool.select_transactions(args.block_size)
+    elapsed = time.perf_counter() - start
+
+    fees = sum(e.fee for e in selected)
+    fifo = arrival_order_fees(mempool, args.block_size)
+    print(f"{len(mempool.entries)} mempool txs, {args.block_size} byte template")
+    print(f"  select_transactions : {elapsed * 1000:8.1f} ms, {len(selected)} txs")
+    print(f"  fees (package rate) : {fees}")
+    print(f"  fees (arrival order): {fifo}  ({fees / max(fifo, 1):.1f}x)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Block sync over the wire: binary payloads vs the legacy JSON bridge.
+
+Serves --blocks blocks (each with --txs transactions) from a local TCP server
+and syncs them the way NetworkManager does: getblocks -> inv -> getdata -> one
+block message per block, with each block deserialized on arrival. Validation
+is left out so only the wire format differs between the two runs. Reports
+bytes on the wire, messages per second and sync time for each format.
+
+Usage: python benchmarks/bench_wire.py [--blocks 500] [--txs 20]
+"""
+import io
+import os
+import sys
+import time
+import asyncio
+import logging
+import argparse
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from icsicoin.core.primitives import Block, BlockHeader, Transaction, TxIn, TxOut
+from icsicoin.network.messages import Message, InvMessage, GetDataMessage, BlockMessage, GetBlocksMessage
+
+def make_chain(count, txs_per_block):
+    blocks = []
+    prev = b'\x00' * 32
+    for height in range(count):
+        vtx = [Transaction(vin=[TxIn(b'\x00' * 32, 0xffffffff, str(height).encode())], vout=[TxOut(50, b'\x51' * 25)])]
+        for i in range(txs_per_block):
+            seed = (height * 1000 + i).to_bytes(32, 'little')
+            vtx.append(Transaction(vin=[TxIn(seed, 0, b'\x30' * 107)],
+                                   vout=[TxOut(1000, b'\x76' * 25), TxOut(2000, b'\x76' * 25)]))
+        block = Block(BlockHeader(1, prev, b'\x11' * 32, 1700000000 + height, 0x1f099996, height), vtx)
+        prev = block.get_hash()
+        blocks.append(block)
+    return blocks
+
+async def read_message(reader, counter):
+    header = await reader.readexactly(24)
+    _, command, length, _ = Message.parse_header(header)
+    payload = await reader.readexactly(length) if length else b''
+    counter[0] += 24 + length
+    return command, payload
+
+async def sync(blocks, binary):
+    raw = {b.get_hash().hex(): b.serialize() for b in blocks}
+    hashes = list(raw)
+    served = asyncio.Event()
+
+    async def serve(reader, writer):
+        counter = [0]
+        try:
+            while True:
+                command, payload = await read_message(reader, counter)
+                if command == 'getblocks':
+                    GetBlocksMessage.parse(payload, binary)
+                    writer.write(InvMessage([{"type": "block", "hash": h} for h in hashes], binary).serialize())
+                elif command == 'getdata':
+                    for item in GetDataMessage.parse(payload, binary):
+                        writer.write(BlockMessage(raw[item['hash']], binary).serialize())
+                        await writer.drain()
+        except asyncio.IncompleteReadError:
+            pass
+        finally:
+            writer.close()
+            served.set()
+
+    server = await asyncio.start_server(serve, '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    received, sent, messages = [0], 0, 0
+
+    start = time.perf_counter()
+    out = GetBlocksMessage([hashes[0]], binary).serialize()
+    writer.write(out)
+    sent += len(out)
+    command, payload = await read_message(reader, received)
+    messages += 1
+    inventory = InvMessage.parse(payload, binary)
+    out = GetDataMessage(inventory, binary).serialize()
+    writer.write(out)
+    sent += len(out)
+    for item in inventory:
+        command, payload = await read_message(reader, received)
+        messages += 1
+        block = Block.deserialize(io.BytesIO(BlockMessage.parse(payload, binary)))
+        assert block.get_hash().hex() == item['hash']
+    elapsed = time.perf_counter() - start
+
+    writer.close()
+    await served.wait()
+    server.close()
+    await server.wait_closed()
+    return sent + received[0], messages + 2, elapsed
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--blocks", type=int, default=500)
+    parser.add_argument("--txs", type=int, default=20, help="Transactions per block besides the coinbase")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    blocks = make_chain(args.blocks, args.txs)
+    chain_bytes = sum(len(b.serialize()) for b in blocks)
+    print(f"{args.blocks} blocks, {args.txs + 1} txs each, {chain_bytes / 1e6:.2f} MB serialized")
+    results = {}
+    for name, binary in (("json", False), ("binary", True)):
+        results[name] = wire, messages, elapsed = asyncio.run(sync(blocks, binary))
+        print(f"  {name:6s}: {wire / 1e6:7.2f} MB on the wire | {messages / elapsed:8.0f} msg/s | sync {elapsed * 1000:7.1f} ms")
+    json_wire, _, json_time = results["json"]
+    bin_wire, _, bin_time = results["binary"]
+    print(f"  binary: {bin_wire / json_wire:.2f}x the bytes, {json_time / bin_time:.1f}x faster")
+
+if __name__ == "__main__":
+    main()
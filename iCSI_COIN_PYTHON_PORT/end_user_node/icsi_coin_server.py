@@ -44,6 +44,9 @@ async def main():
     parser.add_argument("--rpcallowip", default="127.0.0.1", help="Allow JSON-RPC connections from specified IP address")
     parser.add_argument("--rpcthreads", type=int, default=4, help="Set the number of threads to service RPC calls")
     
+    # Mining Options
+    parser.add_argument("--stratum-port", type=int, help="Serve stratum-style mining on <port> (e.g., 3333)")
+
     # Web Config Options
     parser.add_argument("--web-port", type=int, help="Port to serve the web configuration interface (e.g., 8080)")
 
@@ -51,6 +54,10 @@ async def main():
     args = parser.parse_args()
     
     logger.info(f"Starting iCSI Coin Node on port {args.port}")
+
+    # Pick the scrypt backend now (a short benchmark) rather than on the first block
+    from icsicoin.consensus import proof_of_work
+    logger.info(f"Proof-of-work scrypt backend: {proof_of_work.select_backend()}")
     
     # Init Network Manager (which inits Chain & Mempool)
     network_manager = NetworkManager(
@@ -79,6 +86,22 @@ async def main():
     )
     if args.rpcport:
         await rpc_server.start()
+
+    # Init Stratum Server (shares the RPC server's template cache and work notifications)
+    stratum_server = None
+    if args.stratum_port:
+        from icsicoin.mining.stratum import StratumServer
+        stratum_server = StratumServer(
+            port=args.stratum_port,
+            chain_manager=network_manager.chain_manager,
+            templates=rpc_server.templates,
+            notifier=rpc_server.notifier,
+            wallet=wallet,
+            network_manager=network_manager,
+            bind_address=args.bind
+        )
+        await stratum_server.start()
+    network_manager.stratum_server = stratum_server # Attach for WebServer stats
         
     web_server = None
     if args.web_port:
@@ -95,6 +118,8 @@ async def main():
             await asyncio.sleep(3600)
     except asyncio.CancelledError:
         logger.info("Node stopping...")
+        if stratum_server:
+            await stratum_server.stop()
         if rpc_server:
             await rpc_server.stop()
         if web_server:
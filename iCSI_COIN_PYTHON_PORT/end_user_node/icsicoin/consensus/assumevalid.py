@@ -0,0 +1,33 @@
+import os
+import logging
+
+logger = logging.getLogger("AssumeValid")
+
+# Built-in assume-valid block, bumped each release to a main-chain block buried well
+# below the tip at release time. Still the genesis block, so nothing is assumed by default.
+DEFAULT_ASSUME_VALID_BLOCK = '0b3b4f0815e0324c866dece998eedcd4b3e82ca0afdb5e8f7baef34a007b53e3'
+
+# Override with ASSUME_VALID_BLOCK=<hash>, or '0' to disable.
+ASSUME_VALID_BLOCK = os.getenv('ASSUME_VALID_BLOCK', DEFAULT_ASSUME_VALID_BLOCK)
+
+class AssumeValid:
+    """
+    Decides which blocks may be connected without signature checks.
+
+    A block is covered only when the assume-valid block is already in the block
+    tree and the block is one of its ancestors (or the block itself). While it is
+    unknown the node fetches headers ahead of bodies (ChainManager.accept_headers,
+    which checks each header's bits and proof of work), so during sync it is known
+    before the blocks under it arrive; until then everything is fully verified.
+    Amounts, double spends, merkle roots and the UTXO set are always fully processed.
+    """
+    def __init__(self, block_hash=ASSUME_VALID_BLOCK):
+        self.block_hash = block_hash if block_hash and block_hash != '0' else None
+        self.skipped = 0 # Blocks connected without signature checks
+
+    def covers(self, block_tree, entry):
+        """True if `entry` may skip signature checks when it is connected."""
+        if self.block_hash is None:
+            return False
+        target = block_tree.entries.get(self.block_hash)
+        return target is not None and block_tree.get_ancestor(target, entry.height) is entry
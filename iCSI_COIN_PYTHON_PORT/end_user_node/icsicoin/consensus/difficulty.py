@@ -0,0 +1,93 @@
+import logging
+
+from icsicoin.consensus.validation import (
+    DIFFICULTY_ADJUSTMENT_INTERVAL, GENESIS_BITS, bits_to_target, retarget_bits
+)
+
+logger = logging.getLogger("Difficulty")
+
+# Difficulty 1 target (compact 0x1d00ffff), same reference as BlockHeader.difficulty
+DIFF1_TARGET = 0xffff * (256**(0x1d - 3))
+
+def bits_to_difficulty(bits):
+    """Difficulty relative to the 0x1d00ffff target."""
+    target = bits_to_target(bits)
+    if target == 0:
+        return 0
+    return DIFF1_TARGET / target
+
+def get_block_proof(bits):
+    """Expected number of hashes to find a block at `bits`; summed along a branch to give its chainwork."""
+    target = bits_to_target(bits)
+    return (1 << 256) // (target + 1)
+
+class DifficultyCache:
+    """
+    In-memory retarget data for the active chain.
+
+    Retargeting only ever looks at the first and last block of each 2016-block
+    period, so those headers' (timestamp, bits) are all we keep. Entries are
+    filled from connected blocks, or read once from disk on first use, and
+    dropped when the blocks at or above a height are disconnected.
+    """
+    def __init__(self, chain_manager):
+        self.chain_manager = chain_manager
+        self.boundaries = {} # height -> (timestamp, bits), first/last block of each period
+
+    @staticmethod
+    def is_boundary(height):
+        return height % DIFFICULTY_ADJUSTMENT_INTERVAL in (0, DIFFICULTY_ADJUSTMENT_INTERVAL - 1)
+
+    def _boundary(self, height, branch=None):
+        if branch is not None:
+            block = branch(height)
+            if block is not None:
+                return (block.timestamp, block.bits)
+        entry = self.boundaries.get(height)
+        if entry is None:
+            header = self.chain_manager.get_block_header(height)
+            if header is None:
+                return None
+            entry = (header.timestamp, header.bits)
+            self.boundaries[height] = entry
+        return entry
+
+    def get_next_bits(self, height, branch=None):
+        """
+        Expected 'bits' for the block at `height` (see calculate_next_bits).
+        branch: optional height -> header lookup for a side branch being connected;
+        heights it returns None for are answered from the active chain.
+        """
+        if height < DIFFICULTY_ADJUSTMENT_INTERVAL:
+            return GENESIS_BITS
+
+        last_retarget_height = (height // DIFFICULTY_ADJUSTMENT_INTERVAL) * DIFFICULTY_ADJUSTMENT_INTERVAL
+
+        if height != last_retarget_height:
+            retarget = self._boundary(last_retarget_height, branch)
+            return retarget[1] if retarget else GENESIS_BITS
+
+        period_start = self._boundary(last_retarget_height - DIFFICULTY_ADJUSTMENT_INTERVAL, branch)
+        period_end = self._boundary(last_retarget_height - 1, branch)
+        if not period_start or not period_end:
+            return GENESIS_BITS
+
+        return retarget_bits(period_start[0], period_end[0], period_end[1])
+
+    def get_current_difficulty(self):
+        """Difficulty a miner faces for the next block on the current tip."""
+        height = self.chain_manager.get_best_height()
+        return bits_to_difficulty(self.get_next_bits(height + 1))
+
+    def on_block_connected(self, height, header):
+        self._truncate(height)
+        if self.is_boundary(height):
+            self.boundaries[height] = (header.timestamp, header.bits)
+
+    def on_block_disconnected(self, height):
+        self._truncate(height)
+
+    def _truncate(self, height):
+        # Anything cached at or above `height` belonged to the old branch
+        for h in [h for h in self.boundaries if h >= height]:
+            del self.boundaries[h]
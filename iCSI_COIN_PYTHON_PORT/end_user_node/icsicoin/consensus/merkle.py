@@ -27,3 +27,24 @@ def get_merkle_root(transactions):
         hashes = new_hashes
 
     return hashes[0]
+
+def get_merkle_branch(hashes):
+    """
+    Sibling hashes on the path from hashes[0] (the coinbase) up to the root, so the
+    root can be recomputed for a different coinbase without the other transactions.
+    hashes[0] itself is never read.
+    """
+    branch = []
+    level = list(hashes)
+    while len(level) > 1:
+        branch.append(level[1])
+        if len(level) % 2 != 0:
+            level.append(level[-1])
+        level = [double_sha256(level[i] + level[i+1]) for i in range(0, len(level), 2)]
+    return branch
+
+def get_merkle_root_from_branch(leaf, branch):
+    """Merkle root for a first-transaction hash `leaf` and its get_merkle_branch()."""
+    for sibling in branch:
+        leaf = double_sha256(leaf + sibling)
+    return leaf
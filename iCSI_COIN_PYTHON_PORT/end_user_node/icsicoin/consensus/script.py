@@ -1,6 +1,10 @@
 import hashlib
+import logging
 from ecdsa import VerifyingKey, SECP256k1, BadSignatureError
 from ecdsa.util import sigdecode_der
+from icsicoin.consensus.sighash import SighashCache, SIGHASH_ALL, signature_hash
+
+logger = logging.getLogger("Script")
 
 # OPCodes
 OP_DUP = 0x76
@@ -17,8 +21,11 @@ def hash160(data):
     return h.digest()
 
 class ScriptEngine:
-    def __init__(self):
+    def __init__(self, sighash_cache=None):
         self.stack = []
+        self.script_code = b''
+        # Optional SighashCache for `transaction`, shared across its inputs
+        self.sighash_cache = sighash_cache
 
     def evaluate(self, script_sig, script_pubkey, transaction, vin_index):
         """
@@ -31,6 +38,7 @@ class ScriptEngine:
         # We assume standard P2PKH script_sig: [Sig Length][Sig][PubKey Length][PubKey]
         
         self.stack = []
+        self.script_code = bytes(script_pubkey)
         try:
             self._execute_push_only(script_sig)
         except Exception as e:
@@ -89,20 +97,22 @@ class ScriptEngine:
             i += length
 
     def _check_sig(self, sig_bytes, pubkey_bytes, transaction, vin_index):
-        # Full SIGHASH implementation deferred.
-        # Strict signature format check for now.
+        # Signature layout: <DER sig><1-byte hash type>, as produced by the wallet.
+        if transaction is None or len(sig_bytes) < 2:
+            return False
+
+        hash_type = sig_bytes[-1]
+        if hash_type != SIGHASH_ALL:
+            return False
+
         try:
-            vk = VerifyingKey.from_string(pubkey_bytes, curve=SECP256k1)
-            # This verifies the signature format is valid DER for SECP256k1
-            # Actual content verification against tx hash will be added in later phase
-            # sigdecode_der returns (r, s)
-            r, s = sigdecode_der(sig_bytes, SECP256k1.order)
-            return True
+            vk = VerifyingKey.from_string(bytes(pubkey_bytes), curve=SECP256k1)
+            if self.sighash_cache is None or self.sighash_cache.transaction is not transaction:
+                self.sighash_cache = SighashCache(transaction)
+            sighash = self.sighash_cache.signature_hash(vin_index, self.script_code, hash_type)
+            return vk.verify_digest(bytes(sig_bytes[:-1]), sighash, sigdecode=sigdecode_der)
         except BadSignatureError:
-            print("BadSignatureError")
             return False
         except Exception as e:
-            print(f"CheckSig Error: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.debug(f"CheckSig Error (input {vin_index}): {e}")
             return False
@@ -0,0 +1,73 @@
+import os
+import hashlib
+import struct
+import threading
+from collections import OrderedDict
+
+# Maximum number of verified (txid, input, script) entries kept in memory.
+# Each entry is a 32-byte digest plus dict overhead (~150 bytes total).
+SIG_CACHE_MAX_ENTRIES = int(os.getenv('SIG_CACHE_MAX_ENTRIES', 50000))
+
+class SignatureCache:
+    """
+    Bounded cache of script checks that already passed.
+
+    Transactions relayed to us are verified once on mempool acceptance; when the
+    block containing them arrives, validate_block finds them here and skips ECDSA.
+    Keys are salted with a per-process random value so a peer cannot craft
+    collisions against a known key layout.
+    """
+    def __init__(self, max_entries=SIG_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.salt = os.urandom(32)
+        self.entries = OrderedDict() # key -> None (insertion order = eviction order)
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def _key(self, tx_hash, vin_index, script_pubkey):
+        h = hashlib.sha256(self.salt)
+        h.update(tx_hash)
+        h.update(struct.pack('<I', vin_index))
+        h.update(script_pubkey)
+        return h.digest()
+
+    def contains(self, tx_hash, vin_index, script_pubkey, erase=False):
+        """
+        Check whether this input was already verified.
+        Block validation passes erase=True since a confirmed input is never checked again.
+        """
+        key = self._key(tx_hash, vin_index, script_pubkey)
+        with self.lock:
+            if key in self.entries:
+                self.hits += 1
+                if erase:
+                    del self.entries[key]
+                return True
+            self.misses += 1
+            return False
+
+    def add(self, tx_hash, vin_index, script_pubkey):
+        key = self._key(tx_hash, vin_index, script_pubkey)
+        with self.lock:
+            self.entries[key] = None
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def get_stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits / lookups) if lookups else 0.0
+            }
+
+# Shared between mempool acceptance and block validation
+signature_cache = SignatureCache()
@@ -0,0 +1,62 @@
+import hashlib
+import struct
+from icsicoin.core.serialization import encode_uint32, encode_varint, encode_varstr, serialize_list
+
+# Signature hash types
+SIGHASH_ALL = 0x01
+
+class SighashCache:
+    """
+    SIGHASH_ALL preimages for every input of one transaction.
+
+    The legacy preimage is the whole transaction with all input scripts blanked
+    except the one being signed, so rebuilding it per input is O(n^2) in input
+    count. Here the shared parts (version, blanked outpoints, outputs, locktime)
+    are serialized once and each input's preimage is spliced together from
+    views into that buffer. The SHA256 state over the leading blanked inputs is
+    carried forward, so signing/verifying inputs in order hashes that prefix once.
+    """
+    def __init__(self, transaction):
+        self.transaction = transaction
+        self.prefix = encode_uint32(transaction.version) + encode_varint(len(transaction.vin))
+
+        # Each input with an empty script (varstr length 0x00), back to back
+        blanks = []
+        self.offsets = [0]
+        for txin in transaction.vin:
+            blank = txin.prev_hash + encode_uint32(txin.prev_index) + b'\x00' + encode_uint32(txin.sequence)
+            blanks.append(blank)
+            self.offsets.append(self.offsets[-1] + len(blank))
+        self.blank_inputs = memoryview(b''.join(blanks))
+
+        self.suffix = serialize_list(transaction.vout, lambda x: x.serialize()) + encode_uint32(transaction.locktime)
+
+        self._midstate = None
+        self._midstate_pos = 0
+
+    def _prefix_state(self, vin_index):
+        """SHA256 state after the version, count and blanked inputs before vin_index."""
+        start = self.offsets[vin_index]
+        if self._midstate is None or self._midstate_pos > start:
+            self._midstate = hashlib.sha256(self.prefix)
+            self._midstate_pos = 0
+        if self._midstate_pos < start:
+            self._midstate.update(self.blank_inputs[self._midstate_pos:start])
+            self._midstate_pos = start
+        return self._midstate.copy()
+
+    def signature_hash(self, vin_index, script_code, hash_type=SIGHASH_ALL):
+        txin = self.transaction.vin[vin_index]
+        h = self._prefix_state(vin_index)
+        h.update(txin.prev_hash)
+        h.update(encode_uint32(txin.prev_index))
+        h.update(encode_varstr(script_code))
+        h.update(encode_uint32(txin.sequence))
+        h.update(self.blank_inputs[self.offsets[vin_index + 1]:])
+        h.update(self.suffix)
+        h.update(struct.pack("<I", hash_type))
+        return hashlib.sha256(h.digest()).digest()
+
+def signature_hash(transaction, vin_index, script_code, hash_type=SIGHASH_ALL):
+    """One-off SIGHASH_ALL digest. Use SighashCache when hashing several inputs."""
+    return SighashCache(transaction).signature_hash(vin_index, script_code, hash_type)
@@ -1,7 +1,15 @@
 import time
+import io
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from icsicoin.consensus.merkle import get_merkle_root
-# scrypt import will be needed for PoW check, assuming standard library or installed module
-import scrypt 
+from icsicoin.consensus.script import ScriptEngine
+from icsicoin.consensus.sighash import SighashCache
+from icsicoin.consensus.sigcache import signature_cache
+from icsicoin.core.primitives import Transaction
+from icsicoin.core.coins import UTXOView
+from icsicoin.consensus.proof_of_work import hash_header
 
 def validate_block_header(header, prev_block_index_entry):
     """
@@ -15,12 +23,10 @@ def validate_block_header(header, prev_block_index_entry):
     
     # 2. Check Proof of Work
     # Scrypt hash must be < Target (derived from header.bits)
-    # Using hardcoded parameters for scrypt (N=1024, r=1, p=1) typical for Litecoin/iCSI?
-    # Actually need to check legacy code for parameters.
-    # Litecoin uses N=1024, r=1, p=1.
+    # Litecoin parameters (N=1024, r=1, p=1); see proof_of_work for the backends
     
     header_bytes = header.serialize()
-    pow_hash = scrypt.hash(header_bytes, header_bytes, N=1024, r=1, p=1, buflen=32)
+    pow_hash = hash_header(header_bytes)
     
     # Convert bits to target
     target = bits_to_target(header.bits)
@@ -75,6 +81,12 @@ def calculate_next_bits(chain_manager, height):
     # For heights before the first retarget, use genesis bits
     if height < DIFFICULTY_ADJUSTMENT_INTERVAL:
         return GENESIS_BITS
+
+    # Fast path: answer from the chain's in-memory header cache
+    from icsicoin.consensus.difficulty import DifficultyCache
+    cache = getattr(chain_manager, 'difficulty', None)
+    if isinstance(cache, DifficultyCache):
+        return cache.get_next_bits(height)
     
     # Find which retarget period we're in
     last_retarget_height = (height // DIFFICULTY_ADJUSTMENT_INTERVAL) * DIFFICULTY_ADJUSTMENT_INTERVAL
@@ -98,8 +110,16 @@ def calculate_next_bits(chain_manager, height):
     if not period_start_block or not period_end_block:
         return GENESIS_BITS
     
+    return retarget_bits(
+        period_start_block.header.timestamp,
+        period_end_block.header.timestamp,
+        period_end_block.header.bits
+    )
+
+def retarget_bits(period_start_time, period_end_time, period_end_bits):
+    """New bits for a retarget block, from the timestamps bounding the previous period."""
     # Calculate actual timespan
-    actual_timespan = period_end_block.header.timestamp - period_start_block.header.timestamp
+    actual_timespan = period_end_time - period_start_time
     
     # Clamp: no more than 4× easier, no more than ¼× harder
     if actual_timespan < EXPECTED_TIMESPAN // 4:
@@ -108,7 +128,7 @@ def calculate_next_bits(chain_manager, height):
         actual_timespan = EXPECTED_TIMESPAN * 4
     
     # Calculate new target
-    old_target = bits_to_target(period_end_block.header.bits)
+    old_target = bits_to_target(period_end_bits)
     new_target = (old_target * actual_timespan) // EXPECTED_TIMESPAN
     
     # Don't exceed genesis target (can't get easier than starting difficulty)
@@ -122,9 +142,129 @@ import logging
 
 logger = logging.getLogger("Validation")
 
-def validate_block(block, utxo_set):
+# ────── Script Verification ──────
+# ECDSA verification in pure Python costs a few ms per input, so a block's script
+# checks are collected during validation and fanned out across a process pool.
+SCRIPT_VERIFY_WORKERS = int(os.getenv('SCRIPT_VERIFY_WORKERS', os.cpu_count() or 1))
+PARALLEL_SCRIPT_MIN_CHECKS = 16   # Below this, IPC overhead outweighs the parallelism
+
+_script_executor = None
+
+def get_script_executor():
+    """Lazily create the shared script verification pool (None if disabled)."""
+    global _script_executor
+    if SCRIPT_VERIFY_WORKERS <= 1:
+        return None
+    if _script_executor is None:
+        try:
+            _script_executor = ProcessPoolExecutor(
+                max_workers=SCRIPT_VERIFY_WORKERS,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        except Exception as e:
+            logger.warning(f"Script verification pool unavailable, verifying inline: {e}")
+            return None
+    return _script_executor
+
+def verify_input_script(tx, vin_index, script_pubkey, sighash_cache=None):
+    """Run the input's script_sig against the script_pubkey of the output it spends."""
+    engine = ScriptEngine(sighash_cache)
+    return engine.evaluate(tx.vin[vin_index].script_sig, script_pubkey, tx, vin_index)
+
+def _verify_script_job(tx_bytes, checks):
+    """
+    Process pool worker: verify a slice of one transaction's inputs.
+    Returns the first failing input index, or None if all pass.
+    """
+    tx = Transaction.deserialize(io.BytesIO(tx_bytes))
+    sighash_cache = SighashCache(tx)
+    for vin_index, script_pubkey in checks:
+        if not verify_input_script(tx, vin_index, script_pubkey, sighash_cache):
+            return vin_index
+    return None
+
+def run_script_checks(checks, executor=None, workers=None):
+    """
+    Verify a batch of deferred script checks.
+    checks: list of (tx, vin_index, script_pubkey).
+    Returns (is_valid, reason).
+    """
+    if not checks:
+        return True, "Valid"
+
+    if executor is None and len(checks) >= PARALLEL_SCRIPT_MIN_CHECKS:
+        executor = get_script_executor()
+
+    if executor is None:
+        return _run_script_checks_inline(checks)
+
+    return collect_script_checks(submit_script_checks(checks, executor, workers), checks, executor)
+
+def submit_script_checks(checks, executor, workers=None):
+    """Queue script checks on the pool without waiting; returns [(tx, future)] for collect_script_checks."""
+    # Group by transaction so each job ships the tx bytes once, then slice large
+    # transactions so a single 500-input consolidation still spreads across workers.
+    workers = workers or SCRIPT_VERIFY_WORKERS
+    slice_size = max(1, -(-len(checks) // (workers * 2)))
+    grouped = {}
+    for tx, vin_index, script_pubkey in checks:
+        grouped.setdefault(id(tx), (tx, []))[1].append((vin_index, script_pubkey))
+
+    futures = []
+    for tx, tx_checks in grouped.values():
+        tx_bytes = tx.serialize()
+        for i in range(0, len(tx_checks), slice_size):
+            fut = executor.submit(_verify_script_job, tx_bytes, tx_checks[i:i + slice_size])
+            futures.append((tx, fut))
+    return futures
+
+def collect_script_checks(futures, checks, executor):
+    """Wait for submitted checks; `checks` is everything submitted, re-run inline if the pool breaks."""
+    try:
+        failed = None
+        for tx, fut in futures:
+            bad_index = fut.result()
+            if bad_index is not None and failed is None:
+                failed = (tx, bad_index)
+    except Exception as e:
+        # Broken pool (e.g. worker killed): drop it so it is rebuilt next time
+        global _script_executor
+        if executor is _script_executor:
+            _script_executor = None
+        logger.error(f"Parallel script verification failed ({e}). Retrying inline.")
+        return _run_script_checks_inline(checks)
+
+    if failed:
+        tx, bad_index = failed
+        return False, f"Script verification failed for {tx.get_hash().hex()}:{bad_index}"
+    return True, "Valid"
+
+def filter_cached_checks(checks, erase=False):
+    """Drop checks already verified (e.g. on mempool acceptance) from a batch."""
+    tx_hashes = {}
+    remaining = []
+    for tx, vin_index, script_pubkey in checks:
+        tx_hash = tx_hashes.get(id(tx))
+        if tx_hash is None:
+            tx_hash = tx_hashes[id(tx)] = tx.get_hash()
+        if not signature_cache.contains(tx_hash, vin_index, script_pubkey, erase=erase):
+            remaining.append((tx, vin_index, script_pubkey))
+    return remaining
+
+def _run_script_checks_inline(checks):
+    sighash_caches = {}
+    for tx, vin_index, script_pubkey in checks:
+        sighash_cache = sighash_caches.get(id(tx))
+        if sighash_cache is None:
+            sighash_cache = sighash_caches[id(tx)] = SighashCache(tx)
+        if not verify_input_script(tx, vin_index, script_pubkey, sighash_cache):
+            return False, f"Script verification failed for {tx.get_hash().hex()}:{vin_index}"
+    return True, "Valid"
+
+def validate_block(block, utxo_set, skip_scripts=False):
     """
     Validate a full block.
+    skip_scripts: block is covered by assume-valid; everything but signature checks still runs.
     """
     # 1. Check Merkle Root
     calculated_root = get_merkle_root(block.vtx)
@@ -133,47 +273,110 @@ def validate_block(block, utxo_set):
         logger.error(f"Block validation failed: {reason}")
         return False, reason
 
-    # Track spent outputs in this block to prevent double-spending within the block
+    # In-memory UTXO view: every input the block spends is fetched in one batched
+    # query, and outputs created in this block are added as we go (for chaining).
+    view = None
+    if utxo_set is not None:
+        view = UTXOView(utxo_set)
+        view.prefetch_block(block)
+
+    # Intra-block double spends, and spends of a later tx in the block (which
+    # in-order validation never saw), checked once across the whole block up front
+    tx_index = {tx.get_hash(): i for i, tx in enumerate(block.vtx)}
     spent_in_block = set()
-    
-    # Track new outputs created in this block (for chaining)
-    # Key: (tx_hash_hex, vout_index) -> UTXO dict
-    chained_utxos = {}
+    for i, tx in enumerate(block.vtx[1:], 1):
+        for vin in tx.vin:
+            prev_out = (vin.prev_hash, vin.prev_index)
+            if prev_out in spent_in_block:
+                reason = f"Intra-block double spend. Input {vin.prev_hash.hex()}:{vin.prev_index} used twice."
+                logger.error(f"Block validation failed: {reason}")
+                return False, reason # Double spend within block
+            if tx_index.get(vin.prev_hash, -1) >= i:
+                reason = f"Invalid Tx {i}: Input {vin.prev_hash.hex()}:{vin.prev_index} spends a later transaction in the block"
+                logger.error(f"Block validation failed: {reason}")
+                return False, reason
+            spent_in_block.add(prev_out)
 
-    # 2. Validate Transactions
-    for i, tx in enumerate(block.vtx):
-        # Coinbase (first tx) is special
-        is_coinbase = (i == 0)
-        
-        is_valid, reason = validate_transaction(tx, utxo_set, is_coinbase, chained_utxos)
-        if not is_valid:
-             logger.error(f"Block validation failed: Invalid transaction {tx.get_hash().hex()} at index {i}: {reason}")
-             return False, f"Invalid Tx {i}: {reason}"
+    # Large blocks hand each dependency level's signature checks to the pool as soon
+    # as the level's inputs and amounts pass, so workers verify while later levels
+    # are still being checked here. Small blocks verify once, inline, at the end.
+    executor = None
+    if view is not None and not skip_scripts and len(spent_in_block) >= PARALLEL_SCRIPT_MIN_CHECKS:
+        executor = get_script_executor()
+    levels = get_dependency_levels(block) if view is not None else [list(enumerate(block.vtx))]
 
-        if not is_coinbase:
-            for vin in tx.vin:
-                prev_out = (vin.prev_hash, vin.prev_index)
-                if prev_out in spent_in_block:
-                    reason = f"Intra-block double spend. Input {vin.prev_hash.hex()}:{vin.prev_index} used twice."
-                    logger.error(f"Block validation failed: {reason}")
-                    return False, reason # Double spend within block
-                spent_in_block.add(prev_out)
-        
-        # Add outputs to chained_utxos
-        tx_hash = tx.get_hash().hex()
-        for idx, out in enumerate(tx.vout):
-            chained_utxos[(tx_hash, idx)] = {
-                'amount': out.amount, 
-                'script_pubkey': out.script_pubkey, 
-                'block_height': 0, # Placeholder, not yet in chain
-                'is_coinbase': is_coinbase
-            }
+    # Deferred signature checks; those already submitted are kept for an inline retry
+    script_checks = []
+    futures = []
+
+    # 2. Validate Transactions, level by level
+    for level in levels:
+        level_checks = []
+        for i, tx in level:
+            # Coinbase (first tx) is special
+            is_coinbase = (i == 0)
             
+            is_valid, reason = validate_transaction(tx, view, is_coinbase, script_checks=level_checks)
+            if not is_valid:
+                 for _, fut in futures:
+                     fut.cancel()
+                 logger.error(f"Block validation failed: Invalid transaction {tx.get_hash().hex()} at index {i}: {reason}")
+                 return False, f"Invalid Tx {i}: {reason}"
+
+        # Make outputs spendable by later levels
+        if view is not None:
+            for i, tx in level:
+                view.add_transaction(tx, 0, i == 0) # Height placeholder, not yet in chain
+
+        if skip_scripts:
+            continue
+        # Inputs already verified when their tx entered the mempool are skipped.
+        level_checks = filter_cached_checks(level_checks, erase=True)
+        if executor is not None and level_checks:
+            futures.extend(submit_script_checks(level_checks, executor))
+        script_checks.extend(level_checks)
+
+    if skip_scripts:
+        return True, "Valid (assumed scripts)"
+
+    # 3. Verify Signatures (all inputs of the block, fanned out)
+    if executor is not None:
+        is_valid, reason = collect_script_checks(futures, script_checks, executor)
+    else:
+        is_valid, reason = run_script_checks(script_checks)
+    if not is_valid:
+        logger.error(f"Block validation failed: {reason}")
+        return False, reason
+
     return True, "Valid"
 
-def validate_transaction(tx, utxo_set, is_coinbase=False, chained_utxos=None):
+def get_dependency_levels(block):
+    """
+    Group a block's transactions into levels that only spend outputs of earlier
+    levels (or of the chain), so each level's transactions are independent.
+    Returns [[(index, tx), ...], ...] with block order kept inside each level.
+    Only earlier transactions count as parents, as with in-order validation.
+    """
+    level_of = {} # tx hash hex -> level
+    levels = []
+    for i, tx in enumerate(block.vtx):
+        level = 0
+        if i > 0:
+            for vin in tx.vin:
+                parent_level = level_of.get(vin.prev_hash.hex())
+                if parent_level is not None and parent_level >= level:
+                    level = parent_level + 1
+        level_of.setdefault(tx.get_hash().hex(), level)
+        if level == len(levels):
+            levels.append([])
+        levels[level].append((i, tx))
+    return levels
+
+def validate_transaction(tx, utxo_set, is_coinbase=False, chained_utxos=None, script_checks=None):
     """
     Validate a single transaction.
+    If `script_checks` is a list, signature checks are appended to it for the caller
+    to run in batch (block validation); otherwise they are verified inline (mempool).
     """
     # Basic Checks
     if not tx.vin and not is_coinbase: 
@@ -194,17 +397,23 @@ def validate_transaction(tx, utxo_set, is_coinbase=False, chained_utxos=None):
         # Context-free check only (structure)
         return True, "Valid Structure"
 
+    # Resolve all inputs with one storage round trip (no-op if already a prefetched view)
+    if not isinstance(utxo_set, UTXOView):
+        utxo_set = UTXOView(utxo_set)
+        utxo_set.prefetch([(txin.prev_hash.hex(), txin.prev_index) for txin in tx.vin])
+
     total_in = 0
+    pending_checks = []
     for i, txin in enumerate(tx.vin):
         # Look up UTXO
         prev_hash_hex = txin.prev_hash.hex()
         
-        # 1. Check Chained UTXOs (Intra-block)
+        # 1. Check Chained UTXOs (caller-supplied, e.g. unconfirmed parents)
         utxo = None
         if chained_utxos and (prev_hash_hex, txin.prev_index) in chained_utxos:
              utxo = chained_utxos[(prev_hash_hex, txin.prev_index)]
         
-        # 2. Check Database
+        # 2. Check UTXO View (prefetched from the database)
         if not utxo:
              utxo = utxo_set.get_utxo(prev_hash_hex, txin.prev_index)
         
@@ -215,6 +424,7 @@ def validate_transaction(tx, utxo_set, is_coinbase=False, chained_utxos=None):
             return False, reason
             
         total_in += utxo['amount']
+        pending_checks.append((tx, i, utxo['script_pubkey']))
 
     # Check Amounts (Input >= Output)
     total_out = sum(out.amount for out in tx.vout)
@@ -223,4 +433,17 @@ def validate_transaction(tx, utxo_set, is_coinbase=False, chained_utxos=None):
         logger.error(f"Tx validation failed: {reason}")
         return False, reason
 
+    # Check Signatures
+    if script_checks is not None:
+        script_checks.extend(pending_checks)
+    else:
+        pending_checks = filter_cached_checks(pending_checks)
+        is_valid, reason = run_script_checks(pending_checks)
+        if not is_valid:
+            logger.error(f"Tx validation failed: {reason}")
+            return False, reason
+        tx_hash = tx.get_hash()
+        for _, vin_index, script_pubkey in pending_checks:
+            signature_cache.add(tx_hash, vin_index, script_pubkey)
+
     return True, "Valid"
@@ -0,0 +1,113 @@
+import io
+import logging
+
+from icsicoin.consensus.difficulty import get_block_proof
+
+logger = logging.getLogger("BlockTree")
+
+class BlockTreeEntry:
+    __slots__ = ('hash', 'prev_hash', 'parent', 'height', 'bits', 'timestamp', 'chainwork', 'status', 'invalid')
+
+    def __init__(self, block_hash, prev_hash, parent, height, bits, timestamp, status):
+        self.hash = block_hash
+        self.prev_hash = prev_hash
+        self.parent = parent
+        self.height = height
+        self.bits = bits
+        self.timestamp = timestamp
+        self.status = status # Mirrors block_index: 3 = main chain, 2 = stored side branch, None = header only
+        self.invalid = False
+        parent_work = parent.chainwork if parent else 0
+        self.chainwork = parent_work + (get_block_proof(bits) if bits is not None else 0)
+
+class BlockTree:
+    """
+    In-memory copy of the block index: every known block with its parent link,
+    height and cumulative work. Fork choice and fork-point searches run against
+    this tree instead of reading parent blocks back from disk.
+    """
+    def __init__(self, block_index, block_store):
+        self.block_index = block_index
+        self.block_store = block_store
+        self.entries = {} # block_hash -> BlockTreeEntry
+        self.tip = None
+
+    def load(self):
+        backfill = []
+        for block_hash, prev_hash, height, status, bits, timestamp, file_num, offset in self.block_index.get_block_tree_rows():
+            if bits is None:
+                # Indexed before the header columns existed
+                header = self._read_header(file_num, offset)
+                if header is not None:
+                    bits, timestamp = header.bits, header.timestamp
+                    backfill.append((bits, timestamp, block_hash))
+            parent = self.entries.get(prev_hash)
+            self.entries[block_hash] = BlockTreeEntry(block_hash, prev_hash, parent, height, bits, timestamp, status)
+
+        if backfill:
+            logger.info(f"Backfilled header fields for {len(backfill)} indexed blocks")
+            self.block_index.set_header_fields(backfill)
+
+        best = self.block_index.get_best_block()
+        if best:
+            self.tip = self.get(best['block_hash'])
+        logger.info(f"Block tree loaded: {len(self.entries)} entries, tip height {self.tip.height if self.tip else None}")
+
+    def _read_header(self, file_num, offset):
+        try:
+            from icsicoin.core.primitives import BlockHeader
+            data = self.block_store.read_block(file_num, offset, 80)
+            return BlockHeader.deserialize(io.BytesIO(data))
+        except Exception:
+            return None
+
+    def get(self, block_hash):
+        """Entry for block_hash, picking up index rows written behind the tree's back."""
+        entry = self.entries.get(block_hash)
+        if entry is not None:
+            return entry
+        info = self.block_index.get_block_info(block_hash)
+        if not info:
+            return None
+        bits, timestamp = info.get('bits'), info.get('timestamp')
+        if bits is None and 'file_num' in info:
+            header = self._read_header(info['file_num'], info['offset'])
+            if header is not None:
+                bits, timestamp = header.bits, header.timestamp
+        prev_hash = info.get('prev_hash')
+        entry = BlockTreeEntry(block_hash, prev_hash, self.entries.get(prev_hash), info.get('height', 0),
+                               bits, timestamp, info.get('status'))
+        self.entries[block_hash] = entry
+        return entry
+
+    def add(self, block_hash, header, parent):
+        entry = BlockTreeEntry(block_hash, header.prev_block.hex(), parent, parent.height + 1,
+                               header.bits, header.timestamp, None)
+        self.entries[block_hash] = entry
+        return entry
+
+    def get_ancestor(self, entry, height):
+        while entry is not None and entry.height > height:
+            entry = entry.parent
+        return entry
+
+    def find_fork(self, a, b):
+        """Last common ancestor of two entries, or None if their histories don't meet."""
+        if a.height > b.height:
+            a = self.get_ancestor(a, b.height)
+        elif b.height > a.height:
+            b = self.get_ancestor(b, a.height)
+        while a is not b:
+            if a is None or b is None:
+                return None
+            a, b = a.parent, b.parent
+        return a
+
+    def mark_invalid(self, entry, descendant=None):
+        """Flag entry, and the path from it up to descendant, so nothing is built on them."""
+        node = descendant or entry
+        while node is not None:
+            node.invalid = True
+            if node is entry:
+                break
+            node = node.parent
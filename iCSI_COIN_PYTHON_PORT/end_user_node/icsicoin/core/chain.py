@@ -1,7 +1,15 @@
+import io
 import logging
 import time
-from icsicoin.consensus.validation import validate_block, validate_transaction
-from icsicoin.core.primitives import Block
+from collections import deque
+from icsicoin.consensus.validation import validate_block, validate_block_header, validate_transaction
+from icsicoin.consensus.assumevalid import AssumeValid
+from icsicoin.consensus.difficulty import DifficultyCache
+from icsicoin.core.blocktree import BlockTree
+from icsicoin.core.coins import UTXOView
+from icsicoin.core.orphans import OrphanPool
+from icsicoin.core.primitives import Block, BlockHeader
+from icsicoin.storage.databases import ChainUpdate
 
 logger = logging.getLogger("ChainManager")
 
@@ -10,8 +18,7 @@ class ChainManager:
         self.block_store = block_store
         self.block_index = block_index
         self.chain_state = chain_state
-        self.orphan_blocks = {} # hash -> block
-        self.orphan_dep = {} # prev_hash -> list of orphan blocks waiting for it
+        self.orphan_pool = OrphanPool() # Blocks waiting for their parent
         
         # Create Genesis object
         self.genesis_block = self._create_genesis_block()
@@ -19,6 +26,22 @@ class ChainManager:
         # Initialize if not present
         self._initialize_genesis()
 
+        # Every known block with its cumulative work, for fork choice and reorgs
+        self.block_tree = BlockTree(block_index, block_store)
+        self.block_tree.load()
+
+        # Retarget data for the active chain, kept in step by connect/disconnect
+        self.difficulty = DifficultyCache(self)
+
+        # Ancestors of the assume-valid block, once it is in the block tree, skip signature checks
+        self.assume_valid = AssumeValid()
+
+        # Mempool kept in step with the active chain, when the node has one
+        self.mempool = None
+
+        # Called with the new tip entry whenever the active chain changes
+        self.listeners = []
+
     def _create_genesis_block(self):
         """Creates the hardcoded Genesis Block object"""
         from icsicoin.core.primitives import Block, BlockHeader, Transaction, TxIn, TxOut
@@ -57,7 +80,9 @@ class ChainManager:
              block_hash, loc[0], loc[1], len(block_bytes),
              prev_hash='0'*64,
              height=0,
-             status=3 # Valid Main Chain
+             status=3, # Valid Main Chain
+             bits=self.genesis_block.header.bits,
+             timestamp=self.genesis_block.header.timestamp
         )
         self.block_index.update_best_block(block_hash)
         logger.info(f"Genesis Initialized: {block_hash}")
@@ -132,13 +157,94 @@ class ChainManager:
             logger.error(f"Error reading block {block_hash}: {e}")
         return None
 
-    def process_block(self, block: Block):
+    @property
+    def orphan_blocks(self):
+        """hash -> block, for every orphan in the pool."""
+        return self.orphan_pool.blocks
+
+    @property
+    def orphan_dep(self):
+        """prev_hash -> list of orphan blocks waiting for it."""
+        return self.orphan_pool.by_prev
+
+    def get_missing_orphan_ancestor(self, block_hash):
+        """
+        For a pooled orphan, the (root_orphan_hash, missing_parent_hash) to request so
+        its chain can connect, or None if there's nothing to ask for.
+        """
+        result = self.orphan_pool.get_missing_ancestor(block_hash)
+        if result is None:
+            return None
+        parent = self.block_tree.get(result[1])
+        if parent is not None and parent.status is not None:
+            return None # Have it; only a header-only parent still needs its body
+        return result
+
+    def wants_headers(self):
+        """True while the assume-valid block's header hasn't been seen: fetch headers ahead of bodies."""
+        block_hash = self.assume_valid.block_hash
+        return block_hash is not None and self.block_tree.get(block_hash) is None
+
+    def accept_headers(self, headers):
+        """
+        Add headers (oldest first) to the block tree as header-only entries, ahead of
+        their bodies. Each must connect to a known block, carry the expected difficulty
+        bits and meet its proof of work. Returns (success, reason); headers before the
+        first bad one are kept.
+        """
+        for header in headers:
+            block_hash = header.get_hash().hex()
+            if self.block_tree.get(block_hash) is not None:
+                continue
+            parent = self.block_tree.get(header.prev_block.hex())
+            if parent is None:
+                return False, "Unconnected headers"
+            if parent.invalid:
+                return False, "Parent invalid"
+            fork = self.block_tree.find_fork(self.block_tree.tip, parent)
+            if fork is None:
+                return False, "No common ancestor"
+            def branch(height):
+                return self.block_tree.get_ancestor(parent, height) if height > fork.height else None
+            if header.bits != self.difficulty.get_next_bits(parent.height + 1, branch):
+                return False, "Bad difficulty bits"
+            if not validate_block_header(header, None):
+                return False, "High hash"
+            self.block_tree.add(block_hash, header, parent)
+        return True, "Headers accepted"
+
+    def get_headers_after(self, locator, limit):
+        """Up to `limit` active-chain headers after the first locator hash on our active chain."""
+        start = 0
+        for block_hash in locator:
+            entry = self.block_tree.get(block_hash)
+            if entry is not None and entry.status == 3:
+                start = entry.height
+                break
+        headers = []
+        for height in range(start + 1, min(self.get_best_height(), start + limit) + 1):
+            info = self.block_index.get_block_info(self.get_block_hash(height))
+            if not info:
+                break
+            data = self.block_store.read_block(info['file_num'], info['offset'], 80)
+            headers.append(BlockHeader.deserialize(io.BytesIO(data)))
+        return headers
+
+    def process_block(self, block: Block, peer=None):
+        """Accept a block (peer: who sent it, for orphan accounting), then connect any orphans it unblocks."""
+        success, reason = self._accept_block(block, peer)
+        if success:
+            self._process_orphans(block.get_hash().hex())
+        return success, reason
+
+    def _accept_block(self, block, peer=None):
         block_hash = block.get_hash().hex()
         
-        # 1. Check if already known
-        if self.block_index.get_block_info(block_hash):
+        # 1. Check if already known; a header-only entry (body never stored) still takes the body
+        known = self.block_tree.get(block_hash)
+        if known and (known.invalid or known.status is not None):
             logger.debug(f"Block {block_hash} already known")
-            return False, "Already known"
+            return False, "Already known" if not known.invalid else "Known invalid"
 
         # 2. Basic Validation (PoW, Structure) - Context-free checks
         # We assume caller might have done some, but good to be safe.
@@ -153,282 +259,287 @@ class ChainManager:
 
         # 3. Check Parent
         prev_hash = block.header.prev_block.hex()
-        # Genesis special case: if prev_hash is 00..00 and we have no blocks? 
-        # Actually genesis should already be loaded or handled. 
-        
-        parent_info = self.block_index.get_block_info(prev_hash)
+        parent = self.block_tree.get(prev_hash)
         
-        if not parent_info:
+        if not parent or (parent.status is None and not parent.invalid):
+             # Unknown parent, or only its header so far: wait for the parent's body
              logger.warning(f"Orphan block detected: {block_hash} (Parent {prev_hash} unknown)")
-             self.orphan_blocks[block_hash] = block
-             
-             if prev_hash not in self.orphan_dep:
-                 self.orphan_dep[prev_hash] = []
-             self.orphan_dep[prev_hash].append(block)
-             
+             self.orphan_pool.add(block, peer)
              return False, "Orphan block"
 
-        # 3. Connect to Chain (State Updates)
-        # We need to determine if this extends the longest chain.
-        # For Phase 5, we assume linear extension of current tip.
-        # Check Prev Hash
-        best_block = self.block_index.get_best_block()
-        if best_block:
-            prev_hash = block.header.prev_block.hex()
-            if prev_hash != best_block['block_hash']:
-                # Fork detected
-                # Check if this fork is longer/has more work
-                # For Phase 5, just height.
-                
-                # We need the height of this new block.
-                # Since we don't have it yet, we check the parent's height.
-                parent_info = self.block_index.get_block_info(prev_hash)
-                if parent_info:
-                    new_height = parent_info['height'] + 1
-                    current_height = best_block['height']
-                    
-                    if new_height > current_height:
-                        logger.info(f"Longer chain found! Current: {current_height}, New: {new_height}. Triggering Reorg.")
-                        self._handle_reorg(block, new_height, best_block)
-                        
-                        # Process orphans for the NEW tip (which is now best)
-                        self._process_orphans(block_hash)
-                        return True, "Reorg Success"
-                    else:
-                        logger.info(f"Fork detected but shorter/equal ({new_height} vs {current_height}). Ignoring for now.")
-                        # Special Path: Store Side Chain Block
-                        data = block.serialize()
-                        file_num, offset = self.block_store.write_block(data)
-                        self.block_index.add_block(block_hash, file_num, offset, len(data), block.header.prev_block.hex(), new_height, status=2) # Status 2 = Valid Data
-                        
-                        # Also index transactions!
-                        for tx in block.vtx:
-                            self.block_index.add_transaction(tx.get_hash().hex(), block_hash)
-
-                        # Check if any orphans were waiting for this side-chain block
-                        self._process_orphans(block_hash)
-
-                        return True, "Fork Stored"
-                else:
-                     # This should be caught by "Check Parent" above, but just in case
-                     return False, f"Orphan block (prev={prev_hash[:8]} not found)"
+        if parent.invalid:
+             logger.warning(f"Block {block_hash} builds on invalid block {prev_hash}")
+             return False, "Parent invalid"
+
+        entry = known or self.block_tree.add(block_hash, block.header, parent)
+        tip = self.block_tree.tip
+
+        # 4. Fork choice: extend the tip, reorg onto more work, or store as a side branch
+        if tip is not None and parent is not tip:
+            if entry.chainwork > tip.chainwork:
+                logger.info(f"Chain with more work found! Current: {tip.height}, New: {entry.height}. Triggering Reorg.")
+                success, reason = self._reorganize(entry, block)
+                if not success:
+                    return False, f"Reorg failed: {reason}"
+                return True, "Reorg Success"
+
+            logger.info(f"Fork detected but not more work ({entry.height} vs {tip.height}). Storing side branch.")
+            data = block.serialize()
+            file_num, offset = self.block_store.write_block(data)
+            self.block_index.add_block(block_hash, file_num, offset, len(data), prev_hash, entry.height, status=2, # Status 2 = Valid Data
+                                       bits=block.header.bits, timestamp=block.header.timestamp)
+            entry.status = 2
+            
+            # Also index transactions!
+            self.block_index.add_transactions([(tx.get_hash().hex(), block_hash) for tx in block.vtx])
+
+            return True, "Fork Stored"
                 
-        # 4. Connect
-        # Determine height for the new block
-        height = (best_block['height'] + 1) if best_block else 0
+        # 5. Connect
+        height = entry.height
         
         success, reason = self._connect_block(block, height)
         if success:
-            # 5. Store Block Body (Disk)
+            # 6. Store Block Body (Disk)
             # Serialize
             data = block.serialize()
             file_num, offset = self.block_store.write_block(data)
             
-            # 6. Index It
-            # Height is Best + 1
-            
+            # 7. Index It
             # ATOMIC UPDATE: Index + Head Pointer
-            self.block_index.add_block_atomic(block_hash, file_num, offset, len(data), block.header.prev_block.hex(), height, status=3, is_best=True)
+            self.block_index.add_block_atomic(block_hash, file_num, offset, len(data), prev_hash, height, status=3, is_best=True,
+                                              bits=block.header.bits, timestamp=block.header.timestamp)
+            entry.status = 3
+            self.block_tree.tip = entry
             logger.info(f"Block {block_hash} connected at height {height}")
-            
-            # Check for orphans waiting for this block
-            self._process_orphans(block_hash)
-            
+            if self.mempool is not None:
+                self.mempool.on_block_connected(block)
+            self._notify_tip()
             return True, "Accepted"
-            
+
+        self.block_tree.mark_invalid(entry)
         return False, f"Connect failed: {reason}"
 
     def _connect_block(self, block, height):
-        # Update UTXO set
-        # This is where we run full contextual validation
-        is_valid, reason = validate_block(block, self.chain_state)
+        # Difficulty must match the retarget schedule for this height
+        expected_bits = self.difficulty.get_next_bits(height)
+        if block.header.bits != expected_bits:
+             logger.error(f"Block {block.get_hash().hex()} has bits {block.header.bits:#010x}, expected {expected_bits:#010x}")
+             return False, "Bad difficulty bits"
+
+        # Full contextual validation against a view of the UTXO set; the view's
+        # prefetch is reused when applying the block below
+        block_hash = block.get_hash().hex()
+        entry = self.block_tree.get(block_hash)
+        skip_scripts = entry is not None and self.assume_valid.covers(self.block_tree, entry)
+        view = UTXOView(self.chain_state)
+        is_valid, reason = validate_block(block, view, skip_scripts=skip_scripts)
         if not is_valid:
              logger.error(f"Block {block.get_hash().hex()} failed contextual validation: {reason}")
-             # Mark invalid?
              return False, reason
              
-        # Commit UTXO changes
-        # validate_block (current impl) doesn't update DB, just checks.
-        # We need a method to APPLY changes.
-        # For Phase 5, we'll implement simple apply.
-        
-        # Spend Inputs
-        for tx in block.vtx:
-            # Coinbase input doesn't spend (handled in is_coinbase check)
-            if not tx.is_coinbase():
-                for vin in tx.vin:
-                    prev_out = f"{vin.prev_hash.hex()}:{vin.prev_index}"
-                    self.chain_state.remove_utxo(vin.prev_hash.hex(), vin.prev_index)
-            
-            # Create Outputs
-            tx_hash = tx.get_hash().hex()
-            is_coinbase = tx.is_coinbase()
-            for i, vout in enumerate(tx.vout):
-                 # add_utxo(tx_hash, index, amount, script_pubkey, block_height, is_coinbase)
-                 self.chain_state.add_utxo(tx_hash, i, vout.amount, vout.script_pubkey, height, is_coinbase)
-                 
-        # Update Best Block in Index - REMOVED (Moved to atomic add_block in process_block)
-        # self.block_index.update_best_block(block.get_hash().hex())
-        
-        # New: Update status to 3 (Main Chain) - REMOVED (Moved to atomic add_block)
-        # self.block_index.update_block_status(block.get_hash().hex(), 3)
+        # Commit UTXO changes and undo data in one transaction
+        undo = self._apply_block(view, block, height)
+        adds, removes = view.get_changes()
+        self.chain_state.apply_changes(adds, removes, undo_puts=[(block_hash, undo)])
         
         # Populate Tx Index
-        block_hash = block.get_hash().hex()
-        for tx in block.vtx:
-            self.block_index.add_transaction(tx.get_hash().hex(), block_hash)
+        self.block_index.add_transactions([(tx.get_hash().hex(), block_hash) for tx in block.vtx])
+
+        self.difficulty.on_block_connected(height, block.header)
+        if skip_scripts:
+            self.assume_valid.skipped += 1
             
         return True, "Connected"
 
-    def _disconnect_block(self, block):
-        logger.info(f"Disconnecting block {block.get_hash().hex()}")
-        
-        # 1. Reverse Transactions (Right to Left)
-        for tx in reversed(block.vtx):
-            tx_hash = tx.get_hash().hex()
+    def _apply_block(self, view, block, height):
+        """Spend a block's inputs and add its outputs in `view`; returns the block's undo data."""
+        undo = []
+        for tx in block.vtx:
+            is_coinbase = tx.is_coinbase()
+            if not is_coinbase:
+                for vin in tx.vin:
+                    prev_txid = vin.prev_hash.hex()
+                    utxo = view.spend(prev_txid, vin.prev_index)
+                    if utxo:
+                        undo.append([prev_txid, vin.prev_index, utxo['amount'], utxo['script_pubkey'].hex(),
+                                     utxo['block_height'], bool(utxo['is_coinbase'])])
+            view.add_transaction(tx, height, is_coinbase)
+        return undo
+
+    def _undo_block(self, view, block, block_hash):
+        """Reverse a connected block in `view`: drop the outputs it created, restore the ones it spent."""
+        undo = self.chain_state.get_undo(block_hash)
+        if undo is None:
+            undo = self._rebuild_undo(block)
             
-            # A. Remove Outputs created by this block
-            for i, _ in enumerate(tx.vout):
-                self.chain_state.remove_utxo(tx_hash, i)
+        created = set()
+        for tx in block.vtx:
+            tx_hash = tx.get_hash().hex()
+            created.add(tx_hash)
+            for i in range(len(tx.vout)):
+                view.remove(tx_hash, i)
                 
-            # B. Restore Inputs spent by this block
-            if not tx.is_coinbase():
-                for vin in tx.vin:
-                     prev_txid = vin.prev_hash.hex()
-                     prev_out_idx = vin.prev_index
-                     
-                     # Find which block contains this previous transaction
-                     source_block_hash = self.block_index.get_transaction_block_hash(prev_txid)
+        for prev_txid, prev_index, amount, script_hex, height, is_coinbase in undo:
+            # Outputs created and spent inside this block stay removed
+            if prev_txid in created:
+                continue
+            view.add_utxo(prev_txid, prev_index, {
+                'amount': amount,
+                'script_pubkey': bytes.fromhex(script_hex),
+                'block_height': height,
+                'is_coinbase': is_coinbase
+            })
+
+    def _rebuild_undo(self, block):
+        """Undo data for blocks connected before it was recorded: look up each spent output's source block."""
+        undo = []
+        for tx in block.vtx:
+            if tx.is_coinbase():
+                continue
+            for vin in tx.vin:
+                 prev_txid = vin.prev_hash.hex()
+                 prev_out_idx = vin.prev_index
+                 
+                 # Find which block contains this previous transaction
+                 source_block_hash = self.block_index.get_transaction_block_hash(prev_txid)
+                 source_block = self.get_block_by_hash(source_block_hash) if source_block_hash else None
+                 original_tx = None
+                 if source_block:
+                     original_tx = next((t for t in source_block.vtx if t.get_hash().hex() == prev_txid), None)
+                 if not original_tx or prev_out_idx >= len(original_tx.vout):
+                     logger.critical(f"CRITICAL: Could not find source of input {prev_txid}:{prev_out_idx} during rollback. UTXO Set may be corrupt.")
+                     continue
                      
-                     if source_block_hash:
-                         source_block = self.get_block_by_hash(source_block_hash)
-                         if source_block:
-                             # Find the tx in that block
-                             original_tx = next((t for t in source_block.vtx if t.get_hash().hex() == prev_txid), None)
-                             if original_tx and prev_out_idx < len(original_tx.vout):
-                                 out = original_tx.vout[prev_out_idx]
-                                 # Restore UTXO
-                                 # We need the block height of the source block
-                                 source_info = self.block_index.get_block_info(source_block_hash)
-                                 height = source_info['height'] if source_info else 0
-                                 
-                                 self.chain_state.add_utxo(
-                                     prev_txid, 
-                                     prev_out_idx, 
-                                     out.amount, 
-                                     out.script_pubkey, 
-                                     height, 
-                                     original_tx.is_coinbase()
-                                 )
-                             else:
-                                 logger.error(f"Could not find tx {prev_txid} in block {source_block_hash} during rollback")
-                         else:
-                             logger.error(f"Could not load source block {source_block_hash} during rollback")
-                     else:
-                         # Fallback: Maybe it's in the mempool? No, blocks only spend confirmed (usually).
-                         # Or we just don't have the index for it yet (old block).
-                         logger.critical(f"CRITICAL: Could not find block for input {prev_txid} during rollback. UTXO Set may be corrupt.")
-                         
-        # Update Best Block to Parent
-        prev = block.header.prev_block.hex()
-        self.block_index.update_best_block(prev)
-        
-        # Revert status to 2 (Valid Header/Data, but not active chain)
-        self.block_index.update_block_status(block.get_hash().hex(), 2)
-
+                 out = original_tx.vout[prev_out_idx]
+                 source = self.block_tree.get(source_block_hash)
+                 undo.append([prev_txid, prev_out_idx, out.amount, out.script_pubkey.hex(),
+                              source.height if source else 0, original_tx.is_coinbase()])
+        return undo
 
-    def _handle_reorg(self, new_tip_block, new_height, old_tip_info):
-        old_hash = old_tip_info['block_hash'] if old_tip_info else "None"
-        new_hash = new_tip_block.get_hash().hex()
-        logger.warning(f"REORG START: {old_hash} -> {new_hash}")
+    def _reorganize(self, new_tip, new_block=None):
+        """
+        Switch the active chain to new_tip. The whole disconnect/connect sequence is
+        applied to an in-memory UTXO view and written in a single transaction, so an
+        invalid block on the new branch leaves the chain and database untouched.
+        new_block: new_tip's body when it hasn't been stored yet.
+        """
+        old_tip = self.block_tree.tip
+        logger.warning(f"REORG START: {old_tip.hash} -> {new_tip.hash}")
         
         # 1. Find Common Ancestor
-        fork_hash, path_to_new = self._find_fork(new_tip_block, old_tip_info)
-        
-        if not fork_hash:
+        fork = self.block_tree.find_fork(old_tip, new_tip)
+        if fork is None:
             logger.error("Reorg failed: Could not find common ancestor (Genesis mismatch?)")
-            return
+            return False, "No common ancestor"
             
-        logger.info(f"Reorg Common Ancestor: {fork_hash}")
+        disconnect = []
+        entry = old_tip
+        while entry is not fork:
+            disconnect.append(entry)
+            entry = entry.parent
+        connect = []
+        entry = new_tip
+        while entry is not fork:
+            connect.append(entry)
+            entry = entry.parent
+        connect.reverse()
+        logger.info(f"Reorg Common Ancestor: {fork.hash} (height {fork.height}), disconnecting {len(disconnect)}, connecting {len(connect)}")
+        
+        view = UTXOView(self.chain_state)
+        update = ChainUpdate()
+        disconnected_blocks = []
+        connected_blocks = []
+        assumed = 0
         
         # 2. Disconnect Old Chain (Old Tip -> Fork exclusive)
-        curr = old_hash
-        while curr != fork_hash:
-             block_to_disconnect = self.get_block_by_hash(curr)
-             if not block_to_disconnect:
-                 logger.critical(f"Could not load block {curr} during reorg disconnect!")
-                 break
-             
-             self._disconnect_block(block_to_disconnect)
-             # Move to parent
-             curr = block_to_disconnect.header.prev_block.hex()
+        for entry in disconnect:
+             block = self.get_block_by_hash(entry.hash)
+             if not block:
+                 logger.critical(f"Could not load block {entry.hash} during reorg disconnect!")
+                 return False, f"Missing block {entry.hash}"
+             self._undo_block(view, block, entry.hash)
+             disconnected_blocks.append(block)
+             update.statuses.append((2, entry.hash))
+             update.undo_deletes.append(entry.hash)
 
         # 3. Connect New Chain (Fork -> New Tip)
-        # path_to_new is [Fork+1, ..., NewTip]
-        for b in path_to_new:
-             b_hash = b.get_hash().hex()
-             parent_hash = b.header.prev_block.hex()
-             
-             # Get parent height to determine this block's height
-             parent_info = self.block_index.get_block_info(parent_hash)
-             h = (parent_info['height'] + 1) if parent_info else 0
-             
-             self._connect_block(b, h)
-             
-             if b == new_tip_block:
-                 # This is the new tip we haven't stored yet.
-                 data = b.serialize()
-                 file_num, offset = self.block_store.write_block(data)
-                 self.block_index.add_block(b_hash, file_num, offset, len(data), parent_hash, h, status=3)
+        def branch(height):
+            return self.block_tree.get_ancestor(new_tip, height) if height > fork.height else None
+            
+        for entry in connect:
+             block = new_block if (new_block is not None and entry is new_tip) else self.get_block_by_hash(entry.hash)
+             if not block:
+                 logger.critical(f"Could not load block {entry.hash} during reorg connect!")
+                 return False, f"Missing block {entry.hash}"
+                 
+             expected_bits = self.difficulty.get_next_bits(entry.height, branch)
+             if block.header.bits != expected_bits:
+                 reason = "Bad difficulty bits"
              else:
-                 # Intermediate block, should be on disk/index already?
-                 pass
+                 skip_scripts = self.assume_valid.covers(self.block_tree, entry)
+                 is_valid, reason = validate_block(block, view, skip_scripts=skip_scripts)
+                 if is_valid:
+                     reason = None
+                     assumed += skip_scripts
+             if reason:
+                 logger.error(f"Reorg aborted: block {entry.hash} at height {entry.height} is invalid: {reason}")
+                 self.block_tree.mark_invalid(entry, new_tip)
+                 return False, reason
+                 
+             update.undo_puts.append((entry.hash, self._apply_block(view, block, entry.height)))
+             connected_blocks.append(block)
+             update.statuses.append((3, entry.hash))
+             update.transactions.extend((tx.get_hash().hex(), entry.hash) for tx in block.vtx)
+
+        # 4. Store the new tip's body; the index row goes in with the rest
+        if new_block is not None:
+            data = new_block.serialize()
+            file_num, offset = self.block_store.write_block(data)
+            update.blocks.append((new_tip.hash, file_num, offset, len(data), new_tip.prev_hash, new_tip.height, 3,
+                                  new_block.header.bits, new_block.header.timestamp))
+        update.best_block = new_tip.hash
+        update.utxo_adds, update.utxo_removes = view.get_changes()
+        
+        self.block_index.apply_chain_update(update, self.chain_state)
+
+        # 5. Committed: bring the in-memory state along
+        for entry in disconnect:
+            entry.status = 2
+        for entry in connect:
+            entry.status = 3
+        self.block_tree.tip = new_tip
+        self.assume_valid.skipped += assumed
+        self.difficulty.on_block_disconnected(fork.height + 1)
+        for entry in connect:
+            self.difficulty.on_block_connected(entry.height, entry)
+        if self.mempool is not None:
+            for block in disconnected_blocks:
+                self.mempool.on_block_disconnected(block)
+            for block in connected_blocks:
+                self.mempool.on_block_connected(block)
+            self.mempool.resubmit_disconnected()
+        self._notify_tip()
 
         logger.info("REORG COMPLETE")
+        return True, "Reorganized"
 
-
-    def _find_fork(self, new_tip_block, old_tip_info):
-        """
-        Returns (fork_hash, [block_objects_from_fork_to_new])
-        """
-        # Load new chain path backwards
-        new_chain = []
-        curr_block = new_tip_block
-        
-        while True:
-             block_hash = curr_block.get_hash().hex()
-             
-             # Check if this block exists and is active?
-             info = self.block_index.get_block_info(block_hash)
-             if info and info['status'] == 3:
-                 return block_hash, list(reversed(new_chain))
-             
-             new_chain.append(curr_block)
-             
-             prev_hash = curr_block.header.prev_block.hex()
-             parent = self.get_block_by_hash(prev_hash)
-             
-             if not parent:
-                 # Check genesis in index
-                 p_info = self.block_index.get_block_info(prev_hash)
-                 if p_info and p_info['status'] == 3:
-                      return prev_hash, list(reversed(new_chain))
-                 
-                 # If we hit Genesis hash hardcoded
-                 if prev_hash == '00'*32: 
-                      # This shouldn't happen if genesis is indexed
-                      return None, None
-                 
-                 return None, None
-                 
-             curr_block = parent
+    def _notify_tip(self):
+        for listener in self.listeners:
+            try:
+                listener(self.block_tree.tip)
+            except Exception as e:
+                logger.error(f"Tip listener failed: {e}")
 
     def _process_orphans(self, parent_hash):
-        if parent_hash in self.orphan_dep:
-            orphans = self.orphan_dep[parent_hash]
-            del self.orphan_dep[parent_hash]
-            for b in orphans:
-                self.process_block(b)
+        # Breadth-first over the orphans each newly accepted block unblocks; iterative
+        # so a long out-of-order batch can't exhaust the stack
+        pending = deque([parent_hash])
+        while pending:
+            for b in self.orphan_pool.take_children(pending.popleft()):
+                success, reason = self._accept_block(b)
+                if success:
+                    pending.append(b.get_hash().hex())
 
 
     def check_integrity(self):
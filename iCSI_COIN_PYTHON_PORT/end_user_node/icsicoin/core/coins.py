@@ -0,0 +1,103 @@
+import logging
+
+logger = logging.getLogger("Coins")
+
+class UTXOView:
+    """
+    In-memory view of the UTXO set for validating one block (or transaction).
+
+    prefetch() pulls every referenced outpoint from the backing ChainStateDB in a
+    single batched query; outputs created earlier in the same block are added with
+    add_transaction() so intra-block chains resolve from the same view.
+    Lookups for outpoints that were not prefetched fall through to the backing store.
+    Views stack (a view can be the base of another), and the outpoints a view has
+    added or removed are tracked so its net changes can be written back in one batch.
+    """
+    def __init__(self, base):
+        self.base = base
+        self.entries = {} # (txid_hex, vout_index) -> utxo dict, or None if known missing
+        self.dirty = set() # outpoints added/removed through this view
+
+    def prefetch(self, outpoints):
+        missing = [op for op in outpoints if op not in self.entries]
+        if not missing or self.base is None:
+            return
+        get_utxos = getattr(self.base, 'get_utxos', None)
+        if get_utxos:
+            found = get_utxos(missing)
+        else:
+            found = {}
+            for txid, vout in missing:
+                utxo = self.base.get_utxo(txid, vout)
+                if utxo:
+                    found[(txid, vout)] = utxo
+        for op in missing:
+            self.entries[op] = found.get(op)
+
+    def prefetch_block(self, block):
+        """Prefetch every input outpoint spent by a block, skipping those it creates itself."""
+        created = {tx.get_hash().hex() for tx in block.vtx}
+        outpoints = []
+        for tx in block.vtx:
+            if tx.is_coinbase():
+                continue
+            for vin in tx.vin:
+                prev_txid = vin.prev_hash.hex()
+                if prev_txid not in created:
+                    outpoints.append((prev_txid, vin.prev_index))
+        self.prefetch(outpoints)
+
+    def add_transaction(self, tx, height=0, is_coinbase=False):
+        """Make a transaction's outputs spendable by later transactions in the view."""
+        tx_hash = tx.get_hash().hex()
+        for idx, out in enumerate(tx.vout):
+            self.add_utxo(tx_hash, idx, {
+                'amount': out.amount,
+                'script_pubkey': out.script_pubkey,
+                'block_height': height,
+                'is_coinbase': is_coinbase
+            })
+
+    def add_utxo(self, txid, vout_index, utxo):
+        key = (txid, vout_index)
+        self.entries[key] = utxo
+        self.dirty.add(key)
+
+    def spend(self, txid, vout_index):
+        """Remove an outpoint from the view, returning the utxo it held (or None)."""
+        utxo = self.get_utxo(txid, vout_index)
+        self.remove(txid, vout_index)
+        return utxo
+
+    def remove(self, txid, vout_index):
+        key = (txid, vout_index)
+        self.entries[key] = None
+        self.dirty.add(key)
+
+    def get_changes(self):
+        """Net effect of this view: ({outpoint: utxo} to write, [outpoints] to delete)."""
+        adds = {}
+        removes = []
+        for key in self.dirty:
+            utxo = self.entries[key]
+            if utxo is None:
+                removes.append(key)
+            else:
+                adds[key] = utxo
+        return adds, removes
+
+    def get_utxos(self, outpoints):
+        """Batch lookup, so a view can back another view's prefetch."""
+        outpoints = list(outpoints)
+        self.prefetch(outpoints)
+        return {op: self.entries[op] for op in outpoints if self.entries.get(op)}
+
+    def get_utxo(self, txid, vout_index):
+        key = (txid, vout_index)
+        if key in self.entries:
+            return self.entries[key]
+        if self.base is None:
+            return None
+        utxo = self.base.get_utxo(txid, vout_index)
+        self.entries[key] = utxo
+        return utxo
@@ -1,88 +1,813 @@
 import logging
 import os
+import sys
 import json
+import struct
+import asyncio
+import time
+import heapq
+import bisect
+import threading
 import binascii
 import io
 from icsicoin.core.primitives import Transaction
 
 logger = logging.getLogger("Mempool")
 
+# Journal records appended before the snapshot is rewritten and the journal truncated.
+MEMPOOL_JOURNAL_MAX_RECORDS = int(os.getenv('MEMPOOL_JOURNAL_MAX_RECORDS', 5000))
+# Seconds a pending snapshot waits for more changes before it is written.
+MEMPOOL_SNAPSHOT_DELAY = float(os.getenv('MEMPOOL_SNAPSHOT_DELAY', 5))
+
+SNAPSHOT_MAGIC = b'ICMP'
+SNAPSHOT_VERSION = 1
+RECORD_ADD = 1
+RECORD_REMOVE = 2
+
+# Serialized block size a template may fill, and the part of it kept for header and coinbase.
+BLOCK_MAX_SIZE = int(os.getenv('BLOCK_MAX_SIZE', 1000000))
+BLOCK_RESERVED_SIZE = 1000
+
+# Memory the pool may use (estimated per entry) before the lowest fee-rate packages are evicted.
+MEMPOOL_MAX_BYTES = int(os.getenv('MEMPOOL_MAX_BYTES', 128 * 1024 * 1024))
+# Transactions still unconfirmed after this many seconds are dropped, with their descendants.
+MEMPOOL_EXPIRY_SECONDS = int(os.getenv('MEMPOOL_EXPIRY_SECONDS', 14 * 24 * 3600))
+# Fee rates are in satoshis per serialized byte.
+MIN_RELAY_FEERATE = float(os.getenv('MIN_RELAY_FEERATE', 0))
+# After an eviction, new transactions must beat the evicted package by this much.
+MEMPOOL_INCREMENTAL_FEERATE = float(os.getenv('MEMPOOL_INCREMENTAL_FEERATE', 1.0))
+# The eviction-raised minimum fee rate halves over this many seconds (faster while the pool is small).
+MEMPOOL_MIN_FEE_HALFLIFE = 12 * 3600
+
+# Limits on unconfirmed chains: in-mempool ancestors/descendants of any entry, itself included.
+MEMPOOL_MAX_ANCESTORS = int(os.getenv('MEMPOOL_MAX_ANCESTORS', 25))
+MEMPOOL_MAX_ANCESTOR_SIZE = int(os.getenv('MEMPOOL_MAX_ANCESTOR_SIZE', 101000))
+MEMPOOL_MAX_DESCENDANTS = int(os.getenv('MEMPOOL_MAX_DESCENDANTS', 25))
+MEMPOOL_MAX_DESCENDANT_SIZE = int(os.getenv('MEMPOOL_MAX_DESCENDANT_SIZE', 101000))
+
+# Per-entry bookkeeping beyond the transaction objects: the MempoolEntry and its sets,
+# the transactions/entries dict slots and the fee-rate index tuples.
+ENTRY_OVERHEAD = 1050
+# Per-input spent_outpoints slot: (txid_hex, index) key plus the dict entry.
+OUTPOINT_OVERHEAD = 250
+
+def estimate_usage(tx):
+    """Approximate bytes of memory a pooled transaction occupies, index entries included."""
+    usage = ENTRY_OVERHEAD + sys.getsizeof(tx) + sys.getsizeof(tx.__dict__)
+    usage += sys.getsizeof(tx.vin) + sys.getsizeof(tx.vout)
+    for vin in tx.vin:
+        usage += (sys.getsizeof(vin) + sys.getsizeof(vin.__dict__) + sys.getsizeof(vin.prev_hash)
+                  + sys.getsizeof(vin.script_sig) + OUTPOINT_OVERHEAD)
+    for out in tx.vout:
+        usage += sys.getsizeof(out) + sys.getsizeof(out.__dict__) + sys.getsizeof(out.script_pubkey)
+    return usage
+
+class MempoolEntry:
+    __slots__ = ('tx', 'txid', 'fee', 'size', 'feerate', 'usage', 'time', 'sequence', 'parents', 'children',
+                 'ancestor_count', 'ancestor_size', 'ancestor_fee',
+                 'descendant_count', 'descendant_size', 'descendant_fee')
+
+    def __init__(self, tx, txid, fee, size, sequence, now=None):
+        self.tx = tx
+        self.txid = txid
+        self.fee = fee
+        self.size = size
+        self.feerate = fee / size # satoshis per byte
+        self.usage = estimate_usage(tx)
+        self.time = time.time() if now is None else now
+        self.sequence = sequence
+        self.parents = set()  # txids of in-mempool transactions this one spends
+        self.children = set() # txids of in-mempool transactions spending this one
+        # Totals over this entry and all of its in-mempool ancestors
+        self.ancestor_count = 1
+        self.ancestor_size = size
+        self.ancestor_fee = fee
+        # Totals over this entry and all of its in-mempool descendants
+        self.descendant_count = 1
+        self.descendant_size = size
+        self.descendant_fee = fee
+
+    @property
+    def ancestor_feerate(self):
+        return self.ancestor_fee / self.ancestor_size
+
+    @property
+    def eviction_score(self):
+        """Lower is evicted first; a high-fee child keeps its parent in the pool."""
+        return max(self.feerate, self.descendant_fee / self.descendant_size)
+
+class MempoolView:
+    """
+    Chain state with the mempool laid over it, for validating transactions that spend
+    unconfirmed outputs: outputs of mempool transactions resolve from the pool, and
+    outpoints a mempool transaction already spends are reported missing.
+    Usable anywhere a ChainStateDB is (get_utxo / get_utxos).
+    """
+    def __init__(self, base, mempool):
+        self.base = base
+        self.mempool = mempool
+
+    def _unconfirmed(self, txid, vout_index):
+        tx = self.mempool.transactions.get(txid)
+        if tx is None or vout_index >= len(tx.vout):
+            return None
+        out = tx.vout[vout_index]
+        return {'amount': out.amount, 'script_pubkey': out.script_pubkey,
+                'block_height': None, 'is_coinbase': False} # Unconfirmed
+
+    def get_utxo(self, txid, vout_index):
+        if (txid, vout_index) in self.mempool.spent_outpoints:
+            return None
+        if txid in self.mempool.transactions:
+            return self._unconfirmed(txid, vout_index)
+        return self.base.get_utxo(txid, vout_index) if self.base is not None else None
+
+    def get_utxos(self, outpoints):
+        results = {}
+        confirmed = []
+        for op in outpoints:
+            if op in self.mempool.spent_outpoints:
+                continue
+            if op[0] in self.mempool.transactions:
+                utxo = self._unconfirmed(*op)
+                if utxo:
+                    results[op] = utxo
+            else:
+                confirmed.append(op)
+        if confirmed and self.base is not None:
+            get_utxos = getattr(self.base, 'get_utxos', None)
+            if get_utxos:
+                results.update(get_utxos(confirmed))
+            else:
+                for op in confirmed:
+                    utxo = self.base.get_utxo(*op)
+                    if utxo:
+                        results[op] = utxo
+        return results
+
 class Mempool:
-    def __init__(self, data_dir=None):
+    """
+    Unconfirmed transactions, persisted as a binary snapshot (mempool.dat) plus an
+    append-only journal (mempool.journal) of add/remove records. Each change costs
+    one small append; once the journal grows past MEMPOOL_JOURNAL_MAX_RECORDS the
+    snapshot is rewritten (in a worker thread when an event loop is running) and the
+    journal starts over.
+
+    Each transaction has a MempoolEntry with its fee, size and fee rate (fees are
+    resolved against chain_state, or against in-mempool parents, at acceptance) and
+    its ancestor package totals. `by_feerate` keeps (feerate, sequence, txid) in
+    ascending order; select_transactions() fills blocks by ancestor package fee rate.
+
+    Memory use is capped at max_bytes: the package with the lowest eviction score
+    (an entry plus its descendants) is evicted first, and the minimum fee rate for
+    new transactions is raised past it, decaying back over MEMPOOL_MIN_FEE_HALFLIFE.
+    Entries older than MEMPOOL_EXPIRY_SECONDS are dropped.
+    """
+    def __init__(self, data_dir=None, chain_state=None, max_bytes=MEMPOOL_MAX_BYTES, expiry=MEMPOOL_EXPIRY_SECONDS):
         self.transactions = {} # tx_hash -> Transaction object
+        self.entries = {} # tx_hash -> MempoolEntry, in arrival order
+        self.by_feerate = [] # sorted (feerate, sequence, tx_hash)
+        self.by_eviction_score = [] # sorted (eviction_score, sequence, tx_hash)
+        self.max_bytes = max_bytes
+        self.expiry = expiry
+        self.total_usage = 0
+        self.rolling_min_feerate = 0.0
+        self.last_rolling_update = time.time()
+        self.evicted = 0
+        self.expired = 0
+        self.spent_outpoints = {} # (prev_txid_hex, prev_index) -> hash of the mempool tx spending it
+        self.sequence = 0 # Bumped on every add/remove
+        self.listeners = [] # Called with the new sequence on every add/remove (once per batch update)
+        self.chain_state = chain_state
         self.data_dir = data_dir
         self.filename = os.path.join(data_dir, "mempool.dat") if data_dir else None
+        self.journal_filename = os.path.join(data_dir, "mempool.journal") if data_dir else None
+        self.journal = None
+        self.journal_records = 0
+        self._pending_records = None # Buffered journal records while a batch update runs
+        self._notify_pending = False # Listeners are told once a batch update ends
+        self.disconnected = {} # tx_hash -> Transaction from disconnected blocks, awaiting resubmission
+        self._snapshot_handle = None
+        self._compacting = False
+        self._snapshot_lock = threading.RLock() # One snapshot writer at a time
         if self.filename:
-            self.load()
+            self.load(chain_state)
+
+    # --- Persistence ---
 
-    def load(self):
-        if not self.filename or not os.path.exists(self.filename):
+    def load(self, chain_state=None):
+        """
+        Rebuild the pool from the snapshot and journal. With chain_state, every loaded
+        transaction is revalidated in one batch and those no longer valid are dropped.
+        """
+        if not self.filename:
             return
-        
+        txs = {} # tx_hash -> Transaction, in acceptance order
         try:
-            with open(self.filename, 'r') as f:
-                data = json.load(f)
-                
-            count = 0
-            for tx_hex in data:
+            if os.path.exists(self.filename):
+                for tx in self._read_snapshot(self.filename):
+                    txs[tx.get_hash().hex()] = tx
+            # A .old journal is left behind if we stopped mid-compaction; replaying it is harmless
+            for path in (self.journal_filename + ".old", self.journal_filename):
+                if os.path.exists(path):
+                    self._replay_journal(path, txs)
+        except Exception as e:
+            logger.error(f"Failed to load mempool: {e}")
+
+        loaded = list(txs.values())
+        if chain_state is not None and loaded:
+            loaded = self.revalidate(loaded, chain_state)
+
+        count = 0
+        for tx in loaded:
+            tx_hash = tx.get_hash().hex()
+            if tx_hash in self.transactions or self.get_conflicts(tx):
+                continue
+            self._index(tx_hash, tx)
+            count += 1
+        self.trim_to_size()
+        logger.info(f"Loaded {count} transactions from mempool.dat")
+
+        # Start from a clean snapshot so the replayed journal isn't read again next time
+        if txs or os.path.exists(self.journal_filename):
+            self.save()
+
+    def _read_snapshot(self, path):
+        with open(path, 'rb') as f:
+            data = f.read()
+        if data[:1] == b'[':
+            # Hex-in-JSON format written by older versions
+            for tx_hex in json.loads(data.decode('utf-8')):
                 try:
-                    tx_bytes = binascii.unhexlify(tx_hex)
-                    tx = Transaction.deserialize(io.BytesIO(tx_bytes))
-                    # Validate? We assume persisted mempool was valid.
-                    # Re-verify logic could be added here but for now just load.
-                    self.transactions[tx.get_hash().hex()] = tx
-                    count += 1
+                    yield Transaction.deserialize(io.BytesIO(binascii.unhexlify(tx_hex)))
                 except Exception as e:
                     logger.warning(f"Failed to deserialize mempool tx: {e}")
-            
-            logger.info(f"Loaded {count} transactions from mempool.dat")
+            return
+        if data[:4] != SNAPSHOT_MAGIC:
+            logger.error("mempool.dat has an unknown format; ignoring it")
+            return
+        version, count = struct.unpack_from('<II', data, 4)
+        f = io.BytesIO(data)
+        f.seek(12)
+        for _ in range(count):
+            yield Transaction.deserialize(f)
+
+    def _replay_journal(self, path, txs):
+        with open(path, 'rb') as f:
+            data = f.read()
+        pos = 0
+        while pos + 5 <= len(data):
+            kind, length = struct.unpack_from('<BI', data, pos)
+            payload = data[pos + 5:pos + 5 + length]
+            if len(payload) < length:
+                break # Torn final record from a crash mid-append
+            pos += 5 + length
+            if kind == RECORD_ADD:
+                tx = Transaction.deserialize(io.BytesIO(payload))
+                txs[tx.get_hash().hex()] = tx
+            elif kind == RECORD_REMOVE:
+                txs.pop(payload.hex(), None)
+        if pos < len(data):
+            logger.warning(f"Ignoring {len(data) - pos} trailing bytes of {os.path.basename(path)}")
+
+    def revalidate(self, txs, chain_state):
+        """
+        Check txs (in acceptance order) against chain_state in one batch: a single UTXO
+        query for all inputs, then every signature check at once. Returns the valid ones.
+        """
+        from icsicoin.core.coins import UTXOView
+        from icsicoin.consensus.validation import validate_transaction, run_script_checks, filter_cached_checks
+        from icsicoin.consensus.sigcache import signature_cache
+
+        view = UTXOView(chain_state)
+        view.prefetch([(vin.prev_hash.hex(), vin.prev_index) for tx in txs for vin in tx.vin])
+
+        candidates = []
+        for tx in txs:
+            checks = []
+            is_valid, reason = validate_transaction(tx, view, script_checks=checks)
+            if not is_valid:
+                logger.info(f"Dropping mempool tx {tx.get_hash().hex()}: {reason}")
+                continue
+            for vin in tx.vin:
+                view.spend(vin.prev_hash.hex(), vin.prev_index)
+            view.add_transaction(tx)
+            candidates.append((tx, filter_cached_checks(checks)))
+
+        all_checks = [check for _, tx_checks in candidates for check in tx_checks]
+        if run_script_checks(all_checks)[0]:
+            valid = candidates
+        else:
+            # Something in the batch is bad; find out which
+            valid = [(tx, checks) for tx, checks in candidates if run_script_checks(checks)[0]]
+
+        for tx, checks in valid:
+            tx_hash = tx.get_hash()
+            for _, vin_index, script_pubkey in checks:
+                signature_cache.add(tx_hash, vin_index, script_pubkey)
+        if len(valid) < len(txs):
+            logger.info(f"Revalidated mempool: kept {len(valid)} of {len(txs)} transactions")
+        return [tx for tx, _ in valid]
+
+    def _append(self, kind, payload):
+        if not self.journal_filename:
+            return
+        if self._pending_records is not None:
+            self._pending_records.append(struct.pack('<BI', kind, len(payload)) + payload)
+            return
+        self._write_records([struct.pack('<BI', kind, len(payload)) + payload])
+
+    def _begin_batch(self):
+        self._pending_records = []
+
+    def _end_batch(self):
+        records, self._pending_records = self._pending_records, None
+        if records:
+            self._write_records(records)
+        if self._notify_pending:
+            self._notify_pending = False
+            self._notify()
+
+    def _write_records(self, records):
+        try:
+            if self.journal is None:
+                self.journal = open(self.journal_filename, 'ab')
+            self.journal.write(b''.join(records))
+            self.journal.flush()
+            self.journal_records += len(records)
         except Exception as e:
-            logger.error(f"Failed to load mempool: {e}")
+            logger.error(f"Failed to append to mempool journal: {e}")
+            return
+        if self.journal_records >= MEMPOOL_JOURNAL_MAX_RECORDS:
+            self.schedule_snapshot()
+
+    def schedule_snapshot(self):
+        """Rewrite the snapshot soon: debounced on the event loop, or right away without one."""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.save()
+            return
+        if self._snapshot_handle is None and not self._compacting:
+            self._snapshot_handle = loop.call_later(MEMPOOL_SNAPSHOT_DELAY, self._start_snapshot, loop)
+
+    def _start_snapshot(self, loop):
+        self._snapshot_handle = None
+        self._compacting = True
+        txs, old_journal = self._rotate_journal()
+        fut = loop.run_in_executor(None, self._write_snapshot, txs, old_journal)
+        fut.add_done_callback(self._snapshot_done)
+
+    def _snapshot_done(self, fut):
+        self._compacting = False
+        if fut.exception():
+            logger.error(f"Failed to write mempool snapshot: {fut.exception()}")
+
+    def _rotate_journal(self):
+        """
+        Capture the current pool and move the journal aside; changes from here on go
+        to a fresh journal, so none are lost while the snapshot is being written.
+        """
+        txs = list(self.transactions.values())
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+        old_journal = self.journal_filename + ".old"
+        if os.path.exists(self.journal_filename):
+            os.replace(self.journal_filename, old_journal)
+        self.journal_records = 0
+        return txs, old_journal
+
+    def _write_snapshot(self, txs, old_journal):
+        with self._snapshot_lock:
+            tmp = self.filename + ".tmp"
+            with open(tmp, 'wb') as f:
+                f.write(SNAPSHOT_MAGIC + struct.pack('<II', SNAPSHOT_VERSION, len(txs)))
+                for tx in txs:
+                    f.write(tx.serialize())
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.filename)
+            if os.path.exists(old_journal):
+                os.remove(old_journal)
+        logger.info(f"Saved {len(txs)} transactions to mempool.dat")
 
     def save(self):
+        """Write the snapshot now (blocking) and start an empty journal."""
         if not self.filename:
             return
-            
+        if self._snapshot_handle is not None:
+            self._snapshot_handle.cancel()
+            self._snapshot_handle = None
         try:
-            # Serialize all transactions to hex
-            data = []
-            for tx in self.transactions.values():
-                data.append(binascii.hexlify(tx.serialize()).decode('utf-8'))
-                
-            with open(self.filename, 'w') as f:
-                json.dump(data, f)
-            logger.info(f"Saved {len(data)} transactions to mempool.dat")
+            # Waits out a snapshot still being written in the background
+            with self._snapshot_lock:
+                self._write_snapshot(*self._rotate_journal())
         except Exception as e:
             logger.error(f"Failed to save mempool: {e}")
 
-    def add_transaction(self, tx):
+    def add_transaction(self, tx, fee=None, now=None):
+        now = time.time() if now is None else now
         tx_hash = tx.get_hash().hex()
         if tx_hash in self.transactions:
             return False
         
         # Check if any input is already spent by a tx in the mempool
         for vin in tx.vin:
-            for existing_tx in self.transactions.values():
-                for existing_vin in existing_tx.vin:
-                    if vin.prev_hash == existing_vin.prev_hash and vin.prev_index == existing_vin.prev_index:
-                        logger.warning(f"Rejected TX {tx_hash}: Input {vin.prev_hash.hex()}:{vin.prev_index} already spent in mempool by {existing_tx.get_hash().hex()}")
-                        return False
+            spender = self.spent_outpoints.get((vin.prev_hash.hex(), vin.prev_index))
+            if spender is not None:
+                logger.warning(f"Rejected TX {tx_hash}: Input {vin.prev_hash.hex()}:{vin.prev_index} already spent in mempool by {spender}")
+                return False
+
+        reason = self.check_chain_limits(tx)
+        if reason:
+            logger.warning(f"Rejected TX {tx_hash}: {reason}")
+            return False
+
+        self.expire(now)
+        if fee is None:
+            fee = self.get_fee(tx)
+        feerate = fee / len(tx.serialize())
+        min_feerate = self.get_min_feerate(now)
+        if feerate < min_feerate:
+            logger.warning(f"Rejected TX {tx_hash}: fee rate {feerate:.2f} below mempool minimum {min_feerate:.2f}")
+            return False
 
         # In a real node, we would validate mempool acceptance (fees, standardness, etc.)
-        self.transactions[tx_hash] = tx
+        self._index(tx_hash, tx, fee, now)
+        self.trim_to_size()
+        if tx_hash not in self.transactions:
+            logger.warning(f"Rejected TX {tx_hash}: mempool full")
+            return False
         logger.info(f"Added TX {tx_hash} to mempool. Size: {len(self.transactions)}")
-        self.save() # Auto-save on addition? Yes, for safety. Or periodic. Auto-save is safer for crashes.
+        self._append(RECORD_ADD, tx.serialize())
         return True
 
+    def check_chain_limits(self, tx):
+        """Reason tx would make an unconfirmed chain too long or too large, or None."""
+        parents = {vin.prev_hash.hex() for vin in tx.vin if vin.prev_hash.hex() in self.entries}
+        if not parents:
+            return None
+        ancestors = set(parents)
+        for parent in parents:
+            ancestors |= self.get_ancestors(parent)
+        size = len(tx.serialize())
+        if len(ancestors) + 1 > MEMPOOL_MAX_ANCESTORS:
+            return f"too many unconfirmed ancestors ({len(ancestors)})"
+        if size + sum(self.entries[a].size for a in ancestors) > MEMPOOL_MAX_ANCESTOR_SIZE:
+            return "unconfirmed ancestors too large"
+        for txid in ancestors:
+            ancestor = self.entries[txid]
+            if ancestor.descendant_count + 1 > MEMPOOL_MAX_DESCENDANTS:
+                return f"too many unconfirmed descendants of {txid}"
+            if ancestor.descendant_size + size > MEMPOOL_MAX_DESCENDANT_SIZE:
+                return f"unconfirmed descendants of {txid} too large"
+        return None
+
+    def get_view(self, chain_state=None):
+        """A MempoolView over chain_state (default: the one this pool was created with)."""
+        return MempoolView(chain_state if chain_state is not None else self.chain_state, self)
+
+    def _index(self, tx_hash, tx, fee=None, now=None):
+        if fee is None:
+            fee = self.get_fee(tx)
+        self.sequence += 1
+        entry = MempoolEntry(tx, tx_hash, fee, len(tx.serialize()), self.sequence, now)
+        self.transactions[tx_hash] = tx
+        self.entries[tx_hash] = entry
+        self.total_usage += entry.usage
+        for vin in tx.vin:
+            prev_txid = vin.prev_hash.hex()
+            self.spent_outpoints[(prev_txid, vin.prev_index)] = tx_hash
+            if prev_txid in self.entries:
+                entry.parents.add(prev_txid)
+                self.entries[prev_txid].children.add(tx_hash)
+        # Re-added after a reorg: its outputs may already be spent by pooled children
+        for i in range(len(tx.vout)):
+            child = self.spent_outpoints.get((tx_hash, i))
+            if child is not None and child in self.entries:
+                entry.children.add(child)
+                self.entries[child].parents.add(tx_hash)
+        ancestors = self._update_ancestor_state(entry)
+        bisect.insort(self.by_feerate, (entry.feerate, entry.sequence, tx_hash))
+        bisect.insort(self.by_eviction_score, (entry.eviction_score, entry.sequence, tx_hash))
+        if entry.children:
+            for txid in sorted(self.get_descendants(tx_hash), key=lambda t: self.entries[t].ancestor_count):
+                self._update_ancestor_state(self.entries[txid])
+            self._update_descendant_state(entry)
+            for txid in ancestors:
+                self._update_descendant_state(self.entries[txid])
+        else:
+            for txid in ancestors:
+                ancestor = self.entries[txid]
+                self._remove_key(self.by_eviction_score, (ancestor.eviction_score, ancestor.sequence, txid))
+                ancestor.descendant_count += 1
+                ancestor.descendant_size += entry.size
+                ancestor.descendant_fee += entry.fee
+                bisect.insort(self.by_eviction_score, (ancestor.eviction_score, ancestor.sequence, txid))
+        # Listeners read the pool, so only once the entry is fully in it
+        self._notify()
+
+    def _notify(self):
+        if self._pending_records is not None:
+            self._notify_pending = True
+            return
+        for listener in self.listeners:
+            listener(self.sequence)
+
+    def _unindex(self, tx_hash):
+        ancestors = self.get_ancestors(tx_hash)
+        descendants = self.get_descendants(tx_hash)
+        tx = self.transactions.pop(tx_hash)
+        entry = self.entries.pop(tx_hash)
+        self.total_usage -= entry.usage
+        self.sequence += 1
+        for vin in tx.vin:
+            outpoint = (vin.prev_hash.hex(), vin.prev_index)
+            if self.spent_outpoints.get(outpoint) == tx_hash:
+                del self.spent_outpoints[outpoint]
+        self._remove_key(self.by_feerate, (entry.feerate, entry.sequence, tx_hash))
+        self._remove_key(self.by_eviction_score, (entry.eviction_score, entry.sequence, tx_hash))
+
+        for parent in entry.parents:
+            self.entries[parent].children.discard(tx_hash)
+        for child in entry.children:
+            self.entries[child].parents.discard(tx_hash)
+        # Descendants left behind (e.g. the parent was confirmed) no longer count it,
+        # and its ancestors lose it (and whatever it connected them to) as a descendant
+        for txid in sorted(descendants, key=lambda t: self.entries[t].ancestor_count):
+            self._update_ancestor_state(self.entries[txid])
+        for txid in ancestors:
+            self._update_descendant_state(self.entries[txid])
+        self._notify()
+        return tx
+
+    @staticmethod
+    def _remove_key(index, key):
+        i = bisect.bisect_left(index, key)
+        if i < len(index) and index[i] == key:
+            del index[i]
+
+    def _update_ancestor_state(self, entry):
+        ancestors = self.get_ancestors(entry.txid)
+        entry.ancestor_count = 1 + len(ancestors)
+        entry.ancestor_size = entry.size + sum(self.entries[a].size for a in ancestors)
+        entry.ancestor_fee = entry.fee + sum(self.entries[a].fee for a in ancestors)
+        return ancestors
+
+    def _update_descendant_state(self, entry):
+        self._remove_key(self.by_eviction_score, (entry.eviction_score, entry.sequence, entry.txid))
+        descendants = self.get_descendants(entry.txid)
+        entry.descendant_count = 1 + len(descendants)
+        entry.descendant_size = entry.size + sum(self.entries[d].size for d in descendants)
+        entry.descendant_fee = entry.fee + sum(self.entries[d].fee for d in descendants)
+        bisect.insort(self.by_eviction_score, (entry.eviction_score, entry.sequence, entry.txid))
+
+    def get_ancestors(self, tx_hash):
+        """Txids of every in-mempool transaction tx_hash depends on (not including itself)."""
+        return self._walk(tx_hash, 'parents')
+
+    def get_descendants(self, tx_hash):
+        """Txids of every in-mempool transaction depending on tx_hash (not including itself)."""
+        return self._walk(tx_hash, 'children')
+
+    def _walk(self, tx_hash, direction):
+        seen = set()
+        stack = list(getattr(self.entries[tx_hash], direction))
+        while stack:
+            txid = stack.pop()
+            if txid in seen:
+                continue
+            seen.add(txid)
+            stack.extend(getattr(self.entries[txid], direction))
+        return seen
+
+    def get_fee(self, tx):
+        """Inputs minus outputs, resolving inputs from mempool parents and chain_state (0 if unresolvable)."""
+        values = {}
+        missing = []
+        for vin in tx.vin:
+            op = (vin.prev_hash.hex(), vin.prev_index)
+            parent = self.transactions.get(op[0])
+            if parent is not None and op[1] < len(parent.vout):
+                values[op] = parent.vout[op[1]].amount
+            else:
+                missing.append(op)
+        if missing:
+            if self.chain_state is None:
+                return 0
+            get_utxos = getattr(self.chain_state, 'get_utxos', None)
+            if get_utxos:
+                found = get_utxos(missing)
+            else:
+                found = {op: self.chain_state.get_utxo(*op) for op in missing}
+            for op in missing:
+                utxo = found.get(op)
+                if not utxo:
+                    return 0
+                values[op] = utxo['amount']
+        return max(0, sum(values.values()) - sum(out.amount for out in tx.vout))
+
     def get_transaction(self, tx_hash):
         return self.transactions.get(tx_hash)
 
+    def get_spender(self, outpoint):
+        """Hash of the mempool tx spending outpoint (txid, vout), or None."""
+        txid, vout = outpoint
+        if isinstance(txid, bytes):
+            txid = txid.hex()
+        return self.spent_outpoints.get((txid, vout))
+
+    def is_spent(self, outpoint):
+        """True if some mempool tx already spends outpoint (txid, vout)."""
+        return self.get_spender(outpoint) is not None
+
+    def get_conflicts(self, tx):
+        """Hashes of mempool txs spending any of tx's inputs."""
+        conflicts = set()
+        for vin in tx.vin:
+            spender = self.spent_outpoints.get((vin.prev_hash.hex(), vin.prev_index))
+            if spender is not None:
+                conflicts.add(spender)
+        return conflicts
+
     def remove_transaction(self, tx_hash):
         if tx_hash in self.transactions:
-            del self.transactions[tx_hash]
-            self.save() # Update persistence
+            self._unindex(tx_hash)
+            self._append(RECORD_REMOVE, bytes.fromhex(tx_hash))
             return True
         return False
+
+    def remove_with_descendants(self, tx_hash):
+        """Remove tx_hash and everything spending its outputs. Returns the removed txids."""
+        if tx_hash not in self.entries:
+            return []
+        removed = [tx_hash] + list(self.get_descendants(tx_hash))
+        # Children first, so no entry is left pointing at a removed parent's stats
+        removed.sort(key=lambda t: self.entries[t].ancestor_count, reverse=True)
+        for txid in removed:
+            self.remove_transaction(txid)
+        return removed
+
+    def on_block_connected(self, block):
+        """
+        A block joined the active chain: drop its transactions and everything that
+        conflicts with them (with descendants) in one pass, then journal the result once.
+        """
+        self._begin_batch()
+        try:
+            confirmed = 0
+            conflicts = 0
+            for tx in block.vtx:
+                tx_hash = tx.get_hash().hex()
+                self.disconnected.pop(tx_hash, None)
+                if self.remove_transaction(tx_hash):
+                    confirmed += 1
+                if not tx.is_coinbase():
+                    conflicts += len(self.remove_conflicts(tx))
+        finally:
+            self._end_batch()
+        if confirmed or conflicts:
+            logger.info(f"Block {block.get_hash().hex()[:16]}: removed {confirmed} confirmed and {conflicts} conflicting txs from mempool")
+
+    def on_block_disconnected(self, block):
+        """
+        A block left the active chain. Its transactions are held until
+        resubmit_disconnected(), called once the whole reorg has been applied.
+        """
+        txs = {tx.get_hash().hex(): tx for tx in block.vtx if not tx.is_coinbase()}
+        # Blocks come off tip first; keep earlier blocks' transactions ahead of later ones
+        txs.update(self.disconnected)
+        self.disconnected = txs
+
+    def resubmit_disconnected(self):
+        """
+        Return transactions from disconnected blocks to the pool, checked in one batch
+        against the new chain and the pool. Pooled transactions that spent one of them
+        that didn't make it back are removed. Journaled once.
+        """
+        if not self.disconnected:
+            return []
+        pending, self.disconnected = self.disconnected, {}
+        self._begin_batch()
+        try:
+            valid = self.revalidate(list(pending.values()), self.get_view())
+            added = [tx for tx in valid if self.add_transaction(tx)]
+            readded = {tx.get_hash().hex() for tx in added}
+            for tx_hash, tx in pending.items():
+                if tx_hash in readded:
+                    continue
+                for i in range(len(tx.vout)):
+                    spender = self.spent_outpoints.get((tx_hash, i))
+                    if spender is not None and spender in self.entries:
+                        self.remove_with_descendants(spender)
+        finally:
+            self._end_batch()
+        logger.info(f"Resubmitted {len(added)} of {len(pending)} transactions from disconnected blocks")
+        return added
+
+    def remove_conflicts(self, tx):
+        """
+        Remove mempool transactions that spend any of tx's inputs (tx was confirmed
+        in a block), together with their descendants. Returns the removed txids.
+        """
+        tx_hash = tx.get_hash().hex()
+        removed = []
+        for txid in self.get_conflicts(tx):
+            if txid != tx_hash and txid in self.entries:
+                logger.info(f"Removing TX {txid} from mempool: conflicts with confirmed {tx_hash}")
+                removed.extend(self.remove_with_descendants(txid))
+        return removed
+
+    def trim_to_size(self):
+        """Evict lowest-scoring packages until the pool fits in max_bytes."""
+        while self.total_usage > self.max_bytes and self.by_eviction_score:
+            score, _, txid = self.by_eviction_score[0]
+            removed = self.remove_with_descendants(txid)
+            self.evicted += len(removed)
+            # Anything paying less than what was just thrown out would be evicted next
+            self.rolling_min_feerate = max(self.rolling_min_feerate, score + MEMPOOL_INCREMENTAL_FEERATE)
+            self.last_rolling_update = time.time()
+            logger.info(f"Mempool full: evicted {len(removed)} txs at fee rate {score:.2f}, "
+                        f"minimum now {self.rolling_min_feerate:.2f}")
+
+    def get_min_feerate(self, now=None):
+        """Fee rate a new transaction must pay: the configured floor or the eviction-raised minimum."""
+        now = time.time() if now is None else now
+        if self.rolling_min_feerate > 0 and now > self.last_rolling_update:
+            halflife = MEMPOOL_MIN_FEE_HALFLIFE
+            if self.total_usage < self.max_bytes / 4:
+                halflife /= 4
+            elif self.total_usage < self.max_bytes / 2:
+                halflife /= 2
+            self.rolling_min_feerate /= 2 ** ((now - self.last_rolling_update) / halflife)
+            self.last_rolling_update = now
+            if self.rolling_min_feerate < MEMPOOL_INCREMENTAL_FEERATE / 2:
+                self.rolling_min_feerate = 0.0
+        return max(MIN_RELAY_FEERATE, self.rolling_min_feerate)
+
+    def expire(self, now=None):
+        """Drop entries (and their descendants) that have waited longer than the expiry age."""
+        now = time.time() if now is None else now
+        cutoff = now - self.expiry
+        stale = []
+        # Entries are in arrival order, so stop at the first one still in date
+        for txid, entry in self.entries.items():
+            if entry.time > cutoff:
+                break
+            stale.append(txid)
+        for txid in stale:
+            if txid in self.entries:
+                self.expired += len(self.remove_with_descendants(txid))
+
+    def get_stats(self):
+        return {
+            'transactions': len(self.entries),
+            'bytes': sum(e.size for e in self.entries.values()),
+            'usage': self.total_usage,
+            'max_usage': self.max_bytes,
+            'min_feerate': self.get_min_feerate(),
+            'evicted': self.evicted,
+            'expired': self.expired
+        }
         
     def get_all_transactions(self):
         return list(self.transactions.values())
+
+    def get_entry(self, tx_hash):
+        return self.entries.get(tx_hash)
+
+    def select_transactions(self, max_size=BLOCK_MAX_SIZE - BLOCK_RESERVED_SIZE):
+        """
+        Pick transactions for a block template, best ancestor package fee rate first,
+        until max_size bytes are used. Returns MempoolEntry objects in an order where
+        parents precede children.
+
+        Packages sit in a heap keyed by their score when the pool was snapshotted; a
+        package whose ancestors were partly included since is re-scored and pushed back.
+        """
+        heap = [(-e.ancestor_feerate, e.sequence, txid) for txid, e in self.entries.items()]
+        heapq.heapify(heap)
+        included = set()
+        selected = []
+        size_left = max_size
+        while heap and size_left > 0:
+            neg_score, sequence, txid = heapq.heappop(heap)
+            if txid in included:
+                continue
+            package = [a for a in self.get_ancestors(txid) if a not in included]
+            package.append(txid)
+            package_size = sum(self.entries[t].size for t in package)
+            package_fee = sum(self.entries[t].fee for t in package)
+            score = package_fee / package_size
+            if score != -neg_score:
+                heapq.heappush(heap, (-score, sequence, txid))
+                continue
+            if package_size > size_left:
+                continue
+            package.sort(key=lambda t: (self.entries[t].ancestor_count, self.entries[t].sequence))
+            for t in package:
+                included.add(t)
+                selected.append(self.entries[t])
+            size_left -= package_size
+        return selected
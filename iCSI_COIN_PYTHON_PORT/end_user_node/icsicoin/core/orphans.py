@@ -0,0 +1,135 @@
+import os
+import time
+import logging
+
+logger = logging.getLogger("OrphanPool")
+
+# Serialized bytes of orphan blocks held in memory before the oldest are evicted.
+ORPHAN_POOL_MAX_BYTES = int(os.getenv('ORPHAN_POOL_MAX_BYTES', 64 * 1024 * 1024))
+# Orphans any single peer may have in the pool (a getblocks batch is 500).
+ORPHAN_POOL_MAX_PER_PEER = int(os.getenv('ORPHAN_POOL_MAX_PER_PEER', 750))
+# Orphans whose parent hasn't shown up within this many seconds are dropped.
+ORPHAN_POOL_EXPIRY_SECONDS = int(os.getenv('ORPHAN_POOL_EXPIRY_SECONDS', 20 * 60))
+
+class OrphanPool:
+    """
+    Blocks received before their parent, bounded by total size, per-peer count and age.
+
+    `blocks` and `by_prev` keep the shapes ChainManager.orphan_blocks/orphan_dep always
+    had (hash -> Block, prev_hash -> [Block]); insertion order doubles as eviction order.
+    """
+    def __init__(self, max_bytes=ORPHAN_POOL_MAX_BYTES, max_per_peer=ORPHAN_POOL_MAX_PER_PEER,
+                 expiry=ORPHAN_POOL_EXPIRY_SECONDS):
+        self.max_bytes = max_bytes
+        self.max_per_peer = max_per_peer
+        self.expiry = expiry
+        self.blocks = {}   # hash -> Block
+        self.by_prev = {}  # prev_hash -> [Block] waiting for it
+        self.by_peer = {}  # peer -> {hash: None}, oldest first
+        self.meta = {}     # hash -> (size, peer, time_added)
+        self.total_bytes = 0
+        self.evicted = 0
+        self.expired = 0
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def __contains__(self, block_hash):
+        return block_hash in self.blocks
+
+    def get(self, block_hash):
+        return self.blocks.get(block_hash)
+
+    def add(self, block, peer=None, now=None):
+        """Hold an orphan. Returns False if it was already pooled or can never fit."""
+        now = time.time() if now is None else now
+        block_hash = block.get_hash().hex()
+        if block_hash in self.blocks:
+            return False
+        size = len(block.serialize())
+        if size > self.max_bytes:
+            return False
+
+        self.expire(now)
+        peer_orphans = self.by_peer.get(peer)
+        if peer is not None and peer_orphans and len(peer_orphans) >= self.max_per_peer:
+            self._evict(next(iter(peer_orphans)))
+        while self.blocks and self.total_bytes + size > self.max_bytes:
+            self._evict(next(iter(self.blocks)))
+
+        self.blocks[block_hash] = block
+        self.by_prev.setdefault(block.header.prev_block.hex(), []).append(block)
+        self.by_peer.setdefault(peer, {})[block_hash] = None
+        self.meta[block_hash] = (size, peer, now)
+        self.total_bytes += size
+        return True
+
+    def remove(self, block_hash):
+        block = self.blocks.pop(block_hash, None)
+        if block is None:
+            return None
+        size, peer, _ = self.meta.pop(block_hash)
+        self.total_bytes -= size
+
+        prev_hash = block.header.prev_block.hex()
+        siblings = self.by_prev.get(prev_hash)
+        if siblings is not None:
+            siblings[:] = [b for b in siblings if b is not block]
+            if not siblings:
+                del self.by_prev[prev_hash]
+
+        peer_orphans = self.by_peer.get(peer)
+        if peer_orphans is not None:
+            peer_orphans.pop(block_hash, None)
+            if not peer_orphans:
+                del self.by_peer[peer]
+        return block
+
+    def _evict(self, block_hash):
+        logger.debug(f"Evicting orphan {block_hash[:16]}")
+        self.evicted += 1
+        self.remove(block_hash)
+
+    def take_children(self, parent_hash):
+        """Remove and return the orphans that were waiting for parent_hash."""
+        children = list(self.by_prev.get(parent_hash, ()))
+        for block in children:
+            self.remove(block.get_hash().hex())
+        return children
+
+    def expire(self, now=None):
+        now = time.time() if now is None else now
+        cutoff = now - self.expiry
+        # Pool is in insertion order, so stop at the first orphan still in date
+        while self.blocks:
+            oldest = next(iter(self.blocks))
+            if self.meta[oldest][2] > cutoff:
+                break
+            self.expired += 1
+            self.remove(oldest)
+
+    def get_missing_ancestor(self, block_hash):
+        """
+        Follow pooled parents back from block_hash to the deepest orphan.
+        Returns (root_orphan_hash, missing_parent_hash), or None if block_hash isn't pooled.
+        """
+        if block_hash not in self.blocks:
+            return None
+        curr = block_hash
+        seen = set()
+        while True:
+            seen.add(curr)
+            prev_hash = self.blocks[curr].header.prev_block.hex()
+            if prev_hash not in self.blocks or prev_hash in seen:
+                return curr, prev_hash
+            curr = prev_hash
+
+    def get_stats(self):
+        return {
+            'orphans': len(self.blocks),
+            'bytes': self.total_bytes,
+            'max_bytes': self.max_bytes,
+            'peers': len([p for p in self.by_peer if p is not None]),
+            'evicted': self.evicted,
+            'expired': self.expired
+        }
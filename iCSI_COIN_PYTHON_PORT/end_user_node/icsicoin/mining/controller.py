@@ -1,25 +1,39 @@
+import os
 import threading
 import time
 import logging
 import binascii
 import requests
 import json
-import scrypt
-from icsicoin.core.primitives import Block, BlockHeader, Transaction
-import io
+from icsicoin.mining.workers import HashWorkers
+from icsicoin.mining.watcher import TemplateWatcher
+from icsicoin.mining.work import WorkTemplate
+from icsicoin.mining.metrics import MinerMetrics, HASHRATE_WINDOWS
 
 logger = logging.getLogger("MinerController")
 
+# Hashing processes for the built-in miner; by default every core but one, which is left to the node
+MINER_WORKERS = int(os.getenv('MINER_WORKERS', max(1, (os.cpu_count() or 1) - 1)))
+
+# Nonces tried per unit of work before rolling the extranonce and timestamp
+NONCES_PER_WORK = 1000000
+
+# Client-side timeout for a long-polling getblocktemplate (the node answers within a minute)
+LONGPOLL_HTTP_TIMEOUT = 90
+
 class MinerController:
-    def __init__(self, rpc_url, rpc_user, rpc_password):
+    def __init__(self, rpc_url, rpc_user, rpc_password, workers=MINER_WORKERS):
         self.rpc_url = rpc_url
         self.rpc_auth = (rpc_user, rpc_password)
         self.mining_thread = None
         self.stop_event = threading.Event()
         self.target_address = None
         self.is_mining = False
-        self.logs = [] # Simple in-memory log buffer
-        self.hashrate = 0.0
+        self.logs = [] # In-memory log buffer of {"time", "level", "message"}
+        self.hashrate = 0.0 # Over the shortest metrics window
+        self.worker_count = workers
+        self.hash_workers = None # HashWorkers while the mining thread runs
+        self.metrics = MinerMetrics()
 
     def set_credentials(self, user, password):
         self.rpc_auth = (user, password)
@@ -29,17 +43,7 @@ class MinerController:
         if self.is_mining:
             return False, "Already mining"
         
-        self.target_address = target_address # Note: In current miner.py, address is implicitly whoever controls the node/RPC or the coinbases.
-        # Wait, getblocktemplate usually creates a coinbase for the address in the wallet of the node, 
-        # UNLESS we construct the coinbase ourselves.
-        # The current miner.py does NOT construct coinbase. It takes 'transactions' from template which ALREADY includes coinbase.
-        # So 'target_address' here is actually purely cosmetic UNLESS we modify getblocktemplate to accept a target address
-        # OR we modify the miner to rebuild the coinbase.
-        # Protocol: getblocktemplate usually supports a wallet address param OR we stick to the node's wallet.
-        # For Phase 9, let's assume the NODE's wallet (RPC) gets the reward.
-        # User selection of "Target Wallet" might be misleading if we don't pass it to the Node/RPC.
-        # TODO: RPC `getblocktemplate` SHOULD support generating coinbase for specific address.
-        # FOR NOW: We will log the warning that rewards go to Node Default Wallet.
+        self.target_address = target_address
         
         self.stop_event.clear()
         self.is_mining = True
@@ -55,29 +59,38 @@ class MinerController:
         
         self.stop_event.set()
         self.is_mining = False
+        if self.hash_workers:
+            self.hash_workers.interrupt()
         if self.mining_thread:
-            self.mining_thread.join(timeout=2.0)
+            # The thread shuts the hashing processes down on its way out
+            self.mining_thread.join(timeout=5.0)
         self._log("Mining stopped.")
         self.hashrate = 0.0
         return True, "Mining stopped"
 
     def get_status(self):
+        metrics = self.get_metrics()
         return {
             "is_mining": self.is_mining,
             "hashrate": self.hashrate,
+            "workers": self.worker_count,
+            "worker_hashrates": metrics["worker_hashrates"],
             "target": self.target_address,
+            "metrics": metrics,
             "logs": self.logs[-50:] # Last 50 lines
         }
 
-    def _log(self, msg):
-        timestamp = time.strftime("%H:%M:%S")
-        entry = f"[{timestamp}] {msg}"
-        self.logs.append(entry)
+    def get_metrics(self):
+        return dict(self.metrics.snapshot(), is_mining=self.is_mining, workers=self.worker_count)
+
+    def _log(self, msg, level="info"):
+        """level is one of info, success, warning or error; the dashboard colours by it."""
+        self.logs.append({"time": time.strftime("%H:%M:%S"), "level": level, "message": msg})
         if len(self.logs) > 100:
             self.logs.pop(0)
-        logger.info(f"MINER LOG: {msg}")
+        logger.log(logging.WARNING if level in ("warning", "error") else logging.INFO, f"MINER LOG: {msg}")
 
-    def _rpc_call(self, method, params=None):
+    def _rpc_call(self, method, params=None, timeout=5):
         payload = {
             "method": method,
             "params": params or [],
@@ -85,7 +98,7 @@ class MinerController:
             "id": 1,
         }
         try:
-            response = requests.post(self.rpc_url, json=payload, auth=self.rpc_auth, timeout=5)
+            response = requests.post(self.rpc_url, json=payload, auth=self.rpc_auth, timeout=timeout)
             response.raise_for_status()
             return response.json()
         except Exception as e:
@@ -93,97 +106,120 @@ class MinerController:
             return None
 
     def _mine_loop(self):
-        while not self.stop_event.is_set():
-            # 1. Get Work
-            params = []
+        # Hashing happens in worker processes; this thread only fetches work, watches
+        # for stale tips and submits, so it spends its time blocked outside the GIL.
+        workers = HashWorkers(self.worker_count)
+        try:
+            workers.start()
+        except Exception as e:
+            self._log(f"Could not start hashing processes: {e}", "error")
+            self.is_mining = False
+            return
+        self.hash_workers = workers
+        self.metrics.start_session()
+        self.metrics.sample(workers.get_total_hashes(), [0.0] * workers.workers)
+        self._log(f"Hashing with {workers.workers} worker process(es)")
+
+        # Long-polls the node for newer work, interrupting the wait below when it arrives
+        def fetch_newer(longpollid):
+            params = {"longpollid": longpollid}
             if self.target_address:
-                params.append({"mining_address": self.target_address})
-            resp = self._rpc_call("getblocktemplate", params)
+                params["mining_address"] = self.target_address
+            resp = self._rpc_call("getblocktemplate", [params], timeout=LONGPOLL_HTTP_TIMEOUT)
             if not resp or resp.get('error'):
-                self._log("Waiting for RPC/Work...")
-                time.sleep(2)
-                continue
-                
-            template = resp['result']
-            height = template['height']
-            target = int(template['target'], 16)
-            bits = template['bits']
-            
-            # 2. Parse Header
-            current_prev_hash_hex = template['previousblockhash'] # Keep for stale check
-            prev_hash = binascii.unhexlify(current_prev_hash_hex)
-            merkle_root = binascii.unhexlify(template['merkle_root'])
-            timestamp = template['curtime']
-            version = template['version']
-            
-            header = BlockHeader(version, prev_hash, merkle_root, timestamp, bits, 0)
-            
-            tx_count = len(template.get('transactions', []))
-            self._log(f"Mining Block {height}... Tx Count: {tx_count} | Block_Difficulty: {bits}")
-            
-            start_time = time.time()
-            last_report_time = start_time
-            last_check_time = start_time
-            hashes = 0
-            
-            # Nonce loop (chunked)
-            # We use a large range, but we break out if we find it OR if stale
-            for nonce in range(0, 1000000):
-                if self.stop_event.is_set():
-                    break
-                    
-                header.nonce = nonce
-                header_bytes = header.serialize()
-                pow_hash = scrypt.hash(header_bytes, header_bytes, N=1024, r=1, p=1, buflen=32)
-                pow_int = int.from_bytes(pow_hash, 'little')
-                hashes += 1
+                return None
+            self.metrics.template_fetched()
+            return resp['result']
+        watcher = TemplateWatcher(fetch_newer, on_change=workers.interrupt)
+        watcher.start()
+
+        template = None
+        try:
+            while not self.stop_event.is_set():
+                # 1. Get Work (unless the long poll already brought it)
+                if template is None:
+                    params = []
+                    if self.target_address:
+                        params.append({"mining_address": self.target_address})
+                    resp = self._rpc_call("getblocktemplate", params)
+                    if not resp or resp.get('error'):
+                        self._log("Waiting for RPC/Work...")
+                        self.stop_event.wait(2)
+                        continue
+                    template = resp['result']
+                    self.metrics.template_fetched()
+                work = WorkTemplate(template)
+                height = work.height
+                current_prev_hash_hex = template['previousblockhash']
                 
-                now = time.time()
+                tx_count = len(template.get('transactions', []))
+                self._log(f"Mining Block {height}... Tx Count: {tx_count} | Block_Difficulty: {work.bits}")
                 
-                # GIL YIELD: Sleep 0 every slice to let Asyncio network thread run
-                # 10k hashes is a reasonable chunk size.
-                if hashes % 10000 == 0:
-                     time.sleep(0) 
+                start_time = time.time()
+                last_report_time = start_time
+                last_rate_time = start_time
                 
-                # Report hash rate every 10 seconds
-                if now - last_report_time >= 10:
-                    elapsed = now - start_time
-                    rate = hashes / elapsed if elapsed > 0 else 0
-                    self._log(f"⛏ Hash Rate: {rate:.1f} H/s | {hashes} hashes in {elapsed:.0f}s")
-                    last_report_time = now
-                    
-                # STALE TIP CHECK: Every 2.0 seconds
-                if now - last_check_time >= 2.0:
-                    last_check_time = now
-                    best_resp = self._rpc_call("getbestblockhash")
-                    if best_resp and 'result' in best_resp:
-                        network_tip = best_resp['result']
-                        if network_tip != current_prev_hash_hex:
-                            self._log(f"<span class='yellow'>STALE TIP DETECTED! Restarting...</span>")
-                            break # Break nonce loop, get new template instantly
-
-                if pow_int <= target:
-                    self._log(f"<span class='green'>FOUND BLOCK! Nonce: {nonce}</span>")
-                    
-                    # Submit
-                    txs = []
-                    for tx_hex in template['transactions']:
-                        tx_bytes = binascii.unhexlify(tx_hex)
-                        txs.append(Transaction.deserialize(io.BytesIO(tx_bytes)))
-                    block = Block(header, txs)
-                    block_hex = binascii.hexlify(block.serialize()).decode('utf-8')
+                # Workers split each nonce range; we break out if one finds it OR if the watcher brings newer work
+                watcher.watch(template)
+                found = None
+                while not found and not watcher.stale and not self.stop_event.is_set():
+                    # 2. Fresh extranonce/curtime for every nonce range; no round trip to the node
+                    header, coinbase = work.next_work()
+                    workers.submit(header.serialize(), work.target, 0, NONCES_PER_WORK)
+                    while not workers.exhausted and not watcher.stale and not self.stop_event.is_set():
+                        found = workers.wait(timeout=max(0.0, last_rate_time + 2.0 - time.time()))
+                        if found:
+                            break
+                        
+                        now = time.time()
+                        if now - last_rate_time >= 2.0:
+                            last_rate_time = now
+                            self.metrics.sample(workers.get_total_hashes(), workers.get_hashrates(), now)
+                            self.hashrate = self.metrics.hashrate(HASHRATE_WINDOWS[0], now)
+                        
+                        # Report hash rate every 10 seconds
+                        if now - last_report_time >= 10:
+                            rates = " | ".join(f"{w}s {self.metrics.hashrate(w, now):.1f}" for w in HASHRATE_WINDOWS)
+                            self._log(f"Hash Rate (H/s): {rates}")
+                            last_report_time = now
+                # Stop every worker before moving to new work
+                workers.cancel()
+                arrived_at = watcher.arrived_at
+                newer = watcher.take()
+
+                if found:
+                    nonce = found[0]
+                    header.nonce = nonce
+                    self._log(f"FOUND BLOCK! Nonce: {nonce}", "success")
                     
-                    submit_resp = self._rpc_call("submitblock", [block_hex])
-                    if submit_resp and submit_resp['result'] == 'accepted':
-                        self._log(f"<span class='cyan'>Block {height} ACCEPTED!</span>")
-                        elapsed = time.time() - start_time
-                        rate = hashes / elapsed if elapsed > 0 else 0
-                        self._log(f"⛏ {hashes} hashes in {elapsed:.1f}s ({rate:.1f} H/s)")
+                    # Submit: the node rebuilds the block from its copy of the template
+                    params = work.solution_params(header, coinbase)
+                    submit_resp = self._rpc_call("submitsolution", params) if params else None
+                    if not submit_resp or submit_resp.get('result') in (None, 'rejected: unknown-template'):
+                        # Older node, or it no longer has the template: send the whole block
+                        block = work.build_block(header, coinbase)
+                        block_hex = binascii.hexlify(block.serialize()).decode('utf-8')
+                        submit_resp = self._rpc_call("submitblock", [block_hex])
+                    accepted = bool(submit_resp) and submit_resp['result'] == 'accepted'
+                    self.metrics.block_found(accepted)
+                    if accepted:
+                        self._log(f"Block {height} ACCEPTED after {time.time() - start_time:.1f}s", "success")
                     else:
-                        self._log(f"<span class='red'>Block Rejected</span>")
-                    
-                    break
-                
-                # No sleep here, we want max hashrate within the python limits
-            
-            # If loop finishes (not found) or we broke out (stale), we loop back to Get Work
+                        reason = submit_resp['result'] if submit_resp else "no response"
+                        self._log(f"Block Rejected ({reason})", "error")
+                    template = None
+                elif newer:
+                    if newer['previousblockhash'] != current_prev_hash_hex:
+                        # From the long poll bringing the new tip to the workers being told to drop the old one
+                        abandon = time.time() - arrived_at
+                        self.metrics.stale_work(abandon)
+                        self._log(f"STALE TIP DETECTED! Restarting... (old work dropped in {abandon * 1000:.1f} ms)", "warning")
+                    template = newer
+                else:
+                    # Stopping: loop back to Get Work
+                    template = None
+        finally:
+            watcher.stop()
+            workers.close()
+            self.hash_workers = None
+            self.metrics.end_session()
@@ -0,0 +1,104 @@
+import time
+import threading
+from collections import deque
+
+# Rolling windows (seconds) the miner's hashrate is reported over
+HASHRATE_WINDOWS = (10, 60, 600)
+
+# Recent stale-work abandonments kept for the time-to-abandon figures
+ABANDON_SAMPLES = 100
+
+class MinerMetrics:
+    """
+    Counters and rolling rates for the built-in miner.
+
+    The mining thread records into it (hash counter samples, templates, stale
+    work, blocks); the web and RPC handlers read snapshot() from the event loop.
+    Hashrates over each HASHRATE_WINDOWS window come from the workers' total hash
+    counter, sampled every couple of seconds and kept for the longest window.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = deque() # (time, total hashes since the workers started)
+        self.worker_hashrates = []
+        self.templates_fetched = 0
+        self.stale_abandoned = 0
+        self.abandon_times = deque(maxlen=ABANDON_SAMPLES) # Seconds from new tip seen to old work dropped
+        self.blocks_found = 0
+        self.blocks_accepted = 0
+        self.blocks_rejected = 0
+        self.started = None
+
+    def start_session(self):
+        """Hash counters restart with every set of workers; counts carry on."""
+        with self.lock:
+            self.samples.clear()
+            self.worker_hashrates = []
+            self.started = time.time()
+
+    def end_session(self):
+        with self.lock:
+            self.samples.clear()
+            self.worker_hashrates = []
+            self.started = None
+
+    def sample(self, total_hashes, worker_hashrates, now=None):
+        now = time.time() if now is None else now
+        with self.lock:
+            self.samples.append((now, total_hashes))
+            while len(self.samples) > 2 and self.samples[1][0] <= now - HASHRATE_WINDOWS[-1]:
+                self.samples.popleft()
+            self.worker_hashrates = list(worker_hashrates)
+
+    def template_fetched(self):
+        with self.lock:
+            self.templates_fetched += 1
+
+    def stale_work(self, seconds_to_abandon):
+        with self.lock:
+            self.stale_abandoned += 1
+            self.abandon_times.append(seconds_to_abandon)
+
+    def block_found(self, accepted):
+        with self.lock:
+            self.blocks_found += 1
+            if accepted:
+                self.blocks_accepted += 1
+            else:
+                self.blocks_rejected += 1
+
+    def hashrate(self, window, now=None):
+        """Hashes per second over the last `window` seconds (or as much of it as was sampled)."""
+        now = time.time() if now is None else now
+        with self.lock:
+            if len(self.samples) < 2:
+                return 0.0
+            last_time, last_count = self.samples[-1]
+            first_time, first_count = self.samples[0]
+            for sample_time, count in self.samples:
+                if sample_time > now - window:
+                    break
+                first_time, first_count = sample_time, count
+        elapsed = last_time - first_time
+        return (last_count - first_count) / elapsed if elapsed > 0 else 0.0
+
+    def snapshot(self):
+        now = time.time()
+        hashrates = {f"{w}s" if w < 60 else f"{w // 60}m": round(self.hashrate(w, now), 1) for w in HASHRATE_WINDOWS}
+        with self.lock:
+            abandon = sorted(self.abandon_times)
+            return {
+                "uptime": round(now - self.started, 1) if self.started else 0,
+                "hashrate": hashrates,
+                "worker_hashrates": [round(r, 1) for r in self.worker_hashrates],
+                "templates_fetched": self.templates_fetched,
+                "stale_abandoned": self.stale_abandoned,
+                "time_to_abandon_ms": {
+                    "last": round(self.abandon_times[-1] * 1000, 2) if abandon else None,
+                    "median": round(abandon[len(abandon) // 2] * 1000, 2) if abandon else None,
+                    "max": round(abandon[-1] * 1000, 2) if abandon else None,
+                },
+                "blocks_found": self.blocks_found,
+                "blocks_accepted": self.blocks_accepted,
+                "blocks_rejected": self.blocks_rejected,
+            }
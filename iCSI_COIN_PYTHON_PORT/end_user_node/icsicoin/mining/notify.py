@@ -0,0 +1,126 @@
+import os
+import asyncio
+import logging
+import threading
+
+logger = logging.getLogger("WorkNotifier")
+
+# Mempool changes are pushed to subscribers at most this often (seconds); tip changes go out at once
+PUSH_MEMPOOL_INTERVAL = float(os.getenv('PUSH_MEMPOOL_INTERVAL', 1.0))
+
+# Events a slow push subscriber may fall behind by before it is dropped
+PUSH_QUEUE_SIZE = 100
+
+class WorkNotifier:
+    """
+    Tells miners when their work goes stale.
+
+    Registered as a ChainManager and Mempool listener. Long-polling getblocktemplate
+    calls wait() on it; push subscribers get a queue of events:
+      {"event": "tip", "hash": ..., "height": ...}   as soon as the tip changes
+      {"event": "mempool", "sequence": ...}           coalesced, at most every PUSH_MEMPOOL_INTERVAL
+    Listeners may fire on any thread; waiters are woken on the event loop given to start().
+    """
+    def __init__(self):
+        self.loop = None
+        self.loop_thread = None
+        self.tip_event = None # Replaced after every tip change
+        self.any_event = None # Replaced after every tip or mempool change
+        self.waiting = 0
+        self.subscribers = set()
+        self.mempool_sequence = None
+        self._mempool_push = None # Pending coalesced mempool push
+        self.closed = False
+
+    def start(self, loop=None):
+        self.loop = loop or asyncio.get_running_loop()
+        self.loop_thread = threading.get_ident()
+        self.tip_event = asyncio.Event()
+        self.any_event = asyncio.Event()
+
+    def close(self):
+        """Ends every push subscription (their handlers see None) and releases waiters."""
+        self.closed = True
+        if self.loop is not None:
+            self._wake(tip=True)
+        for queue in self.subscribers:
+            queue.put_nowait(None)
+        self.subscribers = set()
+        if self._mempool_push:
+            self._mempool_push.cancel()
+            self._mempool_push = None
+
+    # --- Listeners ---
+
+    def on_tip_changed(self, entry):
+        self._call(self._tip_changed, entry.hash, entry.height)
+
+    def on_mempool_changed(self, sequence):
+        self.mempool_sequence = sequence
+        if self.waiting or self.subscribers:
+            self._call(self._mempool_changed)
+
+    def _call(self, func, *args):
+        if self.loop is None:
+            return # Not serving yet, so nobody to tell
+        if threading.get_ident() == self.loop_thread:
+            func(*args)
+        else:
+            self.loop.call_soon_threadsafe(func, *args)
+
+    def _tip_changed(self, block_hash, height):
+        self._wake(tip=True)
+        self._publish({"event": "tip", "hash": block_hash, "height": height})
+
+    def _mempool_changed(self):
+        self._wake(tip=False)
+        if self.subscribers and self._mempool_push is None:
+            self._mempool_push = self.loop.call_later(PUSH_MEMPOOL_INTERVAL, self._push_mempool)
+
+    def _push_mempool(self):
+        self._mempool_push = None
+        self._publish({"event": "mempool", "sequence": self.mempool_sequence})
+
+    def _wake(self, tip):
+        if tip:
+            event, self.tip_event = self.tip_event, asyncio.Event()
+            event.set()
+        event, self.any_event = self.any_event, asyncio.Event()
+        event.set()
+
+    def _publish(self, event):
+        for queue in list(self.subscribers):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                logger.warning("Dropping push subscriber that stopped reading")
+                self.subscribers.discard(queue)
+                queue.get_nowait()
+                queue.put_nowait(None)
+
+    # --- Consumers ---
+
+    async def wait(self, timeout, mempool=True):
+        """
+        Wait up to timeout seconds for the next tip change (or any mempool change
+        too, with mempool=True). Returns False on timeout.
+        """
+        if self.loop is None:
+            self.start()
+        event = self.any_event if mempool else self.tip_event
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self.waiting -= 1
+
+    def subscribe(self):
+        queue = asyncio.Queue(PUSH_QUEUE_SIZE)
+        self.subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue):
+        self.subscribers.discard(queue)
@@ -0,0 +1,454 @@
+import os
+import io
+import json
+import time
+import socket
+import asyncio
+import logging
+import binascii
+import threading
+from collections import deque, OrderedDict
+from icsicoin.core.primitives import Block, BlockHeader, Transaction
+from icsicoin.core.hashing import double_sha256
+from icsicoin.consensus.merkle import get_merkle_root_from_branch
+from icsicoin.consensus.validation import bits_to_target
+from icsicoin.mining.template import EXTRANONCE_SIZE
+from icsicoin.consensus.proof_of_work import hash_header
+
+logger = logging.getLogger("StratumServer")
+
+# Expected hashes per share: the share target is 2^256 / difficulty (never harder than a block)
+STRATUM_SHARE_DIFFICULTY = int(os.getenv('STRATUM_SHARE_DIFFICULTY', 1024))
+
+# Mempool changes re-issue jobs at most this often (seconds); a new tip always goes out at once
+STRATUM_JOB_REFRESH = int(os.getenv('STRATUM_JOB_REFRESH', 30))
+
+# Per-miner hashrate is estimated from the shares accepted in this window (seconds)
+STRATUM_HASHRATE_WINDOW = 300
+
+# The node's extranonce is split: a per-connection part we assign, and the part miners roll
+EXTRANONCE1_SIZE = 4
+EXTRANONCE2_SIZE = EXTRANONCE_SIZE - EXTRANONCE1_SIZE
+
+# Jobs kept for late submissions; older ones are answered as stale
+MAX_JOBS = 256
+
+# Unsent bytes a miner may have queued before it is considered dead and dropped
+MAX_WRITE_BUFFER = 256 * 1024
+
+class StratumJob:
+    __slots__ = ('job_id', 'template', 'coinbase_prefix', 'coinbase_suffix', 'merkle_branch',
+                 'prev_hash', 'version', 'bits', 'curtime', 'target', 'submitted')
+
+    def __init__(self, job_id, template):
+        self.job_id = job_id
+        self.template = template
+        self.coinbase_prefix = bytes.fromhex(template['coinbase_prefix'])
+        self.coinbase_suffix = bytes.fromhex(template['coinbase_suffix'])
+        self.merkle_branch = [bytes.fromhex(h) for h in template['merkle_branch']]
+        self.prev_hash = bytes.fromhex(template['previousblockhash'])
+        self.version = template['version']
+        self.bits = template['bits']
+        self.curtime = template['curtime']
+        self.target = int(template['target'], 16)
+        self.submitted = set() # (extranonce1, extranonce2, ntime, nonce) already seen
+
+    def notify_params(self, clean):
+        t = self.template
+        return [self.job_id, t['previousblockhash'], t['coinbase_prefix'], t['coinbase_suffix'], t['merkle_branch'],
+                self.version, self.bits, self.curtime, t['height'], clean]
+
+class StratumMiner:
+    """One connected miner and its share accounting."""
+    def __init__(self, writer, extranonce1):
+        self.writer = writer
+        self.peer = writer.get_extra_info('peername')
+        self.extranonce1 = extranonce1
+        self.subscribed = False
+        self.worker = None
+        self.address = None # Payout address (hex pubkey hash); None pays the node's wallet
+        self.connected_at = time.time()
+        self.accepted = 0
+        self.rejected = 0
+        self.stale = 0
+        self.blocks = 0
+        self.last_share = None
+        self.share_times = deque() # Accepted share times inside STRATUM_HASHRATE_WINDOW
+
+    def send(self, message):
+        if self.writer.transport.get_write_buffer_size() > MAX_WRITE_BUFFER:
+            raise ConnectionError("miner is not reading")
+        self.writer.write((json.dumps(message) + "\n").encode())
+
+    def get_hashrate(self, difficulty, now=None):
+        now = now or time.time()
+        while self.share_times and self.share_times[0] < now - STRATUM_HASHRATE_WINDOW:
+            self.share_times.popleft()
+        window = min(STRATUM_HASHRATE_WINDOW, now - self.connected_at)
+        return len(self.share_times) * difficulty / window if window > 0 else 0.0
+
+class StratumServer:
+    """
+    Stratum-style mining over line-delimited JSON on a plain TCP socket.
+
+    mining.subscribe    -> [subscriptions, extranonce1 hex, extranonce2 size]
+    mining.authorize    [worker, password]; a worker named "<40-hex address>[.name]" is paid
+                        to that address, anything else to the node's wallet
+    mining.notify       (pushed) [job_id, prev hash, coinbase prefix, coinbase suffix, merkle
+                        branch, version, bits, curtime, height, clean_jobs]
+    mining.set_difficulty (pushed) [expected hashes per share]
+    mining.submit       [worker, job_id, extranonce2 hex, ntime, nonce]
+
+    Jobs come from the shared TemplateCache and go to every miner as soon as the
+    tip changes (mempool changes at most every STRATUM_JOB_REFRESH). The coinbase
+    extranonce is extranonce1 + extranonce2, so miners never overlap. Shares are
+    checked here; one that meets the block target is turned into a full block from
+    the job's template and connected, so miners only ever send a few numbers.
+    """
+    def __init__(self, port, chain_manager, templates, notifier, wallet, network_manager=None,
+                 bind_address='0.0.0.0', share_difficulty=STRATUM_SHARE_DIFFICULTY):
+        self.port = port
+        self.bind_address = bind_address
+        self.chain_manager = chain_manager
+        self.templates = templates
+        self.notifier = notifier
+        self.wallet = wallet
+        self.network_manager = network_manager
+        self.share_difficulty = share_difficulty
+        self.share_target = (1 << 256) // share_difficulty
+        self.miners = set()
+        self.jobs = OrderedDict() # job_id -> StratumJob, oldest first
+        self.current_jobs = {} # payout address -> StratumJob for the latest work
+        self.next_job_id = 0
+        self.next_extranonce1 = 0
+        self.last_refresh = 0
+        self.blocks_found = 0
+        self.server = None
+        self.watch_task = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle_client, self.bind_address, self.port)
+        self.watch_task = asyncio.create_task(self._watch_work())
+        logger.info(f"Stratum server listening on port {self.port} (share difficulty {self.share_difficulty})")
+
+    async def stop(self):
+        if self.watch_task:
+            self.watch_task.cancel()
+        if self.server:
+            self.server.close()
+            for miner in list(self.miners):
+                miner.writer.close()
+            await self.server.wait_closed()
+        logger.info("Stratum server stopped")
+
+    # --- Work distribution ---
+
+    async def _watch_work(self):
+        queue = self.notifier.subscribe()
+        try:
+            while True:
+                event = await queue.get()
+                if event is None:
+                    return
+                if event['event'] == 'tip':
+                    self.broadcast(clean=True)
+                elif time.time() - self.last_refresh >= STRATUM_JOB_REFRESH:
+                    self.broadcast(clean=False)
+        finally:
+            self.notifier.unsubscribe(queue)
+
+    def broadcast(self, clean):
+        """Send every authorized miner a job for the current template."""
+        self.last_refresh = time.time()
+        if clean:
+            self.jobs.clear() # Work on the old tip can't make a block any more
+        self.current_jobs = {}
+        for miner in list(self.miners):
+            if miner.worker is not None:
+                self._send_job(miner, clean)
+
+    def _get_job(self, address):
+        job = self.current_jobs.get(address)
+        if job is None:
+            template = self.templates.get_template(address or self._default_address())
+            self.next_job_id += 1
+            job = StratumJob(format(self.next_job_id, 'x'), template)
+            self.jobs[job.job_id] = job
+            while len(self.jobs) > MAX_JOBS:
+                self.jobs.popitem(last=False)
+            self.current_jobs[address] = job
+        return job
+
+    def _default_address(self):
+        addrs = self.wallet.get_addresses()
+        if not addrs:
+            self.wallet.get_new_address()
+            addrs = self.wallet.get_addresses()
+        return addrs[0]
+
+    def _send_job(self, miner, clean):
+        try:
+            miner.send({"id": None, "method": "mining.notify", "params": self._get_job(miner.address).notify_params(clean)})
+        except ConnectionError:
+            self._drop(miner)
+
+    def _drop(self, miner):
+        logger.info(f"Dropping miner {miner.worker or miner.peer}")
+        self.miners.discard(miner)
+        miner.writer.close()
+
+    # --- Connections ---
+
+    async def _handle_client(self, reader, writer):
+        self.next_extranonce1 = (self.next_extranonce1 + 1) % (1 << (8 * EXTRANONCE1_SIZE))
+        miner = StratumMiner(writer, self.next_extranonce1.to_bytes(EXTRANONCE1_SIZE, 'big'))
+        self.miners.add(miner)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    method = request.get('method')
+                    params = request.get('params') or []
+                except (ValueError, AttributeError):
+                    miner.send({"id": None, "result": None, "error": [20, "Invalid JSON", None]})
+                    continue
+                result, error = await self._dispatch(miner, method, params)
+                miner.send({"id": request.get('id'), "result": result, "error": error})
+                if method == 'mining.authorize' and result:
+                    miner.send({"id": None, "method": "mining.set_difficulty", "params": [self.share_difficulty]})
+                    self._send_job(miner, clean=True)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.CancelledError):
+            pass # Disconnected, or the server is shutting down
+        finally:
+            self.miners.discard(miner)
+            writer.close()
+
+    async def _dispatch(self, miner, method, params):
+        if method == 'mining.subscribe':
+            miner.subscribed = True
+            return [[["mining.notify", miner.extranonce1.hex()]], miner.extranonce1.hex(), EXTRANONCE2_SIZE], None
+        if method == 'mining.authorize':
+            if not params:
+                return False, [20, "Missing worker name", None]
+            miner.worker = str(params[0])
+            address = miner.worker.split('.')[0]
+            miner.address = address.lower() if len(address) == 40 and all(c in '0123456789abcdefABCDEF' for c in address) else None
+            logger.info(f"Miner {miner.worker} authorized from {miner.peer}, paying {miner.address or 'node wallet'}")
+            return True, None
+        if method == 'mining.submit':
+            if miner.worker is None:
+                return None, [24, "Unauthorized worker", None]
+            return await self._submit(miner, params)
+        return None, [20, f"Unknown method {method}", None]
+
+    # --- Shares ---
+
+    async def _submit(self, miner, params):
+        try:
+            _, job_id, extranonce2_hex, ntime, nonce = params[:5]
+            extranonce2 = bytes.fromhex(extranonce2_hex)
+            ntime, nonce = int(ntime), int(nonce)
+        except (ValueError, TypeError):
+            miner.rejected += 1
+            return None, [20, "Malformed submission", None]
+        job = self.jobs.get(job_id)
+        if job is None:
+            miner.stale += 1
+            return None, [21, "Job not found (stale)", None]
+        if len(extranonce2) != EXTRANONCE2_SIZE or not 0 <= nonce < (1 << 32):
+            miner.rejected += 1
+            return None, [20, "Bad extranonce2 or nonce", None]
+        if not job.curtime <= ntime <= time.time() + 7200:
+            miner.rejected += 1
+            return None, [20, "ntime out of range", None]
+        key = (miner.extranonce1, extranonce2, ntime, nonce)
+        if key in job.submitted:
+            miner.rejected += 1
+            return None, [22, "Duplicate share", None]
+        job.submitted.add(key)
+
+        coinbase = job.coinbase_prefix + miner.extranonce1 + extranonce2 + job.coinbase_suffix
+        merkle_root = get_merkle_root_from_branch(double_sha256(coinbase), job.merkle_branch)
+        header = BlockHeader(job.version, job.prev_hash, merkle_root, ntime, job.bits, nonce)
+        # Off the event loop: with many miners, share hashing would stall peers and RPC
+        pow_hash = await asyncio.get_running_loop().run_in_executor(None, hash_header, header.serialize())
+        pow_int = int.from_bytes(pow_hash, 'little')
+        if pow_int > max(self.share_target, job.target):
+            miner.rejected += 1
+            return None, [23, "Low difficulty share", None]
+
+        now = time.time()
+        miner.accepted += 1
+        miner.last_share = now
+        miner.share_times.append(now)
+        if pow_int <= job.target:
+            self._submit_block(miner, job, header, coinbase)
+        return True, None
+
+    def _submit_block(self, miner, job, header, coinbase):
+        txs = [Transaction.deserialize(io.BytesIO(coinbase))]
+        for tx_hex in job.template['transactions'][1:]:
+            txs.append(Transaction.deserialize(io.BytesIO(binascii.unhexlify(tx_hex))))
+        block = Block(header, txs)
+        success, reason = self.chain_manager.process_block(block)
+        if success:
+            miner.blocks += 1
+            self.blocks_found += 1
+            logger.info(f"Block {block.get_hash().hex()[:16]} at height {job.template['height']} found by {miner.worker}")
+            if self.network_manager is not None:
+                asyncio.create_task(self.network_manager.announce_new_block(block))
+        else:
+            logger.warning(f"Block from {miner.worker} rejected: {reason}")
+
+    def get_stats(self):
+        now = time.time()
+        miners = []
+        for miner in self.miners:
+            if miner.worker is None:
+                continue
+            miners.append({
+                'worker': miner.worker,
+                'peer': f"{miner.peer[0]}:{miner.peer[1]}" if miner.peer else None,
+                'address': miner.address,
+                'accepted': miner.accepted,
+                'rejected': miner.rejected,
+                'stale': miner.stale,
+                'blocks': miner.blocks,
+                'hashrate': round(miner.get_hashrate(self.share_difficulty, now), 1),
+                'last_share': miner.last_share,
+            })
+        return {
+            'port': self.port,
+            'share_difficulty': self.share_difficulty,
+            'miners': miners,
+            'hashrate': round(sum(m['hashrate'] for m in miners), 1),
+            'blocks_found': self.blocks_found,
+            'jobs': len(self.jobs),
+        }
+
+class StratumClient:
+    """
+    Miner side of StratumServer: a socket plus a reader thread that keeps the
+    latest job and counts share results. on_job() is called (from the reader
+    thread) whenever a new job arrives or the connection drops.
+    """
+    def __init__(self, host, port, on_job=None):
+        self.host = host
+        self.port = port
+        self.on_job = on_job
+        self.sock = None
+        self.cond = threading.Condition()
+        self.connected = False
+        self.extranonce1 = None
+        self.extranonce2_size = None
+        self.difficulty = 1
+        self.job = None # Latest mining.notify params
+        self.job_seq = 0
+        self.next_id = 0
+        self.responses = {} # request id -> (result, error), for call()
+        self.submits = set() # request ids of shares awaiting an answer
+        self.accepted = 0
+        self.rejected = 0
+
+    def connect(self, worker, password=''):
+        self.sock = socket.create_connection((self.host, self.port), timeout=30)
+        self.sock.settimeout(None)
+        self.connected = True
+        threading.Thread(target=self._read_loop, name="stratum-reader", daemon=True).start()
+        result, error = self.call('mining.subscribe', ['icsicoin-miner'])
+        if error:
+            raise ConnectionError(f"subscribe failed: {error}")
+        self.extranonce1 = bytes.fromhex(result[1])
+        self.extranonce2_size = result[2]
+        result, error = self.call('mining.authorize', [worker, password])
+        if not result:
+            raise ConnectionError(f"authorize failed: {error}")
+
+    def close(self):
+        if self.sock:
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self.sock.close()
+
+    def _send(self, method, params):
+        with self.cond:
+            self.next_id += 1
+            request_id = self.next_id
+        self.sock.sendall((json.dumps({"id": request_id, "method": method, "params": params}) + "\n").encode())
+        return request_id
+
+    def call(self, method, params, timeout=30):
+        request_id = self._send(method, params)
+        with self.cond:
+            if not self.cond.wait_for(lambda: request_id in self.responses or not self.connected, timeout):
+                raise ConnectionError(f"{method} timed out")
+            if request_id not in self.responses:
+                raise ConnectionError("connection closed")
+            return self.responses.pop(request_id)
+
+    def submit(self, worker, job_id, extranonce2, ntime, nonce):
+        """Send a share without waiting; the answer lands in accepted/rejected."""
+        request_id = self._send('mining.submit', [worker, job_id, extranonce2.hex(), ntime, nonce])
+        with self.cond:
+            self.submits.add(request_id)
+
+    def wait_job(self, last_seq, timeout=None):
+        """The (seq, notify params) of a job newer than last_seq, or None if none came/the connection closed."""
+        with self.cond:
+            self.cond.wait_for(lambda: self.job_seq != last_seq or not self.connected, timeout)
+            if self.job_seq == last_seq or not self.connected:
+                return None
+            return self.job_seq, self.job
+
+    def job_template(self, job):
+        """A getblocktemplate-like dict for WorkTemplate, with the share target as target."""
+        job_id, prev_hash, prefix, suffix, branch, version, bits, curtime, height, clean = job
+        block_target = bits_to_target(bits)
+        return {
+            "version": version, "previousblockhash": prev_hash, "bits": bits, "curtime": curtime,
+            "height": height, "transactions": [],
+            "target": format(max((1 << 256) // max(self.difficulty, 1), block_target), '064x'),
+            "coinbase_prefix": prefix + self.extranonce1.hex(), "coinbase_suffix": suffix,
+            "extranonce_size": self.extranonce2_size, "merkle_branch": branch,
+        }
+
+    def _read_loop(self):
+        try:
+            for line in self.sock.makefile('rb'):
+                try:
+                    message = json.loads(line)
+                except ValueError:
+                    continue
+                method = message.get('method')
+                with self.cond:
+                    if method == 'mining.notify':
+                        self.job = message['params']
+                        self.job_seq += 1
+                    elif method == 'mining.set_difficulty':
+                        self.difficulty = message['params'][0]
+                    elif message.get('id') in self.submits:
+                        self.submits.discard(message['id'])
+                        if message.get('result'):
+                            self.accepted += 1
+                        else:
+                            self.rejected += 1
+                            logger.debug(f"Share rejected: {message.get('error')}")
+                    elif message.get('id') is not None:
+                        self.responses[message['id']] = (message.get('result'), message.get('error'))
+                    self.cond.notify_all()
+                if method == 'mining.notify' and self.on_job:
+                    self.on_job()
+        except OSError:
+            pass
+        finally:
+            with self.cond:
+                self.connected = False
+                self.cond.notify_all()
+            if self.on_job:
+                self.on_job()
@@ -0,0 +1,155 @@
+import io
+import time
+import logging
+import binascii
+from collections import OrderedDict
+from icsicoin.core.primitives import Block, BlockHeader, Transaction, TxIn, TxOut
+from icsicoin.core.hashing import double_sha256
+from icsicoin.consensus.merkle import get_merkle_branch, get_merkle_root_from_branch
+from icsicoin.consensus.validation import calculate_next_bits, bits_to_target
+
+logger = logging.getLogger("TemplateCache")
+
+BLOCK_SUBSIDY = 50 * 100000000
+
+# Bytes of the coinbase script_sig (after the height) a miner may vary to get fresh Merkle roots
+EXTRANONCE_SIZE = 8
+
+# Templates kept for submitsolution after they stop being current (mempool changes, other addresses)
+TEMPLATE_HISTORY = 64
+
+class TemplateCache:
+    """
+    getblocktemplate results, rebuilt only when the tip or the mempool changes.
+
+    The part every miner shares (tip, bits, selected transactions and their hex,
+    the coinbase's Merkle branch) is built once per (tip hash, mempool sequence).
+    Per payout address only the coinbase and the Merkle root are made, and those
+    are kept too until the next change. Registered as a ChainManager and Mempool
+    listener so stale work is dropped as soon as it is stale.
+
+    The coinbase is also handed out split around an EXTRANONCE_SIZE-byte field,
+    together with its Merkle branch, so miners can roll fresh roots themselves
+    instead of coming back for another template.
+
+    Every template carries a template_id. The last TEMPLATE_HISTORY of them are
+    remembered with their transactions already parsed, so a miner can submit a
+    solution as (template_id, nonce, timestamp, extranonce) and build_block()
+    puts the block back together without it being sent or decoded again.
+    """
+    def __init__(self, chain_manager, mempool):
+        self.chain_manager = chain_manager
+        self.mempool = mempool
+        self.key = None # (tip hash, mempool sequence) of the cached work
+        self.base = None
+        self.by_address = {} # payout address -> template for self.key
+        self.hits = 0
+        self.misses = 0
+        self.issued = OrderedDict() # template_id -> (template, coinbase prefix, suffix, Merkle branch, txs)
+        self.next_template_id = 1
+
+    def invalidate(self, *args):
+        self.key = None
+        self.base = None
+        self.by_address = {}
+
+    def get_template(self, mining_address):
+        """The template paying to mining_address (hex pubkey hash), with a fresh curtime."""
+        best = self.chain_manager.block_index.get_best_block()
+        prev_hash_hex = best['block_hash'] if best else '0'*64
+        key = (prev_hash_hex, self.mempool.sequence)
+        if key != self.key:
+            self.invalidate()
+            self.base = self._build_base(best, prev_hash_hex)
+            self.key = key
+        template = self.by_address.get(mining_address)
+        if template is None:
+            self.misses += 1
+            template = self._build_for_address(mining_address)
+            self.by_address[mining_address] = template
+        else:
+            self.hits += 1
+        return dict(template, curtime=int(time.time()))
+
+    def _build_base(self, best, prev_hash_hex):
+        height = (best['height'] + 1) if best else 1
+
+        # Best ancestor package fee rate first, within the size budget
+        selected = self.mempool.select_transactions()
+        total_fees = sum(entry.fee for entry in selected)
+        logger.info(f"Block Template: Selected {len(selected)} of {len(self.mempool.transactions)} mempool transactions, fees {total_fees}.")
+
+        # Merkle path of the coinbase slot; its placeholder leaf is never used
+        merkle_branch = get_merkle_branch([b'\x00'*32] + [bytes.fromhex(entry.txid) for entry in selected])
+
+        next_bits = calculate_next_bits(self.chain_manager, height)
+        return {
+            "height": height,
+            "previousblockhash": prev_hash_hex,
+            "bits": next_bits,
+            "target": format(bits_to_target(next_bits), '064x'),
+            "coinbase_value": BLOCK_SUBSIDY + total_fees,
+            "transactions": [binascii.hexlify(entry.tx.serialize()).decode('utf-8') for entry in selected],
+            "merkle_branch": merkle_branch,
+            "merkle_branch_hex": [h.hex() for h in merkle_branch],
+            "txs": [entry.tx for entry in selected],
+            "longpollid": f"{prev_hash_hex}{self.mempool.sequence}",
+        }
+
+    def _build_for_address(self, mining_address):
+        base = self.base
+        # ScriptPubkey for P2PKH: OP_DUP OP_HASH160 <pubKeyHash> OP_EQUALVERIFY OP_CHECKSIG
+        script_pubkey = b'\x76\xa9\x14' + binascii.unhexlify(mining_address) + b'\x88\xac'
+        def make_coinbase(extranonce):
+            return Transaction(
+                vin=[TxIn(prev_hash=b'\x00'*32, prev_index=0xffffffff, script_sig=str(base['height']).encode() + extranonce, sequence=0xffffffff)],
+                vout=[TxOut(amount=base['coinbase_value'], script_pubkey=script_pubkey)]
+            )
+        coinbase_tx = make_coinbase(b'\x00' * EXTRANONCE_SIZE)
+        coinbase = coinbase_tx.serialize()
+        # The extranonce sits where the two serializations first differ
+        other = make_coinbase(b'\xff' * EXTRANONCE_SIZE).serialize()
+        offset = next(i for i in range(len(coinbase)) if coinbase[i] != other[i])
+        merkle_root = get_merkle_root_from_branch(coinbase_tx.get_hash(), base['merkle_branch'])
+        template_id = str(self.next_template_id)
+        self.next_template_id += 1
+        template = {
+            "template_id": template_id,
+            "version": 1,
+            "previousblockhash": base['previousblockhash'],
+            "bits": base['bits'],
+            "height": base['height'],
+            "coinbase_value": base['coinbase_value'],
+            "transactions": [binascii.hexlify(coinbase).decode('utf-8')] + base['transactions'],
+            "merkle_root": binascii.hexlify(merkle_root).decode('utf-8'),
+            "coinbase_prefix": coinbase[:offset].hex(),
+            "coinbase_suffix": coinbase[offset + EXTRANONCE_SIZE:].hex(),
+            "extranonce_size": EXTRANONCE_SIZE,
+            "merkle_branch": base['merkle_branch_hex'],
+            "target": base['target'],
+            "longpollid": base['longpollid'],
+        }
+        self.issued[template_id] = (template, coinbase[:offset], coinbase[offset + EXTRANONCE_SIZE:], base['merkle_branch'], base['txs'])
+        if len(self.issued) > TEMPLATE_HISTORY:
+            self.issued.popitem(last=False)
+        return template
+
+    def build_block(self, template_id, nonce, timestamp, extranonce):
+        """
+        The block solved from an issued template: its coinbase with `extranonce`
+        (bytes) filled in, header fields `nonce` and `timestamp`.
+        Returns (block, None), or (None, reason) if it can't be rebuilt.
+        """
+        issued = self.issued.get(template_id)
+        if issued is None:
+            return None, "unknown-template"
+        template, prefix, suffix, merkle_branch, txs = issued
+        if len(extranonce) != EXTRANONCE_SIZE:
+            return None, "bad-extranonce"
+        if not (0 <= nonce < (1 << 32) and 0 <= timestamp < (1 << 32)):
+            return None, "bad-header"
+        coinbase = prefix + extranonce + suffix
+        merkle_root = get_merkle_root_from_branch(double_sha256(coinbase), merkle_branch)
+        header = BlockHeader(template['version'], binascii.unhexlify(template['previousblockhash']),
+                             merkle_root, timestamp, template['bits'], nonce)
+        return Block(header, [Transaction.deserialize(io.BytesIO(coinbase))] + txs), None
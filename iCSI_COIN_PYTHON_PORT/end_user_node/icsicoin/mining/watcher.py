@@ -0,0 +1,73 @@
+import time
+import logging
+import threading
+
+logger = logging.getLogger("TemplateWatcher")
+
+class TemplateWatcher:
+    """
+    Long-polls getblocktemplate on a thread while the miner hashes.
+
+    fetch(longpollid) must make the long-poll call and return the template dict
+    (None on error); the node holds it until the tip or mempool moves on. When a
+    template newer than the one being watched arrives it is kept for take() and
+    on_change() is called, so the miner can drop stale work straight away.
+    """
+    def __init__(self, fetch, on_change=None):
+        self.fetch = fetch
+        self.on_change = on_change
+        self.cond = threading.Condition()
+        self.longpollid = None # Work currently being hashed
+        self.template = None # Newer template, once one arrives
+        self.arrived_at = None # When it did
+        self.stopped = False
+        self.thread = threading.Thread(target=self._run, name="template-watcher", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        with self.cond:
+            self.stopped = True
+            self.cond.notify()
+
+    def watch(self, template):
+        """Start watching for work newer than template."""
+        with self.cond:
+            self.longpollid = template.get('longpollid')
+            self.template = None
+            self.cond.notify()
+
+    @property
+    def stale(self):
+        return self.template is not None
+
+    def take(self):
+        """The newer template, if one arrived (and stop watching until the next watch())."""
+        with self.cond:
+            template, self.template = self.template, None
+            self.longpollid = None
+            return template
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.stopped and (self.longpollid is None or self.template is not None):
+                    self.cond.wait()
+                if self.stopped:
+                    return
+                longpollid = self.longpollid
+            template = self.fetch(longpollid)
+            with self.cond:
+                if self.stopped:
+                    return
+                if template is None:
+                    self.cond.wait(1.0) # Node unreachable; don't spin
+                    continue
+                if longpollid != self.longpollid or template.get('longpollid') == longpollid:
+                    continue # Miner moved on meanwhile, or the poll timed out unchanged
+                self.template = template
+                self.arrived_at = time.time()
+            logger.debug("New work available")
+            if self.on_change:
+                self.on_change()
@@ -0,0 +1,70 @@
+import io
+import time
+import binascii
+from icsicoin.core.primitives import Block, BlockHeader, Transaction
+from icsicoin.core.hashing import double_sha256
+from icsicoin.consensus.merkle import get_merkle_root_from_branch
+
+class WorkTemplate:
+    """
+    A getblocktemplate result a miner can keep drawing fresh work from.
+
+    Each next_work() bumps the extranonce in the coinbase (a new Merkle root, folded
+    up the template's branch) and moves the timestamp up to the current time, so
+    an exhausted nonce range never needs a round trip to the node. Templates from
+    nodes that don't split the coinbase only roll the timestamp.
+
+    Templates with a template_id can be submitted compactly: solution_params()
+    gives the submitsolution arguments, so only build_block() for submitblock
+    needs every transaction decoded.
+    """
+    def __init__(self, template):
+        self.template = template
+        self.template_id = template.get('template_id')
+        self.height = template['height']
+        self.bits = template['bits']
+        self.version = template['version']
+        self.target = int(template['target'], 16)
+        self.prev_hash = binascii.unhexlify(template['previousblockhash'])
+        if 'coinbase_prefix' in template:
+            self.coinbase_prefix = bytes.fromhex(template['coinbase_prefix'])
+            self.coinbase_suffix = bytes.fromhex(template['coinbase_suffix'])
+            self.extranonce_size = template['extranonce_size']
+            self.merkle_branch = [bytes.fromhex(h) for h in template['merkle_branch']]
+        else:
+            self.coinbase_prefix = None
+        self.extranonce = 0
+        self.last_timestamp = 0
+
+    def next_work(self, now=None):
+        """A (header, coinbase bytes or None) pair no earlier next_work() handed out; nonce 0."""
+        timestamp = max(self.template['curtime'], int(now if now is not None else time.time()))
+        if self.coinbase_prefix is not None:
+            coinbase = self.coinbase_prefix + self.extranonce.to_bytes(self.extranonce_size, 'little') + self.coinbase_suffix
+            self.extranonce += 1
+            merkle_root = get_merkle_root_from_branch(double_sha256(coinbase), self.merkle_branch)
+        else:
+            # Only the timestamp tells this work apart
+            timestamp = max(timestamp, self.last_timestamp + 1)
+            coinbase = None
+            merkle_root = binascii.unhexlify(self.template['merkle_root'])
+        self.last_timestamp = timestamp
+        return BlockHeader(self.version, self.prev_hash, merkle_root, timestamp, self.bits, 0), coinbase
+
+    def solution_params(self, header, coinbase):
+        """submitsolution params for a solved header from next_work(), or None if the node can't take them."""
+        if self.template_id is None or coinbase is None:
+            return None
+        start = len(self.coinbase_prefix)
+        extranonce = coinbase[start:start + self.extranonce_size]
+        return [self.template_id, header.nonce, header.timestamp, extranonce.hex()]
+
+    def build_block(self, header, coinbase):
+        """The full block for a solved header from next_work()."""
+        txs = []
+        for tx_hex in self.template['transactions']:
+            tx_bytes = binascii.unhexlify(tx_hex)
+            txs.append(Transaction.deserialize(io.BytesIO(tx_bytes)))
+        if coinbase is not None:
+            txs[0] = Transaction.deserialize(io.BytesIO(coinbase))
+        return Block(header, txs)
@@ -0,0 +1,146 @@
+import os
+import time
+import queue
+import logging
+import multiprocessing
+from icsicoin.consensus import proof_of_work
+
+logger = logging.getLogger("HashWorkers")
+
+# Hashes a worker does between looks at the current job id, i.e. how much stale
+# work it can do after a solution is found or the tip changes (~10 ms of scrypt).
+MINER_CHECK_INTERVAL = int(os.getenv('MINER_CHECK_INTERVAL', 64))
+
+def _worker_main(index, jobs, results, current_job, hash_counts, backend):
+    """
+    Worker process: hash the nonce range of each job until it is exhausted, a
+    solution turns up, or the parent moves current_job on. Reports every outcome
+    on `results` as (job_id, worker_index, nonce or None, pow_hash or None).
+    """
+    proof_of_work.select_backend(backend)
+    while True:
+        job = jobs.get()
+        if job is None:
+            return
+        job_id, prefix, target, start, end = job
+        nonce = start
+        solution = None
+        while nonce < end and current_job.value == job_id:
+            stop = min(nonce + MINER_CHECK_INTERVAL, end)
+            solution = proof_of_work.scan_nonces(prefix, target, nonce, stop)
+            if solution:
+                stop = solution[0] + 1
+            hash_counts[index] += stop - nonce
+            nonce = stop
+            if solution:
+                break
+        if solution:
+            results.put((job_id, index, solution[0], solution[1]))
+        else:
+            results.put((job_id, index, None, None))
+
+class HashWorkers:
+    """
+    Processes that hash disjoint slices of one header's nonce space.
+
+    The parent hands each worker (job_id, first 76 header bytes, target, nonce range)
+    through its own queue; a shared job id lets it abandon a job everywhere at once
+    (solution found, tip changed) without waiting for the queues. Per-worker hash
+    counters live in shared memory so hashrates can be read without messages.
+    """
+    def __init__(self, workers=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.ctx = multiprocessing.get_context('spawn')
+        self.current_job = self.ctx.Value('q', 0, lock=False)
+        self.hash_counts = self.ctx.Array('Q', self.workers, lock=False)
+        self.results = self.ctx.Queue()
+        self.jobs = []
+        self.processes = []
+        self.job_id = 0
+        self.running = 0 # Workers still hashing the current job
+        self._last_sample = None # (time, [counts]) for get_hashrates()
+
+    def start(self):
+        # Benchmark the scrypt backends once here rather than in every worker
+        backend = proof_of_work.get_backend_name()
+        for i in range(self.workers):
+            jobs = self.ctx.Queue()
+            p = self.ctx.Process(target=_worker_main, name=f"miner-{i}", daemon=True,
+                                 args=(i, jobs, self.results, self.current_job, self.hash_counts, backend))
+            p.start()
+            self.jobs.append(jobs)
+            self.processes.append(p)
+        self._last_sample = (time.time(), list(self.hash_counts))
+        logger.info(f"Started {self.workers} hashing processes ({backend} scrypt)")
+
+    def submit(self, header_bytes, target, nonce_start=0, nonce_end=1 << 32):
+        """Hash an 80-byte header (nonce ignored) across all workers; supersedes any current job."""
+        self.job_id += 1
+        self.current_job.value = self.job_id
+        prefix = bytes(header_bytes[:76])
+        step = -(-(nonce_end - nonce_start) // self.workers)
+        for i, jobs in enumerate(self.jobs):
+            start = nonce_start + i * step
+            jobs.put((self.job_id, prefix, target, start, min(start + step, nonce_end)))
+        self.running = self.workers
+        return self.job_id
+
+    def cancel(self):
+        """Stop hashing the current job; workers drop it within MINER_CHECK_INTERVAL hashes."""
+        self.job_id += 1
+        self.current_job.value = self.job_id
+        self.running = 0
+
+    def interrupt(self):
+        """Make a pending (or the next) wait() return None early; safe from other threads."""
+        self.results.put((None, None, None, None))
+
+    @property
+    def exhausted(self):
+        """True once every worker finished the current job's range without a solution."""
+        return self.running == 0
+
+    def wait(self, timeout=None):
+        """
+        Wait up to timeout seconds for a solution to the current job.
+        Returns (nonce, pow_hash, worker_index), or None on timeout or exhaustion.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while self.running:
+            remaining = None if deadline is None else max(0, deadline - time.time())
+            try:
+                job_id, index, nonce, pow_hash = self.results.get(timeout=remaining)
+            except queue.Empty:
+                return None
+            if job_id is None:
+                return None # interrupt()
+            if job_id != self.job_id:
+                continue # Report from an abandoned job
+            if nonce is not None:
+                return nonce, pow_hash, index
+            self.running -= 1
+        return None
+
+    def get_hashrates(self):
+        """Per-worker hashes per second since the previous call (or start)."""
+        now, counts = time.time(), list(self.hash_counts)
+        last_time, last_counts = self._last_sample or (now, counts)
+        self._last_sample = (now, counts)
+        elapsed = now - last_time
+        if elapsed <= 0:
+            return [0.0] * self.workers
+        return [(c - l) / elapsed for c, l in zip(counts, last_counts)]
+
+    def get_total_hashes(self):
+        return sum(self.hash_counts)
+
+    def close(self):
+        self.cancel()
+        for jobs in self.jobs:
+            jobs.put(None)
+        for p in self.processes:
+            p.join(timeout=2.0)
+            if p.is_alive():
+                p.terminate()
+        self.jobs = []
+        self.processes = []
@@ -5,9 +5,12 @@ import time
 import os
 import io
 import random
+import weakref
 from icsicoin.network.messages import (
     VersionMessage, VerackMessage, Message, MAGIC_VALUE, GetAddrMessage, AddrMessage,
-    SignalMessage, RelayMessage, TestMessage, PingMessage, PongMessage
+    SignalMessage, RelayMessage, TestMessage, PingMessage, PongMessage,
+    InvMessage, GetDataMessage, BlockMessage, TxMessage, GetBlocksMessage, GetHeadersMessage, HeadersMessage,
+    NODE_BINARY_WIRE, MAX_HEADERS
 )
 from icsicoin.storage.blockstore import BlockStore
 from icsicoin.storage.databases import BlockIndexDB, ChainStateDB
@@ -51,8 +54,9 @@ class NetworkManager:
         self.chain_state = ChainStateDB(self.data_dir)
         
         # Brain
-        self.mempool = Mempool(self.data_dir)
+        self.mempool = Mempool(self.data_dir, self.chain_state)
         self.chain_manager = ChainManager(self.block_store, self.block_index, self.chain_state)
+        self.chain_manager.mempool = self.mempool # Confirmed/reorged txs leave/return to the pool
 
         
         self.add_nodes = add_nodes if add_nodes else []
@@ -69,6 +73,7 @@ class NetworkManager:
         self.tasks = set() # Keep strong references to background tasks
         self.server = None
         self.active_connections = {} # (ip, port) -> writer
+        self.binary_writers = weakref.WeakSet() # Writers of peers that advertised NODE_BINARY_WIRE
         self.ice_connections = {} # (ip, port) -> aioice.Connection
         self.test_msg_count = 0
         self.running = False
@@ -168,19 +173,10 @@ class NetworkManager:
         # Create inventory request
         inv = [{"type": "block", "hash": h} for h in list(self.wanted_blocks)]
         
-        # Create GETDATA message
-        entry = {
-            "type": "getdata",
-            "inventory": inv
-        }
-        payload = json.dumps(entry).encode('utf-8')
-        msg = Message('getdata', payload)
-        serialized = msg.serialize()
-        
         sent_count = 0
         for peer, writer in self.active_connections.items():
             try:
-                writer.write(serialized)
+                writer.write(GetDataMessage(inv, self.speaks_binary(writer)).serialize())
                 await writer.drain()
                 sent_count += 1
             except: pass
@@ -190,6 +186,17 @@ class NetworkManager:
         else:
             logger.warning("BULLDOG: No peers available to retry wanted blocks! Waiting for new connection...")
 
+    def speaks_binary(self, writer):
+        """Whether block/tx/inv/getdata/getblocks go to this peer binary rather than as JSON."""
+        return writer in self.binary_writers
+
+    def note_peer_services(self, writer, services):
+        """Record what a peer's VERSION advertised, before any other message is exchanged."""
+        if services & NODE_BINARY_WIRE:
+            self.binary_writers.add(writer)
+        else:
+            self.binary_writers.discard(writer)
+
     def configure_stun(self, ip, port):
         self.stun_ip = ip
         self.stun_port = int(port)
@@ -371,6 +378,7 @@ class NetworkManager:
         if self.server:
             self.server.close()
             await self.server.wait_closed()
+        self.mempool.save()
         logger.info("Network manager stopped.")
 
     # --- BEGGAR SYSTEM ---
@@ -516,6 +524,7 @@ class NetworkManager:
                     self.log_peer_event(addr, "SENT", "GETADDR", "Initiating discovery")
                     
                     # Start Initial Block Download (IBD)
+                    await self.send_getheaders(writer)
                     await self.send_getblocks(writer)
 
                 elif command == 'ping':
@@ -689,8 +698,7 @@ class NetworkManager:
 
                     try:
                         # Decode payload
-                        inv_data = json.loads(payload.decode('utf-8'))
-                        items = inv_data.get('inventory', [])
+                        items = InvMessage.parse(payload, self.speaks_binary(writer))
                         
                         # LOGGING: Record incoming INV
                         first_item = items[0]['hash'][:8] if items and 'hash' in items[0] else "EMPTY"
@@ -730,12 +738,7 @@ class NetworkManager:
                         
                         if to_get:
                             # Reverting to standard batch size (driven by peer INV size, typ. 500)
-                            msg = {
-                                "type": "getdata",
-                                "inventory": to_get
-                            }
-                            json_payload = json.dumps(msg).encode('utf-8')
-                            out_msg = Message('getdata', json_payload)
+                            out_msg = GetDataMessage(to_get, self.speaks_binary(writer))
                             writer.write(out_msg.serialize())
                             await writer.drain()
                             logger.info(f"Sent GETDATA for {len(to_get)} items to {addr}")
@@ -747,14 +750,7 @@ class NetworkManager:
                             # Otherwise we stall here.
                             
                             # We check the last item in the inventory.
-                            last_item = inventory[-1]
-                            # CONTINUE SYNC LOGIC
-                            # If to_get is empty, we already have everything in this INV.
-                            # But if the INV was full (suggesting more blocks exist), we should ask for what comes NEXT.
-                            # Otherwise we stall here.
-                            
-                            # We check the last item in the inventory.
-                            last_item = inventory[-1]
+                            last_item = items[-1] if items else {'type': None}
                             if last_item['type'] == 'block':
                                 last_hash = last_item['hash']
                                 
@@ -768,7 +764,7 @@ class NetworkManager:
                                 
                                 # If peer is ahead, ask for more even if this batch was known
                                 # or if the batch was substantial.
-                                if peer_height > my_height or len(inventory) > 0:
+                                if peer_height > my_height or len(items) > 0:
                                      # Logic update: Always request more if we are not at tip.
                                      logger.debug(f"INV processing complete. Checking if we need more blocks (Peer H:{peer_height} vs My H:{my_height})...")
                                      if peer_height > my_height:
@@ -784,8 +780,8 @@ class NetworkManager:
 
                 elif command == 'getdata':
                     try:
-                        data = json.loads(payload.decode('utf-8'))
-                        inventory = data.get('inventory', [])
+                        binary = self.speaks_binary(writer)
+                        inventory = GetDataMessage.parse(payload, binary)
                         logger.info(f"Received GETDATA from {addr}")
                         self.log_peer_event(addr, "RECV", "GETDATA", f"Peer requested {len(inventory)} items")
                         
@@ -798,14 +794,7 @@ class NetworkManager:
                                     if info:
                                         try:
                                             raw_block = self.block_store.read_block(info['file_num'], info['offset'], info['length'])
-                                            # Encode to hex
-                                            block_hex = binascii.hexlify(raw_block).decode('ascii')
-                                            msg = {
-                                                "type": "block",
-                                                "payload": block_hex
-                                            }
-                                            json_payload = json.dumps(msg).encode('utf-8')
-                                            out_msg = Message('block', json_payload)
+                                            out_msg = BlockMessage(raw_block, binary)
                                             writer.write(out_msg.serialize())
                                             await writer.drain()
                                             logger.info(f"Sent BLOCK {item['hash']} to {addr}")
@@ -830,21 +819,7 @@ class NetworkManager:
                                     if tx:
                                         try:
                                             # Send TX message
-                                            # We need to wrap it in a 'tx' command like existing codebase expects?
-                                            # Let's check 'tx' handler below.
-                                            # It expects { "payload": hex_tx } ?? No wait.
-                                            # Let's see how 'tx' message is typically formed.
-                                            # The existing codebase doesn't seem to have a standard TX message serializer yet?
-                                            # Wait, existing grep showed 'elif command == 'tx''. Let's check its parsing.
-                                            # Assuming it follows 'block' pattern: JSON with payload hex.
-                                            
-                                            tx_hex = binascii.hexlify(tx.serialize()).decode('ascii')
-                                            msg = {
-                                                "type": "tx",
-                                                "payload": tx_hex
-                                            }
-                                            json_payload = json.dumps(msg).encode('utf-8')
-                                            out_msg = Message('tx', json_payload)
+                                            out_msg = TxMessage(tx.serialize(), binary)
                                             writer.write(out_msg.serialize())
                                             await writer.drain()
                                             logger.info(f"Sent TX {item['hash']} to {addr}")
@@ -865,17 +840,12 @@ class NetworkManager:
                 elif command == 'block':
                     try:
                         try:
-                            # Try decoding JSON
-                            data = json.loads(payload.decode('utf-8'))
-                        except json.JSONDecodeError as decode_err:
-                            logger.error(f"[ERR] DECODE: Failed to parse JSON for block. Raw first 50 chars: {payload[:50]}")
-                            # Try binary fallback or just fail
+                            block_bytes = BlockMessage.parse(payload, self.speaks_binary(writer))
+                        except ValueError as decode_err:
+                            logger.error(f"[ERR] DECODE: Failed to parse block payload. Raw first 50 bytes: {payload[:50]}")
                             raise decode_err
-                        block_hex = data.get('payload')
-                        if block_hex:
-                            block_bytes = binascii.unhexlify(block_hex)
+                        if block_bytes:
                             # Deserialize
-                            import io
                             f = io.BytesIO(block_bytes)
                             block = Block.deserialize(f)
                             
@@ -897,16 +867,9 @@ class NetworkManager:
                             # Process via ChainManager
                             # DEADLOCK FIX: Run in main thread to avoid SQLite threading issues
                             # (SQLite objects created in main thread cannot be shared with executor)
-                            success, reason = self.chain_manager.process_block(block)
+                            success, reason = self.chain_manager.process_block(block, peer=addr)
                             
                             if success:
-                                # Remove received transactions from mempool
-                                try:
-                                    for tx in block.vtx:
-                                        self.mempool.remove_transaction(tx.get_hash().hex())
-                                except Exception as e:
-                                    logger.warning(f"Failed to remove tx from mempool: {e}")
-
                                 self.log_peer_event(addr, "CONSENSUS", "ACCEPTED", f"Block {b_hash[:16]}... added to chain")
 
                                 # PEER HEIGHT UPDATE FIX:
@@ -963,18 +926,13 @@ class NetworkManager:
                                          self.sync_batch_end = None
 
                                 # Relay logic (simple flood)
-                                inv_msg = {
-                                    "type": "inv", 
-                                    "inventory": [{"type": "block", "hash": b_hash}]
-                                }
-                                json_payload = json.dumps(inv_msg).encode('utf-8')
-                                out_m = Message('inv', json_payload)
+                                inv_items = [{"type": "block", "hash": b_hash}]
                                 
                                 # Broadcast to others
                                 for peer_addr, peer_writer in self.active_connections.items():
                                     if peer_addr != addr: 
                                         try:
-                                            peer_writer.write(out_m.serialize())
+                                            peer_writer.write(InvMessage(inv_items, self.speaks_binary(peer_writer)).serialize())
                                             await peer_writer.drain()
                                         except: pass
                                 logger.info("Relayed BLOCK INV to peers")
@@ -1015,43 +973,14 @@ class NetworkManager:
                                         # await self.send_getblocks(writer)
                                         pass
                                         
-                                        # BACKFILL STRATEGY: Iterative Ancestry Lookup
-                                        logger.debug("Orphan Backfill: Starting ancestry lookup...")
-                                        # If we have a chain of orphans (A->B->C), receiving C should trigger request for B's parent (if B is known orphan).
-                                        # We trace back up to 100 steps to find the "Root Orphan" that needs a parent.
-                                        
-                                        curr_hash = b_hash
-                                        steps = 0
+                                        # BACKFILL STRATEGY: Request the root of the orphan chain
+                                        # If we have a chain of orphans (A->B->C), receiving C should trigger request for A's parent.
+                                        # The orphan pool tracks ancestry, so it hands back the missing link directly.
                                         target_parent = None
-                                        
-                                        while steps < 100:
-                                            orphan_block = self.chain_manager.orphan_blocks.get(curr_hash)
-                                            if not orphan_block:
-                                                # Should not happen for the first iteration (b_hash), but safe to break
-                                                break
-                                                
-                                            prev_hash = orphan_block.header.prev_block.hex()
-                                            
-                                            # Do we have this parent in the MAIN chain?
-                                            if self.block_index.get_block_info(prev_hash):
-                                                # Parent is known and processed. 
-                                                # If we are here, it means we FAILED to connect the child despite having parent?
-                                                # That suggests validation failure or race condition. 
-                                                # We stop here.
-                                                target_parent = None
-                                                break
-                                                
-                                            # Do we have this parent in the ORPHAN pool?
-                                            if prev_hash in self.chain_manager.orphan_blocks:
-                                                # Yes, so we need TO CHECK *ITS* PARENT. 
-                                                # Move one step back.
-                                                curr_hash = prev_hash
-                                                steps += 1
-                                                continue
-                                            
-                                            # If neither, THIS is the missing link we need.
-                                            target_parent = prev_hash
-                                            break
+                                        curr_hash = b_hash
+                                        missing = self.chain_manager.get_missing_orphan_ancestor(b_hash)
+                                        if missing:
+                                            curr_hash, target_parent = missing
                                             
                                         if target_parent:
                                             # Check Debounce
@@ -1067,9 +996,7 @@ class NetworkManager:
                                                 self.log_peer_event(addr, "OUT", "GETDATA", f"Requesting missing root parent {target_parent[:16]}...")
                                                 
                                                 inv_item = {"type": "block", "hash": target_parent}
-                                                msg = {"type": "getdata", "inventory": [inv_item]}
-                                                payload = json.dumps(msg).encode('utf-8')
-                                                out_m = Message('getdata', payload)
+                                                out_m = GetDataMessage([inv_item], self.speaks_binary(writer))
                                                 writer.write(out_m.serialize())
                                                 await writer.drain()
                                         else:
@@ -1091,32 +1018,24 @@ class NetworkManager:
 
                 elif command == 'tx':
                     try:
-                        data = json.loads(payload.decode('utf-8'))
-                        tx_hex = data.get('payload')
-                        if tx_hex:
-                            tx_bytes = binascii.unhexlify(tx_hex)
-                            import io
+                        tx_bytes = TxMessage.parse(payload, self.speaks_binary(writer))
+                        if tx_bytes:
                             f = io.BytesIO(tx_bytes)
                             tx = Transaction.deserialize(f)
                             
                             # Validate & Add to Mempool
-                            # FIX: validate_transaction requires utxo_set and returns (bool, reason)
-                            is_valid, reason = validate_transaction(tx, self.chain_manager.chain_state)
+                            # Inputs may be outputs of other mempool transactions (unconfirmed chains)
+                            is_valid, reason = validate_transaction(tx, self.mempool.get_view(self.chain_manager.chain_state))
                             if is_valid:
                                 if self.mempool.add_transaction(tx):
                                     logger.info(f"Received Valid TX: {tx.get_hash().hex()}")
                                     
                                     # Relay 
-                                    inv_msg = {
-                                        "type": "inv", 
-                                        "inventory": [{"type": "tx", "hash": tx.get_hash().hex()}]
-                                    }
-                                    json_payload = json.dumps(inv_msg).encode('utf-8')
-                                    out_m = Message('inv', json_payload)
+                                    inv_items = [{"type": "tx", "hash": tx.get_hash().hex()}]
                                     for peer_addr, peer_writer in self.active_connections.items():
                                         if peer_addr != addr:
                                             try:
-                                                peer_writer.write(out_m.serialize())
+                                                peer_writer.write(InvMessage(inv_items, self.speaks_binary(peer_writer)).serialize())
                                                 await peer_writer.drain()
                                             except: pass
                                     # Added return to fix logging issue? No.
@@ -1127,8 +1046,7 @@ class NetworkManager:
 
                 elif command == 'getblocks':
                     try:
-                        data = json.loads(payload.decode('utf-8'))
-                        locator = data.get('locator', [])
+                        locator = GetBlocksMessage.parse(payload, self.speaks_binary(writer))
                         
                         # LOGGING: Record incoming getblocks request
                         tip_str = locator[0][:8] if locator else "EMPTY"
@@ -1170,12 +1088,7 @@ class NetworkManager:
                                     logger.warning(f"SYNC WARNING: Block hash not found for height {h_idx}")
                             
                             if inv_items:
-                                    inv_msg = {
-                                        "type": "inv", 
-                                        "inventory": inv_items
-                                    }
-                                    json_payload = json.dumps(inv_msg).encode('utf-8')
-                                    out_msg = Message('inv', json_payload)
+                                    out_msg = InvMessage(inv_items, self.speaks_binary(writer))
                                     writer.write(out_msg.serialize())
                                     await writer.drain()
                                     logger.info(f"Sent INV with {len(inv_items)} blocks to {addr}")
@@ -1185,6 +1098,30 @@ class NetworkManager:
                     except Exception as e:
                         logger.error(f"GETBLOCKS error: {e}")
 
+                elif command == 'getheaders':
+                    try:
+                        locator = GetHeadersMessage.parse(payload, self.speaks_binary(writer))
+                        headers = self.chain_manager.get_headers_after(locator, MAX_HEADERS)
+                        writer.write(HeadersMessage(headers, self.speaks_binary(writer)).serialize())
+                        await writer.drain()
+                        self.log_peer_event(addr, "SENT", "HEADERS", f"{len(headers)} headers")
+                    except Exception as e:
+                        logger.error(f"GETHEADERS error: {e}")
+
+                elif command == 'headers':
+                    try:
+                        headers = HeadersMessage.parse(payload, self.speaks_binary(writer))
+                        self.log_peer_event(addr, "RECV", "HEADERS", f"{len(headers)} headers")
+                        if headers:
+                            success, reason = self.chain_manager.accept_headers(headers)
+                            if not success:
+                                logger.warning(f"Headers from {addr} rejected: {reason}")
+                            elif len(headers) == MAX_HEADERS:
+                                # Full batch: there may be more before the assume-valid block
+                                await self.send_getheaders(writer, headers[-1].get_hash().hex())
+                    except Exception as e:
+                        logger.error(f"HEADERS error: {e}")
+
                 elif command == 'beggar':
                     try:
                         data = json.loads(payload.decode('utf-8'))
@@ -1292,6 +1229,7 @@ class NetworkManager:
                 # Parse Version Message to get listening port
                 try:
                     version_msg = VersionMessage.parse(payload)
+                    self.note_peer_services(writer, version_msg.services)
                     remote_listening_port = version_msg.addr_from[2]
                     remote_height = version_msg.start_height
                     remote_agent = version_msg.user_agent
@@ -1328,6 +1266,7 @@ class NetworkManager:
                 
                 # SPRINT 5 FIX: Trigger Initial Block Download (IBD)
                 # Force getblocks here to ensure we active sync immediately
+                await self.send_getheaders(writer)
                 await self.send_getblocks(writer)
                 
             # 4. Expect Verack
@@ -1762,18 +1701,13 @@ class NetworkManager:
             
             # Announce all TXs
             for tx in txs:
-                inv_msg = {
-                    "type": "inv", 
-                    "inventory": [{"type": "tx", "hash": tx.get_hash().hex()}]
-                }
-                json_payload = json.dumps(inv_msg).encode('utf-8')
-                out_m = Message('inv', json_payload)
+                inv_items = [{"type": "tx", "hash": tx.get_hash().hex()}]
                 
                 # Send to all connected peers
                 count = 0
                 for peer_addr, peer_writer in list(self.active_connections.items()):
                     try:
-                        peer_writer.write(out_m.serialize())
+                        peer_writer.write(InvMessage(inv_items, self.speaks_binary(peer_writer)).serialize())
                         await peer_writer.drain()
                         count += 1
                     except: pass
@@ -1814,12 +1748,7 @@ class NetworkManager:
                 logger.error("get_block_locator returned empty list! Cannot sync.")
                 return
 
-            msg = {
-                "type": "getblocks",
-                "locator": locator
-            }
-            json_payload = json.dumps(msg).encode('utf-8')
-            out_msg = Message('getblocks', json_payload)
+            out_msg = GetBlocksMessage(locator, self.speaks_binary(peer_writer))
             
             peer_writer.write(out_msg.serialize())
             await peer_writer.drain()
@@ -1837,22 +1766,34 @@ class NetworkManager:
 
 
 
+    async def send_getheaders(self, peer_writer, from_hash=None):
+        """
+        Ask a peer for headers ahead of block bodies, so blocks under the assume-valid
+        block are recognised as its ancestors when they arrive. Only while that
+        block's header is still unknown. from_hash: last header of the previous batch.
+        """
+        if not self.chain_manager.wants_headers():
+            return
+        try:
+            locator = self.chain_manager.get_block_locator()
+            if from_hash:
+                locator = [from_hash] + locator
+            peer_writer.write(GetHeadersMessage(locator, self.speaks_binary(peer_writer)).serialize())
+            await peer_writer.drain()
+        except Exception as e:
+            logger.error(f"Error sending getheaders: {e}")
+
     async def announce_new_block(self, block):
         """Broadcasts a new block inventory to all peers"""
         block_hash = block.get_hash().hex()
         logger.info(f"Announcing new block {block_hash} to peers...")
         
-        inv_msg = {
-            "type": "inv", 
-            "inventory": [{"type": "block", "hash": block_hash}]
-        }
-        json_payload = json.dumps(inv_msg).encode('utf-8')
-        out_msg = Message('inv', json_payload)
+        inv_items = [{"type": "block", "hash": block_hash}]
         
         count = 0
         for peer_addr, peer_writer in self.active_connections.items():
             try:
-                peer_writer.write(out_msg.serialize())
+                peer_writer.write(InvMessage(inv_items, self.speaks_binary(peer_writer)).serialize())
                 await peer_writer.drain()
                 count += 1
             except Exception:
@@ -2052,6 +1993,7 @@ class NetworkManager:
                  # Parse Version
                 try:
                     version_msg = VersionMessage.parse(payload)
+                    self.note_peer_services(writer, version_msg.services)
                     remote_height = version_msg.start_height
                     remote_agent = version_msg.user_agent
                     
@@ -2099,6 +2041,7 @@ class NetworkManager:
                  self.log_peer_event(addr, "SENT", "GETADDR", "Initiating discovery")
                  
                  # Start Initial Block Download (IBD)
+                 await self.send_getheaders(writer)
                  await self.send_getblocks(writer)
             
             # Outbound connections: we know the target port because we dialed it.
@@ -1,10 +1,35 @@
+import io
+import json
 import struct
 import time
 import random
+import binascii
+from icsicoin.core.primitives import BlockHeader
 
 # Magic value for iCSI Coin (Litecoin mainnet magic)
 MAGIC_VALUE = 0xfbc0b6db
 
+PROTOCOL_VERSION = 70015
+
+# Service bits advertised in VERSION. Peers with NODE_BINARY_WIRE get block, tx,
+# inv, getdata and getblocks as Bitcoin-style binary payloads; everyone else keeps
+# the original JSON form ({"type": ..., "payload": <hex>} and friends).
+NODE_NETWORK = 1
+NODE_BINARY_WIRE = 1 << 24
+LOCAL_SERVICES = NODE_NETWORK | NODE_BINARY_WIRE
+
+# Inventory vector types
+MSG_TX = 1
+MSG_BLOCK = 2
+INV_TYPE_CODES = {'tx': MSG_TX, 'block': MSG_BLOCK}
+INV_TYPE_NAMES = {MSG_TX: 'tx', MSG_BLOCK: 'block'}
+
+# Most entries accepted in one inv/getdata payload or getblocks locator
+MAX_INV_SIZE = 50000
+
+# Most block headers sent in one headers message
+MAX_HEADERS = 2000
+
 class Message:
     def __init__(self, command, payload):
         self.command = command
@@ -111,9 +136,9 @@ class Message:
         }, offset
 
 class VersionMessage(Message):
-    def __init__(self, version=70015, services=1, timestamp=None, 
+    def __init__(self, version=PROTOCOL_VERSION, services=LOCAL_SERVICES, timestamp=None, 
                  addr_recv_services=1, addr_recv_ip='127.0.0.1', addr_recv_port=9333,
-                 addr_from_services=1, addr_from_ip='127.0.0.1', addr_from_port=9333,
+                 addr_from_services=LOCAL_SERVICES, addr_from_ip='127.0.0.1', addr_from_port=9333,
                  nonce=None, user_agent='/iCSICoin:0.1/', start_height=0):
         
         if timestamp is None:
@@ -380,3 +405,118 @@ class PongMessage(Message):
         else:
             nonce = struct.unpack('<Q', payload[:8])[0]
         return cls(nonce)
+
+class InvMessage(Message):
+    """
+    inv: inventory as a list of {"type": "block" | "tx", "hash": hex}.
+    Binary form: var_int count, then (uint32 type, 32-byte hash) per entry.
+    """
+    command = 'inv'
+
+    def __init__(self, inventory, binary=True):
+        self.inventory = inventory
+        if binary:
+            parts = [Message.serialize_var_int(len(inventory))]
+            for item in inventory:
+                parts.append(struct.pack('<I', INV_TYPE_CODES[item['type']]) + bytes.fromhex(item['hash']))
+            payload = b''.join(parts)
+        else:
+            payload = json.dumps({"type": self.command, "inventory": inventory}).encode('utf-8')
+        super().__init__(self.command, payload)
+
+    @classmethod
+    def parse(cls, payload, binary=True):
+        """The inventory list carried by the payload."""
+        if not binary:
+            return json.loads(payload.decode('utf-8')).get('inventory', [])
+        count, offset = Message.parse_var_int(payload, 0)
+        if count > MAX_INV_SIZE or offset + count * 36 > len(payload):
+            raise ValueError(f"Bad {cls.command} payload ({count} entries in {len(payload)} bytes)")
+        inventory = []
+        for _ in range(count):
+            inv_type = struct.unpack_from('<I', payload, offset)[0]
+            inventory.append({"type": INV_TYPE_NAMES.get(inv_type, inv_type), "hash": payload[offset + 4:offset + 36].hex()})
+            offset += 36
+        return inventory
+
+class GetDataMessage(InvMessage):
+    command = 'getdata'
+
+class BlockMessage(Message):
+    """block: a serialized block, sent as is (binary) or as hex under "payload" (JSON)."""
+    command = 'block'
+
+    def __init__(self, raw, binary=True):
+        if binary:
+            payload = bytes(raw)
+        else:
+            payload = json.dumps({"type": self.command, "payload": binascii.hexlify(raw).decode('ascii')}).encode('utf-8')
+        super().__init__(self.command, payload)
+
+    @classmethod
+    def parse(cls, payload, binary=True):
+        """The serialized object carried by the payload (empty if there is none)."""
+        if binary:
+            return payload
+        return binascii.unhexlify(json.loads(payload.decode('utf-8')).get('payload') or '')
+
+class TxMessage(BlockMessage):
+    command = 'tx'
+
+class GetBlocksMessage(Message):
+    """
+    getblocks: a block locator (hex hashes, newest first).
+    Binary form: uint32 version, var_int count, the 32-byte hashes, a 32-byte stop hash.
+    """
+    command = 'getblocks'
+
+    def __init__(self, locator, binary=True):
+        self.locator = locator
+        if binary:
+            payload = (struct.pack('<I', PROTOCOL_VERSION) + Message.serialize_var_int(len(locator)) +
+                       b''.join(bytes.fromhex(h) for h in locator) + b'\x00' * 32)
+        else:
+            payload = json.dumps({"type": self.command, "locator": locator}).encode('utf-8')
+        super().__init__(self.command, payload)
+
+    @classmethod
+    def parse(cls, payload, binary=True):
+        """The locator carried by the payload."""
+        if not binary:
+            return json.loads(payload.decode('utf-8')).get('locator', [])
+        count, offset = Message.parse_var_int(payload, 4)
+        if count > MAX_INV_SIZE or offset + count * 32 > len(payload):
+            raise ValueError(f"Bad {cls.command} payload ({count} hashes in {len(payload)} bytes)")
+        return [payload[offset + i * 32:offset + (i + 1) * 32].hex() for i in range(count)]
+
+class GetHeadersMessage(GetBlocksMessage):
+    command = 'getheaders'
+
+class HeadersMessage(Message):
+    """
+    headers: up to MAX_HEADERS BlockHeaders following a locator, oldest first.
+    Binary form: var_int count, then the 80-byte headers; JSON carries them as hex.
+    """
+    command = 'headers'
+
+    def __init__(self, headers, binary=True):
+        self.headers = headers
+        if binary:
+            payload = Message.serialize_var_int(len(headers)) + b''.join(h.serialize() for h in headers)
+        else:
+            payload = json.dumps({"type": self.command, "headers": [h.serialize().hex() for h in headers]}).encode('utf-8')
+        super().__init__(self.command, payload)
+
+    @classmethod
+    def parse(cls, payload, binary=True):
+        """The BlockHeaders carried by the payload."""
+        if not binary:
+            raw = [bytes.fromhex(h) for h in json.loads(payload.decode('utf-8')).get('headers', [])]
+        else:
+            count, offset = Message.parse_var_int(payload, 0)
+            if count > MAX_HEADERS or offset + count * 80 > len(payload):
+                raise ValueError(f"Bad headers payload ({count} headers in {len(payload)} bytes)")
+            raw = [payload[offset + i * 80:offset + (i + 1) * 80] for i in range(count)]
+        if len(raw) > MAX_HEADERS:
+            raise ValueError(f"Too many headers ({len(raw)})")
+        return [BlockHeader.deserialize(io.BytesIO(h)) for h in raw]
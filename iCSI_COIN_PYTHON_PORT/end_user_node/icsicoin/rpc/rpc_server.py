@@ -1,3 +1,4 @@
+import os
 import asyncio
 import logging
 from aiohttp import web
@@ -6,9 +7,20 @@ import binascii
 import time
 from icsicoin.core.primitives import Block, BlockHeader, Transaction, TxIn, TxOut
 from icsicoin.core.hashing import double_sha256
+from icsicoin.mining.notify import WorkNotifier
+from icsicoin.mining.template import TemplateCache
 
 logger = logging.getLogger("RPCServer")
 
+# Longest a long-polling getblocktemplate is held before returning a fresh template anyway
+GBT_LONGPOLL_TIMEOUT = int(os.getenv('GBT_LONGPOLL_TIMEOUT', 60))
+
+# Mempool-only changes end a long poll once it has waited this long (tip changes end it at once)
+GBT_LONGPOLL_MEMPOOL_DELAY = int(os.getenv('GBT_LONGPOLL_MEMPOOL_DELAY', 10))
+
+# Idle push connections get a blank line this often so dead ones are noticed
+NOTIFY_KEEPALIVE = 15
+
 class RPCServer:
     def __init__(self, port, user, password, allow_ip, network_manager, chain_manager, mempool, wallet):
         self.port = port
@@ -24,10 +36,20 @@ class RPCServer:
         self.app.router.add_post('/', self.handle_request)
         self.app.router.add_get('/api/rpc/config', self.handle_rpc_config_get)
         self.app.router.add_post('/api/rpc/config', self.handle_rpc_config_post)
+        self.app.router.add_get('/notify', self.handle_notify)
+        # Wakes long-polling miners and push subscribers when their work goes stale
+        self.notifier = WorkNotifier()
+        self.chain_manager.listeners.append(self.notifier.on_tip_changed)
+        self.mempool.listeners.append(self.notifier.on_mempool_changed)
+        # getblocktemplate results, reused until the tip or mempool changes
+        self.templates = TemplateCache(self.chain_manager, self.mempool)
+        self.chain_manager.listeners.append(self.templates.invalidate)
+        self.mempool.listeners.append(self.templates.invalidate)
         self.runner = None
         self.site = None
 
     async def start(self):
+        self.notifier.start()
         self.runner = web.AppRunner(self.app)
         await self.runner.setup()
         self.site = web.TCPSite(self.runner, '0.0.0.0', self.port)
@@ -35,30 +57,38 @@ class RPCServer:
         logger.info(f"RPC Server started on port {self.port}")
 
     async def stop(self):
+        self.notifier.close()
         if self.runner:
             await self.runner.cleanup()
         logger.info("RPC Server stopped")
 
-    async def handle_request(self, request):
-        # Basic Auth Check
-        if self.enforce_auth:
-            auth_header = request.headers.get('Authorization')
-            if not auth_header:
-                return web.Response(text="Unauthorized", status=401, headers={'WWW-Authenticate': 'Basic realm="RPC"'})
+    def _check_auth(self, request):
+        """Basic Auth Check: an error response, or None if the request may proceed."""
+        if not self.enforce_auth:
+            return None
+        auth_header = request.headers.get('Authorization')
+        if not auth_header:
+            return web.Response(text="Unauthorized", status=401, headers={'WWW-Authenticate': 'Basic realm="RPC"'})
+        
+        try:
+            auth_type, encoded = auth_header.split(None, 1)
+            if auth_type.lower() != 'basic':
+                 return web.Response(text="Unauthorized (Use Basic Auth)", status=401)
             
-            try:
-                auth_type, encoded = auth_header.split(None, 1)
-                if auth_type.lower() != 'basic':
-                     return web.Response(text="Unauthorized (Use Basic Auth)", status=401)
-                
-                import base64
-                decoded = base64.b64decode(encoded).decode('utf-8')
-                username, password = decoded.split(':', 1)
-                
-                if username != self.user or password != self.password:
-                     return web.Response(text="Unauthorized (Invalid Credentials)", status=401)
-            except Exception:
-                 return web.Response(text="Unauthorized (Bad Request)", status=401)
+            import base64
+            decoded = base64.b64decode(encoded).decode('utf-8')
+            username, password = decoded.split(':', 1)
+            
+            if username != self.user or password != self.password:
+                 return web.Response(text="Unauthorized (Invalid Credentials)", status=401)
+        except Exception:
+             return web.Response(text="Unauthorized (Bad Request)", status=401)
+        return None
+
+    async def handle_request(self, request):
+        denied = self._check_auth(request)
+        if denied:
+            return denied
 
         # Parsing JSON
         try:
@@ -79,10 +109,10 @@ class RPCServer:
             result = {
                 "version": "0.1-beta-python",
                 "protocolversion": 70015,
-                "blocks": 0,
+                "blocks": self.chain_manager.get_best_height(),
                 "connections": len(self.network_manager.peers),
                 "proxy": "",
-                "difficulty": 1.0,
+                "difficulty": self.chain_manager.difficulty.get_current_difficulty(),
                 "testnet": False,
                 "errors": ""
             }
@@ -99,12 +129,11 @@ class RPCServer:
             result = best['block_hash'] if best else self.chain_manager.genesis_block.get_hash().hex()
 
         elif method == 'getblocktemplate':
-            # 1. Get Tip
-            best = self.chain_manager.block_index.get_best_block()
-            prev_hash_hex = best['block_hash'] if best else '0'*64
-            height = (best['height'] + 1) if best else 1
-            
-            # 2. Coinbase
+            # 0. Long poll: hold the call until the work behind `longpollid` is stale
+            if params and isinstance(params[0], dict) and params[0].get("longpollid"):
+                await self._wait_for_new_work(params[0]["longpollid"])
+
+            # 1. Payout address
             miner_addr = None
             if params and isinstance(params[0], dict):
                  miner_addr = params[0].get("mining_address")
@@ -116,88 +145,14 @@ class RPCServer:
                     self.wallet.get_new_address()
                     addrs = self.wallet.get_addresses()
                 miner_addr = addrs[0]
-            
-            # ScriptPubkey for P2PKH: OP_DUP OP_HASH160 <pubKeyHash> OP_EQUALVERIFY OP_CHECKSIG
-            # address is hex of pubKeyHash as per our Wallet impl
-            # binascii is imported globally
-            pubkey_hash = binascii.unhexlify(miner_addr)
-            # 0x76=OP_DUP, 0xa9=OP_HASH160, 0x14=Push20, <hash>, 0x88=OP_EQUALVERIFY, 0xac=OP_CHECKSIG
-            script_pubkey = b'\x76\xa9\x14' + pubkey_hash + b'\x88\xac'
-            
-            coinbase_tx = Transaction(
-                vin=[TxIn(prev_hash=b'\x00'*32, prev_index=0xffffffff, script_sig=str(height).encode(), sequence=0xffffffff)],
-                vout=[TxOut(amount=50*100000000, script_pubkey=script_pubkey)]
-            )
-            
-            # 3. Select Mempool Txs (Greedy non-conflicting selection)
-            # txs = [coinbase_tx] + self.mempool.get_all_transactions()
-            selected_txs = [coinbase_tx]
-            spent_in_block = set()
-            
-            # Mempool txs
-            candidate_txs = self.mempool.get_all_transactions()
-            logger.info(f"Block Template: Found {len(candidate_txs)} candidates in mempool.")
-            
-            # Sort by fee/priority? For now just FCFS/Arbitrary
-            
-            skipped_count = 0
-            for tx in candidate_txs:
-                is_conflict = False
-                # Check inputs
-                current_tx_inputs = []
-                for vin in tx.vin:
-                    prev_out = (vin.prev_hash, vin.prev_index)
-                    if prev_out in spent_in_block:
-                        is_conflict = True
-                        break
-                    current_tx_inputs.append(prev_out)
-                
-                if not is_conflict:
-                    selected_txs.append(tx)
-                    for inp in current_tx_inputs:
-                        spent_in_block.add(inp)
-                else:
-                    skipped_count += 1
-                    logger.debug(f"Skipping TX {tx.get_hash().hex()} due to conflict in current block")
-            
-            logger.info(f"Block Template: Selected {len(selected_txs)} transactions (Inc. Coinbase). Skipped {skipped_count}.")
-            txs = selected_txs
-            
-            # 4. Build Block Object to calculate Merkle Root
-            # Merkle Root calculation is implicit in Block logic usually, or we do it here.
-            # We need a helper. primitive.Block doesn't have build_merkle_tree method publicly exposed easily?
-            # actually we used a helper in tests.
-            # Let's create a temp block just to get the merkle root if the class supports it, 
-            # or implemented simplistic merkle root here.
-            # Wait, `validate_block` calculates it. Block header has it.
-            # We need to constructing the merkle root from txs.
-            from icsicoin.consensus.merkle import get_merkle_root
-            merkle_root = get_merkle_root(txs)
-            
-            # 5. Calculate dynamic difficulty
-            from icsicoin.consensus.validation import calculate_next_bits, bits_to_target
-            next_bits = calculate_next_bits(self.chain_manager, height)
-            next_target = bits_to_target(next_bits)
-            target_hex = format(next_target, '064x')
-            
-            # 6. Return dict
-            # We return enough info for miner to build header
-            result = {
-                "version": 1,
-                "previousblockhash": prev_hash_hex,
-                "curtime": int(time.time()),
-                "bits": next_bits,
-                "height": height,
-                "coinbase_value": 5000000000,
-                "transactions": [binascii.hexlify(tx.serialize()).decode('utf-8') for tx in txs],
-                "merkle_root": binascii.hexlify(merkle_root).decode('utf-8'),
-                "target": target_hex
-            }
+
+            # 2. Template for the current tip and mempool (address is hex of pubKeyHash as per our Wallet impl)
+            result = self.templates.get_template(miner_addr)
 
         elif method == 'submitblock':
             params = data.get('params', [])
             if not params:
-                return web.json_response({"result": None, "error": "Missing block hex", "id": req_id})
+                return web.json_response({"result": None, "error": {"code": -1, "message": "Missing block hex"}, "id": req_id})
             
             block_hex = params[0]
             try:
@@ -206,21 +161,23 @@ class RPCServer:
                 import io
                 f = io.BytesIO(block_bytes)
                 block = Block.deserialize(f)
-                
-                success, reason = self.chain_manager.process_block(block)
-                if success:
-                    # Remove mined transactions from mempool
-                    for tx in block.vtx:
-                        self.mempool.remove_transaction(tx.get_hash().hex())
-
-                    result = "accepted"
-                    # Broadcast to network
-                    asyncio.create_task(self.network_manager.announce_new_block(block))
-                else:
-                    result = f"rejected: {reason}"
+                result = self._submit_block(block)
             except Exception as e:
                  error = {"code": -1, "message": f"Block decode failed: {e}"}
 
+        elif method == 'submitsolution':
+            # Solved work from a template we handed out; the block is rebuilt here
+            try:
+                template_id, nonce, timestamp, extranonce_hex = params[:4]
+                if not isinstance(template_id, str):
+                    raise TypeError("template_id must be a string")
+                nonce, timestamp = int(nonce), int(timestamp)
+                extranonce = bytes.fromhex(extranonce_hex)
+            except (ValueError, TypeError):
+                return web.json_response({"result": None, "error": {"code": -1, "message": "Usage: submitsolution <template_id> <nonce> <timestamp> <extranonce hex>"}, "id": req_id})
+            block, reason = self.templates.build_block(template_id, nonce, timestamp, extranonce)
+            result = self._submit_block(block) if block else f"rejected: {reason}"
+
         elif method == 'getnewaddress':
             result = self.wallet.get_new_address()
             
@@ -243,7 +200,7 @@ class RPCServer:
         elif method == 'addnode':
              params = data.get('params', [])
              if not params:
-                 return web.json_response({"result": None, "error": "Missing node address (usage: addnode <ip>:<port>)", "id": req_id})
+                 return web.json_response({"result": None, "error": {"code": -1, "message": "Missing node address (usage: addnode <ip>:<port>)"}, "id": req_id})
              
              target = params[0]
              try:
@@ -251,7 +208,7 @@ class RPCServer:
                      ip, port_str = target.split(':')
                      port = int(port_str)
                  else:
-                      return web.json_response({"result": None, "error": "Invalid format. Use <ip>:<port>", "id": req_id})
+                      return web.json_response({"result": None, "error": {"code": -1, "message": "Invalid format. Use <ip>:<port>"}, "id": req_id})
                  
                  # Attempt connection (fire and forget task)
                  asyncio.create_task(self.network_manager.connect_to_peer(ip, port))
@@ -305,6 +262,74 @@ class RPCServer:
         }
         return web.json_response(response)
 
+    def _submit_block(self, block):
+        success, reason = self.chain_manager.process_block(block)
+        if not success:
+            return f"rejected: {reason}"
+        # Mined transactions left the mempool as the block connected; broadcast to network
+        asyncio.create_task(self.network_manager.announce_new_block(block))
+        return "accepted"
+
+    def _get_longpollid(self, tip_hash=None):
+        if tip_hash is None:
+            best = self.chain_manager.block_index.get_best_block()
+            tip_hash = best['block_hash'] if best else '0'*64
+        return f"{tip_hash}{self.mempool.sequence}"
+
+    async def _wait_for_new_work(self, longpollid):
+        """
+        Return once the tip differs from the one in longpollid, once the mempool has
+        changed and GBT_LONGPOLL_MEMPOOL_DELAY has passed, or after GBT_LONGPOLL_TIMEOUT.
+        """
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        tip_hash = longpollid[:64]
+        while not self.notifier.closed:
+            current = self._get_longpollid()
+            if current[:64] != tip_hash:
+                return
+            elapsed = loop.time() - start
+            mempool_changed = current != longpollid
+            if mempool_changed and elapsed >= GBT_LONGPOLL_MEMPOOL_DELAY:
+                return
+            if elapsed >= GBT_LONGPOLL_TIMEOUT:
+                return
+            if mempool_changed:
+                # Only a new tip cuts the mempool delay short
+                await self.notifier.wait(min(GBT_LONGPOLL_MEMPOOL_DELAY, GBT_LONGPOLL_TIMEOUT) - elapsed, mempool=False)
+            else:
+                await self.notifier.wait(GBT_LONGPOLL_TIMEOUT - elapsed)
+
+    async def handle_notify(self, request):
+        """
+        Push channel for miners: newline-delimited JSON, one event per line (see
+        WorkNotifier), starting with the current tip. Blank lines are keepalives.
+        """
+        denied = self._check_auth(request)
+        if denied:
+            return denied
+        response = web.StreamResponse(headers={'Content-Type': 'application/x-ndjson'})
+        await response.prepare(request)
+        queue = self.notifier.subscribe()
+        try:
+            best = self.chain_manager.block_index.get_best_block()
+            if best:
+                await response.write((json.dumps({"event": "tip", "hash": best['block_hash'], "height": best['height']}) + "\n").encode())
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), NOTIFY_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    await response.write(b"\n")
+                    continue
+                if event is None:
+                    break
+                await response.write((json.dumps(event) + "\n").encode())
+        except (ConnectionResetError, asyncio.CancelledError):
+            pass
+        finally:
+            self.notifier.unsubscribe(queue)
+        return response
+
     async def _shutdown_server(self):
         logger.info("Shutdown requested via RPC")
         await asyncio.sleep(1) # Give time to return response
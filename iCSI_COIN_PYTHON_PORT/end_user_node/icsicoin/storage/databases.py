@@ -1,6 +1,7 @@
 import sqlite3
 import os
 import os
+import json
 
 class BlockIndexDB:
     def __init__(self, data_dir):
@@ -36,6 +37,13 @@ class BlockIndexDB:
                 )
             """)
             conn.execute("CREATE INDEX IF NOT EXISTS idx_height ON block_index (height)")
+            # Migration check: header fields used by the in-memory block tree
+            cursor = conn.execute("PRAGMA table_info(block_index)")
+            columns = [info[1] for info in cursor.fetchall()]
+            if 'bits' not in columns:
+                conn.execute("ALTER TABLE block_index ADD COLUMN bits INTEGER")
+            if 'timestamp' not in columns:
+                conn.execute("ALTER TABLE block_index ADD COLUMN timestamp INTEGER")
             conn.commit()
 
     def repair_chain_pointer(self):
@@ -96,17 +104,17 @@ class BlockIndexDB:
         except Exception as e:
             print(f"[DB REPAIR] Error: {e}")
 
-    def add_block(self, block_hash, file_num, offset, length, prev_hash, height=0, status=1):
+    def add_block(self, block_hash, file_num, offset, length, prev_hash, height=0, status=1, bits=None, timestamp=None):
         """Add or update a block entry."""
         with sqlite3.connect(self.db_path, timeout=30.0) as conn:
             conn.execute("""
                 INSERT OR REPLACE INTO block_index 
-                (block_hash, file_num, offset, length, prev_hash, height, status)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            """, (block_hash, file_num, offset, length, prev_hash, height, status))
+                (block_hash, file_num, offset, length, prev_hash, height, status, bits, timestamp)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (block_hash, file_num, offset, length, prev_hash, height, status, bits, timestamp))
             conn.commit()
             
-    def add_block_atomic(self, block_hash, file_num, offset, length, prev_hash, height=0, status=1, is_best=False):
+    def add_block_atomic(self, block_hash, file_num, offset, length, prev_hash, height=0, status=1, is_best=False, bits=None, timestamp=None):
         """
         Add block AND update head pointer atomically.
         Prevents corruption where block is added but pointer isn't updated.
@@ -115,9 +123,9 @@ class BlockIndexDB:
             # 1. Add Block
             conn.execute("""
                 INSERT OR REPLACE INTO block_index 
-                (block_hash, file_num, offset, length, prev_hash, height, status)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            """, (block_hash, file_num, offset, length, prev_hash, height, status))
+                (block_hash, file_num, offset, length, prev_hash, height, status, bits, timestamp)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (block_hash, file_num, offset, length, prev_hash, height, status, bits, timestamp))
             
             # 2. Update Head Pointer (if applicable)
             if is_best:
@@ -146,10 +154,53 @@ class BlockIndexDB:
                     'length': row[3],
                     'height': row[4],
                     'prev_hash': row[5],
-                    'status': row[6]
+                    'status': row[6],
+                    'bits': row[7],
+                    'timestamp': row[8]
                 }
             return None
 
+    def get_block_tree_rows(self):
+        """All indexed blocks as (block_hash, prev_hash, height, status, bits, timestamp, file_num, offset), parents first."""
+        with sqlite3.connect(self.db_path, timeout=30.0) as conn:
+            cursor = conn.execute("""
+                SELECT block_hash, prev_hash, height, status, bits, timestamp, file_num, offset
+                FROM block_index ORDER BY height ASC
+            """)
+            return cursor.fetchall()
+
+    def set_header_fields(self, rows):
+        """Backfill (bits, timestamp, block_hash) for rows written before those columns existed."""
+        with sqlite3.connect(self.db_path, timeout=30.0) as conn:
+            conn.executemany("UPDATE block_index SET bits = ?, timestamp = ? WHERE block_hash = ?", rows)
+            conn.commit()
+
+    def apply_chain_update(self, update, chain_state):
+        """
+        Write a ChainUpdate (index, tx index, head pointer and UTXO changes) in one
+        transaction, with the chainstate database attached to the same connection.
+        """
+        with sqlite3.connect(self.db_path, timeout=30.0) as conn:
+            conn.execute("ATTACH DATABASE ? AS cs", (chain_state.db_path,))
+            try:
+                conn.executemany("""
+                    INSERT OR REPLACE INTO block_index 
+                    (block_hash, file_num, offset, length, prev_hash, height, status, bits, timestamp)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """, update.blocks)
+                conn.executemany("UPDATE block_index SET status = ? WHERE block_hash = ?", update.statuses)
+                conn.executemany("INSERT OR REPLACE INTO tx_index (tx_hash, block_hash) VALUES (?, ?)", update.transactions)
+                if update.best_block:
+                    conn.execute("INSERT OR REPLACE INTO chain_info (key, value) VALUES ('best_block_hash', ?)", (update.best_block,))
+                chain_state._write_changes(conn, 'cs.', update.utxo_adds, update.utxo_removes,
+                                           update.undo_puts, update.undo_deletes)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                conn.execute("DETACH DATABASE cs")
+
     def get_block_location(self, block_hash):
         with sqlite3.connect(self.db_path, timeout=30.0) as conn:
             cursor = conn.execute("SELECT file_num, offset, length FROM block_index WHERE block_hash = ?", (block_hash,))
@@ -223,6 +274,12 @@ class BlockIndexDB:
             conn.execute("INSERT OR REPLACE INTO tx_index (tx_hash, block_hash) VALUES (?, ?)", (tx_hash, block_hash))
             conn.commit()
 
+    def add_transactions(self, entries):
+        """Batch form of add_transaction: entries is an iterable of (tx_hash, block_hash)."""
+        with sqlite3.connect(self.db_path, timeout=30.0) as conn:
+            conn.executemany("INSERT OR REPLACE INTO tx_index (tx_hash, block_hash) VALUES (?, ?)", entries)
+            conn.commit()
+
     def get_transaction_block_hash(self, tx_hash):
         """Get the block hash containing the given transaction."""
         with sqlite3.connect(self.db_path, timeout=30.0) as conn:
@@ -243,6 +300,18 @@ class BlockIndexDB:
                 for row in rows:
                     yield row
 
+class ChainUpdate:
+    """Every write of a block connect/disconnect sequence, for BlockIndexDB.apply_chain_update."""
+    def __init__(self):
+        self.blocks = []        # block_index rows for newly stored blocks
+        self.statuses = []      # (status, block_hash)
+        self.transactions = []  # (tx_hash, block_hash)
+        self.best_block = None
+        self.utxo_adds = {}     # (txid, vout) -> utxo dict
+        self.utxo_removes = []  # (txid, vout)
+        self.undo_puts = []     # (block_hash, undo list)
+        self.undo_deletes = []  # block_hash
+
 class ChainStateDB:
     def __init__(self, data_dir):
         self.db_path = os.path.join(data_dir, 'chainstate.sqlite')
@@ -270,6 +339,14 @@ class ChainStateDB:
                 conn.execute("ALTER TABLE utxo ADD COLUMN block_height INTEGER DEFAULT 0")
             if 'is_coinbase' not in columns:
                 conn.execute("ALTER TABLE utxo ADD COLUMN is_coinbase BOOLEAN DEFAULT 0")
+            # Undo data: the outputs each connected block spent, so it can be disconnected
+            # without re-reading the blocks that created them
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS undo (
+                    block_hash TEXT PRIMARY KEY,
+                    data TEXT
+                )
+            """)
                 
             conn.commit()
 
@@ -294,6 +371,56 @@ class ChainStateDB:
                 return {'amount': row[0], 'script_pubkey': row[1], 'block_height': row[2], 'is_coinbase': bool(row[3])}
             return None
 
+    def get_utxos(self, outpoints):
+        """
+        Batch lookup of many outpoints in one connection.
+        outpoints: iterable of (txid_hex, vout_index).
+        Returns {(txid_hex, vout_index): utxo_dict} for the outpoints that exist.
+        """
+        outpoints = list(dict.fromkeys(outpoints))
+        results = {}
+        if not outpoints:
+            return results
+        with sqlite3.connect(self.db_path, timeout=30.0) as conn:
+            # SQLite caps bound parameters (999 on older builds); 2 per outpoint
+            for i in range(0, len(outpoints), 400):
+                chunk = outpoints[i:i+400]
+                placeholders = ",".join(["(?, ?)"] * len(chunk))
+                params = [v for outpoint in chunk for v in outpoint]
+                cursor = conn.execute(f"""
+                    SELECT txid, vout_index, amount, script_pubkey, block_height, is_coinbase FROM utxo
+                    WHERE (txid, vout_index) IN (VALUES {placeholders})
+                """, params)
+                for row in cursor.fetchall():
+                    results[(row[0], row[1])] = {'amount': row[2], 'script_pubkey': row[3], 'block_height': row[4], 'is_coinbase': bool(row[5])}
+        return results
+
+    def get_undo(self, block_hash):
+        """Spent outputs recorded when block_hash was connected, or None if it predates undo data."""
+        with sqlite3.connect(self.db_path, timeout=30.0) as conn:
+            cursor = conn.execute("SELECT data FROM undo WHERE block_hash = ?", (block_hash,))
+            row = cursor.fetchone()
+            if row:
+                return json.loads(row[0])
+            return None
+
+    def apply_changes(self, adds, removes, undo_puts=(), undo_deletes=()):
+        """Apply a UTXOView's net changes (and undo records) in one transaction."""
+        with sqlite3.connect(self.db_path, timeout=30.0) as conn:
+            self._write_changes(conn, '', adds, removes, undo_puts, undo_deletes)
+            conn.commit()
+
+    def _write_changes(self, conn, schema, adds, removes, undo_puts, undo_deletes):
+        conn.executemany(f"DELETE FROM {schema}utxo WHERE txid = ? AND vout_index = ?", removes)
+        conn.executemany(f"""
+            INSERT OR REPLACE INTO {schema}utxo (txid, vout_index, amount, script_pubkey, block_height, is_coinbase)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, [(txid, vout, u['amount'], u['script_pubkey'], u['block_height'], u['is_coinbase'])
+              for (txid, vout), u in adds.items()])
+        conn.executemany(f"DELETE FROM {schema}undo WHERE block_hash = ?", [(h,) for h in undo_deletes])
+        conn.executemany(f"INSERT OR REPLACE INTO {schema}undo (block_hash, data) VALUES (?, ?)",
+                         [(h, json.dumps(data)) for h, data in undo_puts])
+
     def get_utxos_by_script(self, script_pubkey):
         """Find all UTXOs paying to a specific script (address)."""
         # Note: script_pubkey should be bytes
@@ -104,36 +104,15 @@ class Wallet:
         
         if mempool:
             # 2. Calculate Pending Impact
-            mempool_spent = set()
-            
+            # A. Confirmed UTXOs of ours spent by a mempool tx (Debit)
+            for u in utxos:
+                u_txid = u['txid']
+                if isinstance(u_txid, bytes): u_txid = u_txid.decode('utf-8')
+                if mempool.is_spent((u_txid, u['vout'])):
+                    pending_change -= u['amount']
+
             # Scan Mempool
             for tx in mempool.get_all_transactions():
-                tx_hash = tx.get_hash().hex()
-                
-                # A. Inputs spent by this address (Debit)
-                for vin in tx.vin:
-                    # We need to know if this input belongs to US.
-                    # We can check if the spent output was ours.
-                    # But vin only has prev_hash/index. 
-                    # We have to see if (prev_hash, prev_index) matches one of our UTXOs.
-                    # OR we can assume if we are calling this function, we probably own the keys signing it?
-                    # No, we must rely on UTXO set.
-                    
-                    # Optimization: We already have 'utxos' list which is our Confirmed UTXOs.
-                    # If vin spends one of 'utxos', it is a pending debit.
-                    
-                    prev_txid = vin.prev_hash.hex()
-                    if isinstance(vin.prev_hash, bytes):
-                         prev_txid = vin.prev_hash.hex() # Standardize
-                    
-                    # Check against our confirmed UTXOs
-                    for u in utxos:
-                        u_txid = u['txid']
-                        if isinstance(u_txid, bytes): u_txid = u_txid.decode('utf-8')
-                        
-                        if u_txid == prev_txid and u['vout'] == vin.prev_index:
-                             pending_change -= u['amount']
-                
                 # B. Outputs created for this address (Credit)
                 for vout in tx.vout:
                     if vout.script_pubkey == script:
@@ -182,18 +161,12 @@ class Wallet:
                 pass 
                 
         # Optimization: Pre-calculate mempool impacts
-        mempool_spent = set()
+        # (inputs spent in the mempool are looked up in its outpoint index)
         mempool_outputs = [] # List of (txid, vout, amount, script_pubkey)
         
         if mempool:
              for tx in mempool.get_all_transactions():
                  tx_hash = tx.get_hash().hex()
-                 # Inputs spent
-                 for vin in tx.vin:
-                     mempool_spent.add((vin.prev_hash.hex(), vin.prev_index))
-                     # Also handle byte/str discrepancy if prev_hash is bytes
-                     # vin.prev_hash is bytes usually
-                     
                  # Outputs created
                  for i, vout in enumerate(tx.vout):
                      mempool_outputs.append({
@@ -229,30 +202,15 @@ class Wallet:
                 
             for u in metrics_utxos:
                 # CHECK IF SPENT IN MEMPOOL
-                # DEBUG
-                print(f"DEBUG: Checking UTXO: {u['txid']} type: {type(u['txid'])} vout: {u['vout']}", flush=True)
-                print(f"DEBUG: Mempool Spent: {mempool_spent}", flush=True)
-                
-                if (u['txid'], u['vout']) in mempool_spent:
-                     print("DEBUG: SKIPPING SPENT UTXO", flush=True)
+                # u['txid'] from DB is hex string; the mempool index is keyed by hex too.
+                if mempool and mempool.is_spent((u['txid'], u['vout'])):
                      continue
                      
                 # CHECK IF SPENT IN MEMPOOL (Bytes Key compatibility)
-                # u['txid'] from DB is hex string? check databases.py. Yes, hex string.
-                # our mempool_spent set has (hex_str, int).
-                if isinstance(u['txid'], bytes):
-                    print("DEBUG: Handling bytes txid", flush=True) 
-                    txid_str = u['txid'].decode('utf-8')
-                    if (txid_str, u['vout']) in mempool_spent:
-                         print("DEBUG: SKIPPING SPENT UTXO (Bytes decoded)", flush=True)
+                if mempool and isinstance(u['txid'], bytes):
+                    txid_str = u['txid'].decode('utf-8', errors='ignore')
+                    if mempool.is_spent((txid_str, u['vout'])):
                          continue
-                    # Also try hex conversion if it's raw bytes
-                    try:
-                        txid_hex = binascii.hexlify(u['txid']).decode('utf-8')
-                        if (txid_hex, u['vout']) in mempool_spent:
-                            print("DEBUG: SKIPPING SPENT UTXO (Hexified)", flush=True)
-                            continue
-                    except: pass
                 
                 # Check Coinbase Maturity (100 blocks)
                 # Coinbase Maturity Check (100 blocks)
@@ -312,37 +270,14 @@ class Wallet:
         tx = Transaction(vin=tx_ins, vout=outputs)
         
         # 4. Sign Inputs
-        # This requires SIGHASH_ALL logic which might be in validation.py or need to be implemented here.
-        # We need `get_signature_hash` method on Transaction? 
-        # Or reuse validation logic.
-        # In `validation.py`, we check signature.
-        # We need the reverse: Generate signature.
-        # SIGHASH_ALL: Serialize Tx with current input script replaced by sub-script (script_pubkey of UTXO)
-        
-        from icsicoin.core.hashing import double_sha256
-        import struct
+        # SIGHASH_ALL: Serialize Tx with current input script replaced by sub-script (script_pubkey of UTXO).
+        # SighashCache serializes the shared parts of the preimage once; each input still hashes its own full preimage.
+        from icsicoin.consensus.sighash import SighashCache
+        sighash_cache = SighashCache(tx)
         
         for i, inp in enumerate(inputs):
-            # Sign for input i
-            # 1. Get Preimage
-            # Simplistic SIGHASH_ALL implementation
-            # (Matches validation logic ideally)
-            
-            # Clone tx for signing
-            # Set scripts for all inputs to empty, EXCEPT current one set to script_pubkey
-            # (This is the classic Bitcoin SIGHASH_ALL procedure)
-            
-            tmp_tx_ins = []
-            for j, tx_in in enumerate(tx.vin):
-                if i == j:
-                     script = inp['script_pubkey']
-                else:
-                     script = b''
-                tmp_tx_ins.append(TxIn(tx_in.prev_hash, tx_in.prev_index, script, tx_in.sequence))
-            
-            tmp_tx = Transaction(vin=tmp_tx_ins, vout=tx.vout, locktime=tx.locktime)
-            msg = tmp_tx.serialize() + struct.pack("<I", 1) # Append SIGHASH_ALL (1)
-            sighash = double_sha256(msg)
+            # 1. Get Preimage Digest (matches ScriptEngine verification)
+            sighash = sighash_cache.signature_hash(i, inp['script_pubkey'])
             
             # 2. Sign
             priv_key_hex = inp['key']['priv']
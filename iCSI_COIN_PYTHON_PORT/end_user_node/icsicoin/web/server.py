@@ -1020,6 +1020,9 @@ class WebServer:
         
         # Calculate Hashrate
         network_hashrate = self.network_manager.chain_manager.get_network_hashrate(blocks=10)
+
+        from icsicoin.consensus.sigcache import signature_cache
+        stratum_server = getattr(self.network_manager, 'stratum_server', None)
         
         return web.json_response({
             'height': height,
@@ -1028,7 +1031,12 @@ class WebServer:
             'halving_countdown': halving_countdown,
             'difficulty_countdown': DIFFICULTY_ADJUSTMENT_INTERVAL - (height % DIFFICULTY_ADJUSTMENT_INTERVAL),
             'test_msg_received': self.network_manager.test_msg_count,
-            'network_hashrate': network_hashrate
+            'network_hashrate': network_hashrate,
+            'sig_cache': signature_cache.get_stats(),
+            'orphan_pool': self.network_manager.chain_manager.orphan_pool.get_stats(),
+            'mempool': self.network_manager.mempool.get_stats(),
+            'stratum': stratum_server.get_stats() if stratum_server else None,
+            'miner': self.miner_controller.get_metrics()
         })
 
     async def handle_test_stun(self, request):
@@ -1134,24 +1142,19 @@ class WebServer:
 
     async def _broadcast_tx_task(self, tx):
         try:
-            import json as json_mod
-            from icsicoin.network.messages import Message
+            from icsicoin.network.messages import InvMessage
             
             tx_hash_hex = tx.get_hash().hex()
             logger.info(f"Starting async broadcast for tx {tx_hash_hex}")
             
-            inv_msg = {
-                "type": "inv",
-                "inventory": [{"type": "tx", "hash": tx_hash_hex}]
-            }
-            json_payload = json_mod.dumps(inv_msg).encode('utf-8')
-            out_m = Message('inv', json_payload)
+            items = [{"type": "tx", "hash": tx_hash_hex}]
             
             count = 0
             # Best effort broadcast
             for peer_addr, peer_writer in self.network_manager.active_connections.items():
                 try:
                     logger.info(f"Broadcasting tx {tx_hash_hex} to {peer_addr}")
+                    out_m = InvMessage(items, self.network_manager.speaks_binary(peer_writer))
                     peer_writer.write(out_m.serialize())
                     await peer_writer.drain()
                     count += 1
@@ -4,10 +4,8 @@ import time
 import json
 import requests
 import binascii
-import struct
 import argparse
 import logging
-import scrypt
 
 # Add current directory to path to allow importing icsicoin modules if needed
 # But for a standalone miner, ideally it should be self-contained OR explicitly use the library.
@@ -16,7 +14,16 @@ import scrypt
 import os
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from icsicoin.core.primitives import Block, BlockHeader
+from icsicoin.mining.workers import HashWorkers
+from icsicoin.mining.watcher import TemplateWatcher
+from icsicoin.mining.work import WorkTemplate
+from icsicoin.mining.stratum import StratumClient
+
+# Nonces tried per unit of work before rolling the extranonce and timestamp
+NONCES_PER_WORK = 10000000
+
+# Client-side timeout for a long-polling getblocktemplate (the node answers within a minute)
+LONGPOLL_HTTP_TIMEOUT = 90
 
 # Configure logging
 logging.basicConfig(
@@ -25,7 +32,7 @@ logging.basicConfig(
 )
 logger = logging.getLogger("Miner")
 
-def rpc_call(url, method, params=None, session=None):
+def rpc_call(url, method, params=None, session=None, timeout=None):
     headers = {'content-type': 'application/json'}
     payload = {
         "method": method,
@@ -35,9 +42,9 @@ def rpc_call(url, method, params=None, session=None):
     }
     try:
         if session:
-            response = session.post(url, data=json.dumps(payload), headers=headers)
+            response = session.post(url, data=json.dumps(payload), headers=headers, timeout=timeout)
         else:
-            response = requests.post(url, data=json.dumps(payload), headers=headers)
+            response = requests.post(url, data=json.dumps(payload), headers=headers, timeout=timeout)
         response.raise_for_status()
         return response.json()
     except Exception as e:
@@ -49,8 +56,11 @@ def bits_to_target(bits):
     coefficient = bits & 0xffffff
     return coefficient * (256**(exponent - 3))
 
+def format_hashrates(rates):
+    return f"{sum(rates):.2f} H/s [" + ", ".join(f"{r:.0f}" for r in rates) + "]"
+
 def mine(url, user, password, address=None, threads=1):
-    logger.info(f"Starting miner on {url}")
+    logger.info(f"Starting miner on {url} with {threads} worker process(es)")
     if address:
         logger.info(f"Mining to address: {address}")
     else:
@@ -59,117 +69,147 @@ def mine(url, user, password, address=None, threads=1):
     # Session for keep-alive
     session = requests.Session()
     session.auth = (user, password)
-    
-    while True:
-        # 1. Get Work
-        params = []
+
+    # Each worker process hashes its own slice of the nonce range
+    workers = HashWorkers(threads)
+    workers.start()
+
+    # Long-polls the node for newer work on its own connection; interrupts the wait below when it arrives
+    poll_session = requests.Session()
+    poll_session.auth = (user, password)
+    def fetch_newer(longpollid):
+        params = {"longpollid": longpollid}
         if address:
-            params.append({"mining_address": address})
-            
-        resp = rpc_call(url, "getblocktemplate", params=params, session=session)
-        if not resp or resp.get('error'):
-            logger.error(f"Failed to get work: {resp.get('error') if resp else 'No response'}")
-            time.sleep(5)
-            continue
-            
-        template = resp['result']
-        height = template['height']
-        target_str = template['target']
-        target = int(target_str, 16)
-        
-        # 2. Construct Block
-        # We need to construct a Block object to verify/submit, OR just a Header to mine.
-        # RPC returns:
-        # previousblockhash (hex)
-        # curtime (int)
-        # bits (int)
-        # transactions (hex list)
-        # merkle_root (hex)
-        
-        prev_hash = binascii.unhexlify(template['previousblockhash'])
-        merkle_root = binascii.unhexlify(template['merkle_root'])
-        timestamp = template['curtime']
-        bits = template['bits']
-        version = template['version']
-        
-        # Construct Header
-        header = BlockHeader(version, prev_hash, merkle_root, timestamp, bits, 0)
-        
-        # Mining Loop
-        logger.info(f"Mining Block {height} with difficulty {bits}. Tx Count: {len(template['transactions'])}")
-        start_time = time.time()
-        last_rpc_check = time.time()
-        hashes = 0
-        
-        found = False
-        # Simple loop
-        # max_nonce = 0xFFFFFFFF
-        # Let's respect extra nonce/time rolling but for now just nonce rolling.
-        for nonce in range(0, 10000000): # Try 10M hashes then refresh template
-            header.nonce = nonce
-            
-            # Hash
-            # In Phase 3 validation we used scrypt(header_bytes)
-            header_bytes = header.serialize()
-            pow_hash = scrypt.hash(header_bytes, header_bytes, N=1024, r=1, p=1, buflen=32)
-            
-            pow_int = int.from_bytes(pow_hash, 'little')
-            
-            if pow_int <= target:
-                logger.info(f"FOUND BLOCK! Nonce: {nonce}, Hash: {binascii.hexlify(pow_hash).decode()}")
-                found = True
-                break
-                
-            hashes += 1
-            # Check for stale tip every 2 seconds
-            # Original code checked every 100k hashes, which is too frequent on fast CPUs (>10 checks/sec)
-            # causing RPC spam and CPU spikes on the node.
-            # We still print hashrate every 100k hashes for user feedback.
-            if hashes % 100000 == 0:
-                 print(f"Hashrate: {hashes / (time.time() - start_time):.2f} H/s", end='\r')
-                 
-            if time.time() - last_rpc_check > 2.0:
-                 last_rpc_check = time.time()
-                 try:
-                     # Use the same session, check current tip
-                     tip_resp = rpc_call(url, "getbestblockhash", session=session)
-                     if tip_resp and tip_resp.get('result') != template['previousblockhash']:
-                         logger.info(f"\n[!] New block detected on network! detected at nonce {nonce}. Restarting loop.")
-                         found = False
-                         break # Break inner loop to refresh template
-                 except Exception as e:
-                     logger.debug(f"Stale check failed: {e}")
-                 
-        if found:
-            # 3. Submit
-            # Construct full block
-            # We need to parse transactions from hex to Tx objects
-            from icsicoin.core.primitives import Transaction
-            import io
+            params["mining_address"] = address
+        resp = rpc_call(url, "getblocktemplate", params=[params], session=poll_session, timeout=LONGPOLL_HTTP_TIMEOUT)
+        return resp['result'] if resp and not resp.get('error') else None
+    watcher = TemplateWatcher(fetch_newer, on_change=workers.interrupt)
+    watcher.start()
+
+    template = None
+    try:
+        while True:
+            # 1. Get Work (unless the long poll already brought it)
+            if template is None:
+                params = []
+                if address:
+                    params.append({"mining_address": address})
+                    
+                resp = rpc_call(url, "getblocktemplate", params=params, session=session)
+                if not resp or resp.get('error'):
+                    logger.error(f"Failed to get work: {resp.get('error') if resp else 'No response'}")
+                    time.sleep(5)
+                    continue
+                template = resp['result']
+            work = WorkTemplate(template)
+            height = work.height
             
-            txs = []
-            for tx_hex in template['transactions']:
-                tx_bytes = binascii.unhexlify(tx_hex)
-                txs.append(Transaction.deserialize(io.BytesIO(tx_bytes)))
-                
-            block = Block(header, txs)
-            block_hex = binascii.hexlify(block.serialize()).decode('utf-8')
+            logger.info(f"Mining Block {height} with difficulty {work.bits}. Tx Count: {len(template['transactions'])}")
+            watcher.watch(template)
+            last_report = time.time()
             
-            submit_resp = rpc_call(url, "submitblock", [block_hex], session=session)
-            if submit_resp and submit_resp.get('result') == 'accepted':
-                logger.info(f"Block accepted! Height: {height}")
-            else:
-                logger.error(f"Block rejected at Height {height}!")
-                logger.error(f"Block Context: PrevHash={binascii.hexlify(prev_hash).decode()[:16]}..., Time={timestamp}, Merkle={binascii.hexlify(merkle_root).decode()[:16]}...")
-                if submit_resp:
-                     logger.error(f"Node Response: {submit_resp}")
+            found = None
+            while not found and not watcher.stale:
+                # 2. Fresh extranonce/curtime for every nonce range; no round trip to the node
+                header, coinbase = work.next_work()
+                workers.submit(header.serialize(), work.target, 0, NONCES_PER_WORK)
+                while not workers.exhausted and not watcher.stale:
+                    found = workers.wait(timeout=max(0.0, last_report + 10.0 - time.time()))
+                    if found:
+                        break
+
+                    now = time.time()
+                    if now - last_report >= 10.0:
+                        last_report = now
+                        print(f"Hashrate: {format_hashrates(workers.get_hashrates())}", end='\r')
+                if not found and not watcher.stale:
+                    logger.debug(f"Nonce range exhausted; rolled to extranonce {work.extranonce}")
+            # Stops every worker, whether one found the block or the work went stale
+            workers.cancel()
+            newer = watcher.take()
+                     
+            if found:
+                nonce, pow_hash, worker = found
+                header.nonce = nonce
+                logger.info(f"FOUND BLOCK! Nonce: {nonce} (worker {worker}), Hash: {binascii.hexlify(pow_hash).decode()}")
+
+                # 3. Submit: the node rebuilds the block from its copy of the template
+                params = work.solution_params(header, coinbase)
+                submit_resp = rpc_call(url, "submitsolution", params, session=session) if params else None
+                if not submit_resp or submit_resp.get('result') in (None, 'rejected: unknown-template'):
+                    # Older node, or it no longer has the template: send the whole block
+                    block = work.build_block(header, coinbase)
+                    block_hex = binascii.hexlify(block.serialize()).decode('utf-8')
+                    submit_resp = rpc_call(url, "submitblock", [block_hex], session=session)
+                if submit_resp and submit_resp.get('result') == 'accepted':
+                    logger.info(f"Block accepted! Height: {height}")
                 else:
-                     logger.error("Node Response: None (Network Error?)")
-                
-            # Sleep a bit to avoid race or spam
-            time.sleep(0.5) 
-        else:
-             logger.info("Nonce exhausted/Refresh needed. Getting new template.")
+                    logger.error(f"Block rejected at Height {height}!")
+                    logger.error(f"Block Context: PrevHash={template['previousblockhash'][:16]}..., Time={header.timestamp}, Merkle={header.merkle_root.hex()[:16]}...")
+                    if submit_resp:
+                         logger.error(f"Node Response: {submit_resp}")
+                    else:
+                         logger.error("Node Response: None (Network Error?)")
+                    
+                # Our own block makes any newer template stale too
+                template = None
+            elif newer['previousblockhash'] != template['previousblockhash']:
+                 logger.info("\n[!] New block detected on network! Restarting workers.")
+                 template = newer
+            else:
+                 logger.info("Mempool changed. Restarting workers on the new template.")
+                 template = newer
+    finally:
+        watcher.stop()
+        workers.close()
+
+def mine_stratum(host, port, worker, password, threads=1):
+    """Mine shares for a node's stratum server; it builds and relays any block we find."""
+    logger.info(f"Starting stratum miner on {host}:{port} as {worker} with {threads} worker process(es)")
+    workers = HashWorkers(threads)
+    workers.start()
+    try:
+        while True:
+            client = StratumClient(host, port, on_job=workers.interrupt)
+            try:
+                client.connect(worker, password)
+            except (OSError, ConnectionError) as e:
+                logger.error(f"Stratum connection failed: {e}")
+                time.sleep(5)
+                continue
+
+            seq = 0
+            last_report = time.time()
+            while client.connected:
+                latest = client.wait_job(seq, timeout=5)
+                if latest is None:
+                    continue
+                seq, job = latest
+                job_id = job[0]
+                work = WorkTemplate(client.job_template(job))
+                prefix_len = len(work.coinbase_prefix)
+                logger.info(f"Job {job_id}: block {work.height}, share difficulty {client.difficulty}")
+                # New job (or dropped connection) interrupts the wait; shares just move on to fresh work
+                while client.job_seq == seq and client.connected:
+                    header, coinbase = work.next_work()
+                    workers.submit(header.serialize(), work.target, 0, NONCES_PER_WORK)
+                    while not workers.exhausted and client.job_seq == seq and client.connected:
+                        found = workers.wait(timeout=max(0.0, last_report + 10.0 - time.time()))
+                        if found:
+                            extranonce2 = coinbase[prefix_len:prefix_len + work.extranonce_size]
+                            client.submit(worker, job_id, extranonce2, header.timestamp, found[0])
+                            break
+                        now = time.time()
+                        if now - last_report >= 10.0:
+                            last_report = now
+                            print(f"Hashrate: {format_hashrates(workers.get_hashrates())} "
+                                  f"shares {client.accepted} accepted / {client.rejected} rejected", end='\r')
+                    workers.cancel()
+            logger.error("Stratum connection lost; reconnecting")
+            client.close()
+            time.sleep(1)
+    finally:
+        workers.close()
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -177,6 +217,13 @@ if __name__ == "__main__":
     parser.add_argument("--user", default="user", help="RPC User")
     parser.add_argument("--pass", dest="password", default="pass", help="RPC Password")
     parser.add_argument("--address", help="Wallet address to mine rewards to")
+    parser.add_argument("--threads", type=int, default=os.cpu_count() or 1, help="Hashing processes (default: one per core)")
+    parser.add_argument("--stratum", help="Mine through the node's stratum server at host:port instead of RPC")
+    parser.add_argument("--worker", help="Stratum worker name (default: --address, or 'miner')")
     args = parser.parse_args()
     
-    mine(args.url, args.user, args.password, args.address)
+    if args.stratum:
+        host, port = args.stratum.rsplit(':', 1)
+        mine_stratum(host, int(port), args.worker or args.address or "miner", args.password, args.threads)
+    else:
+        mine(args.url, args.user, args.password, args.address, args.threads)
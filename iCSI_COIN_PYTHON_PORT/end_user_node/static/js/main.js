@@ -663,12 +663,15 @@ async function updateMiner() {
     document.getElementById('startMineBtn').disabled = data.is_mining;
     document.getElementById('stopMineBtn').disabled = !data.is_mining;
 
-    // Update Terminal
+    // Update Terminal: log entries are {time, level, message}, rendered as text
     const terminal = document.getElementById('miningTerminal');
-    // We only append new logs or replace?
-    // Let's replace content with last 10 logs for simplicity, or append diff.
-    // Simpler: Just render last 20 logs joined
-    terminal.innerHTML = data.logs.join('<div class="mb-1 border-l-2 border-zinc-700 pl-2"></div>');
+    const levelColors = { success: 'text-green-400', warning: 'text-yellow-400', error: 'text-red-400' };
+    terminal.replaceChildren(...data.logs.map(entry => {
+        const line = document.createElement('div');
+        line.className = `mb-1 border-l-2 border-zinc-700 pl-2 ${levelColors[entry.level] || ''}`;
+        line.textContent = `[${entry.time}] ${entry.message}`;
+        return line;
+    }));
     terminal.scrollTop = terminal.scrollHeight;
 }
 
@@ -103,5 +103,264 @@ class TestChainManager(unittest.TestCase):
 
     import unittest.mock
 
+class TestReorg(unittest.TestCase):
+    """Chainwork fork choice and batched reorgs against real databases."""
+    def setUp(self):
+        from ecdsa import SigningKey, SECP256k1
+        self.test_dir = tempfile.mkdtemp()
+        self.block_store = BlockStore(self.test_dir)
+        self.block_index = BlockIndexDB(self.test_dir)
+        self.chain_state = ChainStateDB(self.test_dir)
+        self.chain_manager = ChainManager(self.block_store, self.block_index, self.chain_state)
+        self.sk = SigningKey.generate(curve=SECP256k1)
+        pubkey = self.sk.verifying_key.to_string()
+        self.pubkey = pubkey
+        pkh = hashlib.new('ripemd160', hashlib.sha256(pubkey).digest()).digest()
+        self.script = b'\x76\xa9\x14' + pkh + b'\x88\xac'
+        # Header proof of work with double SHA-256 instead of scrypt, so test chains mine quickly
+        from icsicoin.core.hashing import double_sha256
+        patcher = unittest.mock.patch('icsicoin.consensus.validation.hash_header', double_sha256)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def make_block(self, prev_hash, tag, spend=None, bad_sig=False):
+        from icsicoin.consensus.merkle import get_merkle_root
+        from icsicoin.consensus.sighash import SighashCache
+        from ecdsa.util import sigencode_der
+        vtx = [Transaction(vin=[TxIn(b'\x00'*32, 0xffffffff, tag.encode(), 0xffffffff)],
+                           vout=[TxOut(5000000000, self.script)])]
+        if spend:
+            tx = Transaction(vin=[TxIn(bytes.fromhex(spend), 0)], vout=[TxOut(4000000000, self.script)])
+            digest = b'\x00' * 32 if bad_sig else SighashCache(tx).signature_hash(0, self.script)
+            sig = self.sk.sign_digest(digest, sigencode=sigencode_der) + b'\x01'
+            tx.vin[0].script_sig = bytes([len(sig)]) + sig + bytes([len(self.pubkey)]) + self.pubkey
+            vtx.append(tx)
+        header = BlockHeader(prev_block=bytes.fromhex(prev_hash), merkle_root=get_merkle_root(vtx),
+                             timestamp=1700000000, bits=0x1f099996)
+        return Block(header, vtx)
+
+    def build(self, prev_hash, count, tag, spends=()):
+        blocks = []
+        for i in range(count):
+            block = self.make_block(prev_hash, f"{tag}{i}", spends[i] if i < len(spends) else None)
+            success, reason = self.chain_manager.process_block(block)
+            self.assertTrue(success, reason)
+            blocks.append(block)
+            prev_hash = block.get_hash().hex()
+        return blocks
+
+    def utxo_snapshot(self):
+        import sqlite3
+        with sqlite3.connect(self.chain_state.db_path) as conn:
+            return sorted(conn.execute("SELECT txid, vout_index, amount, block_height FROM utxo").fetchall())
+
+    def test_reorg_to_more_work(self):
+        genesis = self.chain_manager.genesis_block.get_hash().hex()
+        main = self.build(genesis, 3, "main")
+        coinbase_1 = main[0].vtx[0].get_hash().hex()
+        base = self.utxo_snapshot()
+
+        # Side branch from block 1 spends block 1's coinbase; equal work is only stored
+        side = self.build(main[0].get_hash().hex(), 2, "side", spends=[coinbase_1])
+        self.assertEqual(self.block_index.get_best_block()['block_hash'], main[-1].get_hash().hex())
+        self.assertEqual(self.utxo_snapshot(), base)
+
+        # One more block gives the side branch more work
+        tip = self.make_block(side[-1].get_hash().hex(), "side2")
+        self.assertEqual(self.chain_manager.process_block(tip), (True, "Reorg Success"))
+        best = self.block_index.get_best_block()
+        self.assertEqual((best['block_hash'], best['height']), (tip.get_hash().hex(), 4))
+        self.assertIsNone(self.chain_state.get_utxo(coinbase_1, 0))
+        self.assertIsNone(self.chain_state.get_utxo(main[1].vtx[0].get_hash().hex(), 0))
+        self.assertEqual(self.block_index.get_block_info(main[2].get_hash().hex())['status'], 2)
+        self.assertEqual(self.block_index.get_block_hash_by_height(2), side[0].get_hash().hex())
+
+        # And back: the old branch catches up, disconnecting through the undo data
+        self.build(main[-1].get_hash().hex(), 2, "main-more")
+        self.assertEqual(self.chain_manager.block_tree.tip.height, 5)
+        self.assertIsNotNone(self.chain_state.get_utxo(coinbase_1, 0))
+        self.assertIsNone(self.chain_state.get_utxo(side[0].vtx[1].get_hash().hex(), 0))
+
+    def test_reorg_aborts_on_invalid_block(self):
+        genesis = self.chain_manager.genesis_block.get_hash().hex()
+        main = self.build(genesis, 2, "main")
+        base = self.utxo_snapshot()
+
+        # Middle block of the new branch spends an output that doesn't exist
+        side = self.build(genesis, 1, "side")
+        bad = self.make_block(side[0].get_hash().hex(), "bad", spend='ee'*32)
+        self.assertEqual(self.chain_manager.process_block(bad), (True, "Fork Stored"))
+        tip = self.make_block(bad.get_hash().hex(), "tip")
+        success, reason = self.chain_manager.process_block(tip)
+        self.assertFalse(success)
+
+        self.assertEqual(self.block_index.get_best_block()['block_hash'], main[-1].get_hash().hex())
+        self.assertEqual(self.utxo_snapshot(), base)
+        self.assertTrue(self.chain_manager.block_tree.get(bad.get_hash().hex()).invalid)
+        self.assertEqual(self.chain_manager.process_block(self.make_block(tip.get_hash().hex(), "more"))[1], "Parent invalid")
+
+    def test_reorg_missing_block_can_retry(self):
+        genesis = self.chain_manager.genesis_block.get_hash().hex()
+        main = self.build(genesis, 2, "main")
+        side = self.build(genesis, 2, "side")
+        tip = self.make_block(side[-1].get_hash().hex(), "tip")
+
+        # A side branch body that can't be read fails the reorg without storing the tip
+        missing = side[0].get_hash().hex()
+        load = self.chain_manager.get_block_by_hash
+        with unittest.mock.patch.object(self.chain_manager, 'get_block_by_hash',
+                                        side_effect=lambda h: None if h == missing else load(h)):
+            self.assertEqual(self.chain_manager.process_block(tip), (False, f"Reorg failed: Missing block {missing}"))
+        self.assertEqual(self.block_index.get_best_block()['block_hash'], main[-1].get_hash().hex())
+
+        # A later copy of the tip is taken, not turned away as already known
+        self.assertEqual(self.chain_manager.process_block(tip), (True, "Reorg Success"))
+        self.assertEqual(self.block_index.get_best_block()['block_hash'], tip.get_hash().hex())
+
+    def mine(self, block):
+        from icsicoin.consensus.validation import validate_block_header
+        while not validate_block_header(block.header, None):
+            block.header.nonce += 1
+        return block
+
+    def assumed_chain(self):
+        """Blocks 1-3 on genesis (with real proof of work), where block 2 carries a bad signature."""
+        genesis = self.chain_manager.genesis_block.get_hash().hex()
+        b1 = self.mine(self.make_block(genesis, "av1"))
+        b2 = self.mine(self.make_block(b1.get_hash().hex(), "av2", spend=b1.vtx[0].get_hash().hex(), bad_sig=True))
+        b3 = self.mine(self.make_block(b2.get_hash().hex(), "av3"))
+        return b1, b2, b3
+
+    def test_assume_valid_skips_scripts_below_block(self):
+        from icsicoin.consensus.assumevalid import AssumeValid
+        b1, b2, b3 = self.assumed_chain()
+        self.chain_manager.assume_valid = AssumeValid(b3.get_hash().hex())
+        # Headers first, so the assume-valid block is in the block tree before the bodies arrive
+        self.assertTrue(self.chain_manager.wants_headers())
+        self.assertEqual(self.chain_manager.accept_headers([b.header for b in (b1, b2, b3)]), (True, "Headers accepted"))
+        self.assertFalse(self.chain_manager.wants_headers())
+        self.assertEqual(self.block_index.get_best_block()['height'], 0)
+
+        # A body whose parent is only a header waits in the orphan pool
+        self.assertEqual(self.chain_manager.process_block(b2), (False, "Orphan block"))
+        for block in (b1, b3):
+            self.assertEqual(self.chain_manager.process_block(block), (True, "Accepted"))
+        self.assertEqual(self.block_index.get_best_block()['block_hash'], b3.get_hash().hex())
+        self.assertEqual(self.chain_manager.assume_valid.skipped, 3) # Including the assume-valid block itself
+
+        # Above it, bad signatures are caught again
+        b4 = self.make_block(b3.get_hash().hex(), "av4", spend=b3.vtx[0].get_hash().hex(), bad_sig=True)
+        success, reason = self.chain_manager.process_block(b4)
+        self.assertFalse(success)
+        self.assertEqual(self.block_index.get_best_block()['block_hash'], b3.get_hash().hex())
+
+    def test_assume_valid_needs_block_in_tree(self):
+        from icsicoin.consensus.assumevalid import AssumeValid
+        b1, b2, b3 = self.assumed_chain()
+        self.chain_manager.assume_valid = AssumeValid(b3.get_hash().hex())
+
+        # The assume-valid block hasn't been seen, so block 2's bad signature is caught
+        self.assertEqual(self.chain_manager.process_block(b1), (True, "Accepted"))
+        success, reason = self.chain_manager.process_block(b2)
+        self.assertFalse(success)
+        self.assertEqual(self.block_index.get_best_block()['block_hash'], b1.get_hash().hex())
+        self.assertEqual(self.chain_manager.assume_valid.skipped, 0)
+
+    def test_headers_checked_before_entering_tree(self):
+        from icsicoin.consensus.validation import validate_block_header
+        b1, b2, b3 = self.assumed_chain()
+        tree = self.chain_manager.block_tree
+
+        unmined = self.make_block(self.chain_manager.genesis_block.get_hash().hex(), "weak")
+        while validate_block_header(unmined.header, None):
+            unmined.header.nonce += 1 # Find a nonce that misses the target
+        self.assertEqual(self.chain_manager.accept_headers([unmined.header]), (False, "High hash"))
+        easy = self.make_block(self.chain_manager.genesis_block.get_hash().hex(), "easy")
+        easy.header.bits = 0x2100ffff
+        self.assertEqual(self.chain_manager.accept_headers([easy.header]), (False, "Bad difficulty bits"))
+        self.assertEqual(self.chain_manager.accept_headers([b2.header]), (False, "Unconnected headers"))
+
+        # Good headers before a bad one are kept
+        weak = self.make_block(b2.get_hash().hex(), "weak")
+        while validate_block_header(weak.header, None):
+            weak.header.nonce += 1
+        self.assertEqual(self.chain_manager.accept_headers([b1.header, b2.header, weak.header]), (False, "High hash"))
+        self.assertEqual(tree.get(b2.get_hash().hex()).status, None)
+        self.assertIsNone(tree.get(weak.get_hash().hex()))
+
+        # Served back from the active chain once the bodies are connected
+        for block in (b1, b2, b3):
+            tree.entries.pop(block.get_hash().hex(), None)
+        self.chain_manager.assume_valid.block_hash = None
+        self.chain_manager.process_block(b1)
+        genesis = self.chain_manager.genesis_block.get_hash().hex()
+        self.assertEqual([h.serialize() for h in self.chain_manager.get_headers_after([genesis], 10)], [b1.header.serialize()])
+        self.assertEqual(self.chain_manager.get_headers_after([b1.get_hash().hex()], 10), [])
+
+    def test_block_tree_reloads_with_chainwork(self):
+        genesis = self.chain_manager.genesis_block.get_hash().hex()
+        self.build(genesis, 2, "main")
+        reloaded = ChainManager(self.block_store, self.block_index, self.chain_state)
+        old_tip, new_tip = self.chain_manager.block_tree.tip, reloaded.block_tree.tip
+        self.assertEqual((new_tip.hash, new_tip.height, new_tip.chainwork), (old_tip.hash, old_tip.height, old_tip.chainwork))
+
+    def sign_spend(self, prev_txid, amount):
+        from icsicoin.consensus.sighash import SighashCache
+        from ecdsa.util import sigencode_der
+        tx = Transaction(vin=[TxIn(bytes.fromhex(prev_txid), 0)], vout=[TxOut(amount, self.script)])
+        sig = self.sk.sign_digest(SighashCache(tx).signature_hash(0, self.script), sigencode=sigencode_der) + b'\x01'
+        tx.vin[0].script_sig = bytes([len(sig)]) + sig + bytes([len(self.pubkey)]) + self.pubkey
+        return tx
+
+    def test_mempool_follows_connects_and_reorgs(self):
+        from icsicoin.consensus.merkle import get_merkle_root
+        from icsicoin.consensus.validation import validate_transaction
+        from icsicoin.core.mempool import Mempool
+        mempool = Mempool(self.test_dir, self.chain_state)
+        self.chain_manager.mempool = mempool
+        genesis = self.chain_manager.genesis_block.get_hash().hex()
+        main = self.build(genesis, 2, "main")
+        coinbase_1 = main[0].vtx[0].get_hash().hex()
+
+        # A relayed spend is mined: it leaves the pool when its block connects
+        block3 = self.make_block(main[1].get_hash().hex(), "main2", spend=coinbase_1)
+        spend = block3.vtx[1]
+        spend_hash = spend.get_hash().hex()
+        self.assertTrue(mempool.add_transaction(spend))
+        self.assertEqual(self.chain_manager.process_block(block3), (True, "Accepted"))
+        self.assertNotIn(spend_hash, mempool.transactions)
+
+        # A child of the confirmed spend waits in the pool
+        child = self.sign_spend(spend_hash, 3900000000)
+        child_hash = child.get_hash().hex()
+        self.assertTrue(validate_transaction(child, mempool.get_view())[0])
+        self.assertTrue(mempool.add_transaction(child))
+
+        # Reorg away block 3: its spend comes back, ahead of the child it funds
+        side = self.build(main[1].get_hash().hex(), 1, "side")
+        self.assertEqual(self.chain_manager.process_block(self.make_block(side[0].get_hash().hex(), "side1")),
+                         (True, "Reorg Success"))
+        self.assertEqual(list(mempool.transactions), [child_hash, spend_hash])
+        self.assertEqual(mempool.get_entry(child_hash).parents, {spend_hash})
+        self.assertEqual(mempool.get_entry(child_hash).ancestor_count, 2)
+        self.assertEqual(mempool.get_entry(spend_hash).descendant_count, 2)
+        self.assertEqual(mempool.get_entry(spend_hash).fee, 1000000000)
+        self.assertEqual([e.txid for e in mempool.select_transactions()], [spend_hash, child_hash])
+
+        # A block confirming a double spend of coinbase 1 evicts the spend and its child
+        double = self.sign_spend(coinbase_1, 4500000000)
+        vtx = [Transaction(vin=[TxIn(b'\x00'*32, 0xffffffff, b"side2", 0xffffffff)], vout=[TxOut(5000000000, self.script)]), double]
+        tip = self.chain_manager.block_tree.tip.hash
+        block = Block(BlockHeader(prev_block=bytes.fromhex(tip), merkle_root=get_merkle_root(vtx),
+                                  timestamp=1700000000, bits=0x1f099996), vtx)
+        self.assertEqual(self.chain_manager.process_block(block), (True, "Accepted"))
+        self.assertEqual(mempool.transactions, {})
+
+        # Each block update went to the journal as one write; a restart sees the same pool
+        self.assertEqual(Mempool(self.test_dir, self.chain_state).transactions, {})
+
 if __name__ == '__main__':
     unittest.main()
@@ -2,14 +2,21 @@ import unittest
 import sys
 import hashlib
 from ecdsa import SigningKey, SECP256k1
+from ecdsa.util import sigencode_der
 
 # Adjust path
 sys.path.append('/home/josh/Antigrav_projects/iCSI_Coin/iCSI_COIN_PYTHON_PORT/end_user_node')
 
-from icsicoin.core.primitives import Transaction, Block, BlockHeader
+from icsicoin.core.primitives import Transaction, Block, BlockHeader, TxIn, TxOut
 from icsicoin.consensus.merkle import get_merkle_root
-from icsicoin.consensus.script import ScriptEngine, OP_DUP, OP_HASH160, OP_EQUALVERIFY, OP_CHECKSIG
-from icsicoin.consensus.validation import bits_to_target
+from icsicoin.consensus.script import ScriptEngine, OP_DUP, OP_HASH160, OP_EQUALVERIFY, OP_CHECKSIG, signature_hash
+from icsicoin.consensus.validation import (bits_to_target, validate_transaction, validate_block, run_script_checks,
+                                          filter_cached_checks, get_dependency_levels)
+from icsicoin.consensus.sigcache import SignatureCache
+from icsicoin.consensus.sighash import SighashCache
+from icsicoin.consensus.difficulty import DifficultyCache
+from icsicoin.consensus import validation, proof_of_work
+from icsicoin.core.hashing import double_sha256
 
 class TestConsensus(unittest.TestCase):
     def test_merkle_root(self):
@@ -39,6 +46,17 @@ class TestConsensus(unittest.TestCase):
         # Merkle Root of a single transaction is just the transaction hash itself
         self.assertEqual(root_single, h1)
 
+    def test_merkle_branch(self):
+        from icsicoin.consensus.merkle import get_merkle_branch, get_merkle_root_from_branch
+        for count in range(1, 12):
+            txs = []
+            for i in range(count):
+                tx = Transaction()
+                tx.locktime = i
+                txs.append(tx)
+            branch = get_merkle_branch([b'\xff' * 32] + [tx.get_hash() for tx in txs[1:]])
+            self.assertEqual(get_merkle_root_from_branch(txs[0].get_hash(), branch), get_merkle_root(txs))
+
     def test_script_engine_p2pkh(self):
         # 1. Generate Key Pair
         sk = SigningKey.generate(curve=SECP256k1)
@@ -59,10 +77,12 @@ class TestConsensus(unittest.TestCase):
         script_pubkey.append(OP_EQUALVERIFY)
         script_pubkey.append(OP_CHECKSIG)
         
-        # 3. Create ScriptSig (Sig, PubKey)
+        # 3. Create ScriptSig (Sig, PubKey) over the SIGHASH_ALL digest
         from ecdsa.util import sigencode_der
         
-        sig_der = sk.sign(b"dummy_msg", sigencode=sigencode_der)
+        tx = Transaction(vin=[TxIn(b'\x11'*32, 0)], vout=[TxOut(1000, bytes(script_pubkey))])
+        sighash = signature_hash(tx, 0, bytes(script_pubkey))
+        sig_der = sk.sign_digest(sighash, sigencode=sigencode_der) + b'\x01'
         
         script_sig = bytearray()
         script_sig.append(len(sig_der))
@@ -72,9 +92,14 @@ class TestConsensus(unittest.TestCase):
         
         # 4. Evaluate
         engine = ScriptEngine()
-        result = engine.evaluate(script_sig, script_pubkey, None, 0)
+        result = engine.evaluate(script_sig, script_pubkey, tx, 0)
         self.assertTrue(result)
 
+        # 5. Signature over a different message must not verify
+        bad_sig = sk.sign(b"dummy_msg", sigencode=sigencode_der) + b'\x01'
+        bad_script_sig = bytes([len(bad_sig)]) + bad_sig + bytes([len(pubkey_bytes)]) + pubkey_bytes
+        self.assertFalse(ScriptEngine().evaluate(bad_script_sig, script_pubkey, tx, 0))
+
     def test_script_engine_fail(self):
         # Test with wrong signature
         script_pubkey = b'\x76\xa9\x14' + b'\x00'*20 + b'\x88\xac' # dummy p2pkh
@@ -84,6 +109,155 @@ class TestConsensus(unittest.TestCase):
         result = engine.evaluate(script_sig, script_pubkey, None, 0)
         self.assertFalse(result)
 
+    def test_wallet_signed_transaction_verifies(self):
+        import tempfile, shutil
+        from icsicoin.wallet.wallet import Wallet
+
+        test_dir = tempfile.mkdtemp()
+        try:
+            wallet = Wallet(test_dir)
+            addr = wallet.get_addresses()[0]
+            script = b'\x76\xa9\x14' + bytes.fromhex(addr) + b'\x88\xac'
+
+            class FakeChainState:
+                def __init__(self):
+                    self.utxos = {('aa'*32, i): {'amount': 1000, 'script_pubkey': script,
+                                                  'block_height': 1, 'is_coinbase': False} for i in range(3)}
+                def get_utxos_by_script(self, spk):
+                    return [{'txid': t, 'vout': v, 'amount': u['amount'], 'block_height': 1, 'is_coinbase': False}
+                            for (t, v), u in self.utxos.items() if u['script_pubkey'] == spk]
+                def get_utxo(self, txid, vout):
+                    return self.utxos.get((txid, vout))
+
+            chain_state = FakeChainState()
+            tx = wallet.create_transaction(addr, 2500, chain_state, current_height=10, fee=100)
+            self.assertEqual(len(tx.vin), 3)
+
+            is_valid, reason = validate_transaction(tx, chain_state)
+            self.assertTrue(is_valid, reason)
+
+            # Tampering with an output invalidates every signature
+            tx.vout[0].amount -= 1
+            is_valid, reason = validate_transaction(tx, chain_state)
+            self.assertFalse(is_valid)
+
+            # Deferred checks are collected rather than run when a list is given
+            tx.vout[0].amount += 1
+            checks = []
+            is_valid, _ = validate_transaction(tx, chain_state, script_checks=checks)
+            self.assertTrue(is_valid)
+            self.assertEqual(len(checks), 3)
+            self.assertEqual(run_script_checks(checks)[0], True)
+
+            # Mempool acceptance populated the cache; block validation consumes it
+            self.assertEqual(filter_cached_checks(checks, erase=True), [])
+            self.assertEqual(len(filter_cached_checks(checks)), 3)
+        finally:
+            shutil.rmtree(test_dir)
+
+    def test_sighash_cache_matches_full_reserialization(self):
+        import struct
+        script = b'\x76\xa9\x14' + b'\x42'*20 + b'\x88\xac'
+        tx = Transaction(vin=[TxIn(bytes([i])*32, i, b'\x01\x02', 0xfffffffe) for i in range(7)],
+                         vout=[TxOut(5, script), TxOut(6, b'\x51')], locktime=9)
+        cache = SighashCache(tx)
+        # Out-of-order access must not reuse a stale midstate
+        for i in [0, 1, 2, 6, 3, 3, 5, 4, 0]:
+            blanked = [TxIn(t.prev_hash, t.prev_index, script if j == i else b'', t.sequence)
+                       for j, t in enumerate(tx.vin)]
+            ref_tx = Transaction(tx.version, blanked, tx.vout, tx.locktime)
+            expected = double_sha256(ref_tx.serialize() + struct.pack("<I", 1))
+            self.assertEqual(cache.signature_hash(i, script), expected)
+
+    def test_signature_cache_bounded(self):
+        cache = SignatureCache(max_entries=2)
+        script = b'\x76\xa9\x14' + b'\x00'*20 + b'\x88\xac'
+        for i in range(3):
+            cache.add(b'\x01'*32, i, script)
+        self.assertFalse(cache.contains(b'\x01'*32, 0, script)) # Oldest evicted
+        self.assertTrue(cache.contains(b'\x01'*32, 2, script))
+        self.assertFalse(cache.contains(b'\x01'*32, 2, b'\x00'))  # Script is part of the key
+        stats = cache.get_stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['entries']), (1, 2, 2))
+
+    def test_difficulty_cache_matches_block_reads(self):
+        interval = validation.DIFFICULTY_ADJUSTMENT_INTERVAL
+        headers = {}
+
+        class FakeChain:
+            reads = 0
+            def get_block_header(self, height):
+                FakeChain.reads += 1
+                return headers.get(height)
+            def get_block_by_height(self, height):
+                header = headers.get(height)
+                return Block(header, []) if header else None
+            def get_best_height(self):
+                return max(headers)
+
+        chain = FakeChain()
+        cache = DifficultyCache(chain)
+        bits = validation.GENESIS_BITS
+        for h in range(2 * interval + 5):
+            bits = cache.get_next_bits(h) if h else bits
+            headers[h] = BlockHeader(timestamp=1000 + h * 10, bits=bits) # 3x faster than target
+            cache.on_block_connected(h, headers[h])
+        self.assertEqual(FakeChain.reads, 0)
+
+        retargeted = headers[interval].bits
+        self.assertLess(bits_to_target(retargeted), bits_to_target(validation.GENESIS_BITS))
+        for h in (interval - 1, interval, interval + 1, 2 * interval, 2 * interval + 5):
+            self.assertEqual(cache.get_next_bits(h), validation.calculate_next_bits(chain, h))
+
+        # Disconnecting the retarget block forgets it and everything above
+        cache.on_block_disconnected(2 * interval)
+        self.assertNotIn(2 * interval, cache.boundaries)
+        self.assertIn(interval, cache.boundaries)
+
+    def test_block_validates_by_dependency_level(self):
+        sk = SigningKey.generate(curve=SECP256k1)
+        pubkey = sk.verifying_key.to_string()
+        script = b'\x76\xa9\x14' + hashlib.new('ripemd160', hashlib.sha256(pubkey).digest()).digest() + b'\x88\xac'
+
+        def spend(prev_hash, count, amount):
+            tx = Transaction(vin=[TxIn(prev_hash, i) for i in range(count)], vout=[TxOut(amount, script)])
+            cache = SighashCache(tx)
+            for i in range(count):
+                sig = sk.sign_digest(cache.signature_hash(i, script), sigencode=sigencode_der) + b'\x01'
+                tx.vin[i].script_sig = bytes([len(sig)]) + sig + bytes([len(pubkey)]) + pubkey
+            return tx
+
+        class FakeChainState:
+            def get_utxo(self, txid, vout):
+                if txid in ('aa' * 32, 'bb' * 32) and vout < 20:
+                    return {'amount': 1000, 'script_pubkey': script, 'block_height': 1, 'is_coinbase': False}
+                return None
+
+        coinbase = Transaction(vin=[TxIn(b'\x00' * 32, 0xffffffff, b'levels', 0xffffffff)], vout=[TxOut(50, script)])
+        parent = spend(b'\xaa' * 32, 20, 19000)        # Enough inputs to go through the pool
+        child = spend(parent.get_hash(), 1, 18000)
+        independent = spend(b'\xbb' * 32, 1, 900)
+
+        def block_of(vtx):
+            return Block(BlockHeader(merkle_root=get_merkle_root(vtx)), vtx)
+
+        block = block_of([coinbase, parent, child, independent])
+        levels = [[i for i, _ in level] for level in get_dependency_levels(block)]
+        self.assertEqual(levels, [[0, 1, 3], [2]])
+        self.assertEqual(validate_block(block, FakeChainState()), (True, "Valid"))
+
+        # Spending an output of a later transaction is still rejected
+        is_valid, reason = validate_block(block_of([coinbase, child, parent]), FakeChainState())
+        self.assertFalse(is_valid)
+        self.assertIn("later transaction", reason)
+
+        # A bad signature in the second level fails the block
+        bad_child = spend(parent.get_hash(), 1, 18000)
+        bad_child.vout[0].amount -= 1
+        is_valid, reason = validate_block(block_of([coinbase, parent, bad_child]), FakeChainState())
+        self.assertFalse(is_valid)
+        self.assertIn(bad_child.get_hash().hex(), reason)
+
     def test_bits_to_target(self):
         # Standard Bitcoin/Litecoin max target
         # 0x1d00ffff -> 0x00ffff * 2**(8*(0x1d - 3)) = 0xffff * 256**26
@@ -97,5 +271,30 @@ class TestConsensus(unittest.TestCase):
         # Just ensure it doesn't crash
         pass
 
+    def test_pow_backends(self):
+        header = bytes(range(80))
+        expected = hashlib.scrypt(header, salt=header, n=1024, r=1, p=1, dklen=32)
+        # Every backend that loads agrees with hashlib; a stubbed-out one fails its self-test
+        for name in proof_of_work.BACKENDS:
+            backend = proof_of_work.load_backend(name)
+            if backend:
+                self.assertEqual(backend(header), expected)
+        self.assertIsNotNone(proof_of_work.load_backend('hashlib'))
+        self.assertIn(proof_of_work.select_backend('auto'), proof_of_work.BACKENDS)
+        self.assertEqual(proof_of_work.hash_header(header), expected)
+        with self.assertRaises(ValueError):
+            proof_of_work.select_backend('sha256')
+
+    def test_scan_nonces(self):
+        prefix = bytes(76)
+        target = 1 << 250 # ~1 in 64 hashes
+        nonce, pow_hash = proof_of_work.scan_nonces(prefix, target, 0, 4096)
+        header = prefix + nonce.to_bytes(4, 'little')
+        self.assertEqual(pow_hash, hashlib.scrypt(header, salt=header, n=1024, r=1, p=1, dklen=32))
+        self.assertTrue(proof_of_work.check_pow(header, target))
+        # Nothing below the first hit, and nothing at all in an empty or hopeless range
+        self.assertIsNone(proof_of_work.scan_nonces(prefix, target, 0, nonce))
+        self.assertIsNone(proof_of_work.scan_nonces(prefix, 0, 0, 8))
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,371 @@
+import unittest
+import sys
+import os
+import time
+import shutil
+import asyncio
+import hashlib
+import tempfile
+from unittest.mock import patch
+from ecdsa import SigningKey, SECP256k1
+from ecdsa.util import sigencode_der
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from icsicoin.core.primitives import Block, BlockHeader, Transaction, TxIn, TxOut
+from icsicoin.core import mempool as mempool_module
+from icsicoin.core.mempool import Mempool, MempoolView
+from icsicoin.consensus.validation import validate_transaction
+from icsicoin.consensus.sighash import SighashCache
+
+def make_tx(prev_hash, prev_index, tag=0):
+    return Transaction(vin=[TxIn(prev_hash, prev_index)], vout=[TxOut(1000 + tag, b'\x51')])
+
+class TestMempool(unittest.TestCase):
+    def test_outpoint_index_tracks_spends(self):
+        mempool = Mempool()
+        tx = make_tx(b'\xaa' * 32, 0)
+        txid = tx.get_hash().hex()
+        self.assertTrue(mempool.add_transaction(tx))
+        self.assertTrue(mempool.is_spent(('aa' * 32, 0)))
+        self.assertTrue(mempool.is_spent((b'\xaa' * 32, 0)))
+        self.assertFalse(mempool.is_spent(('aa' * 32, 1)))
+        self.assertEqual(mempool.get_spender(('aa' * 32, 0)), txid)
+
+        # Double spend of the same outpoint is rejected
+        double = make_tx(b'\xaa' * 32, 0, tag=1)
+        self.assertEqual(mempool.get_conflicts(double), {txid})
+        self.assertFalse(mempool.add_transaction(double))
+
+        # Removal frees the outpoint
+        self.assertTrue(mempool.remove_transaction(txid))
+        self.assertFalse(mempool.is_spent(('aa' * 32, 0)))
+        self.assertEqual(mempool.spent_outpoints, {})
+        self.assertTrue(mempool.add_transaction(double))
+
+    def test_index_rebuilt_on_load(self):
+        data_dir = tempfile.mkdtemp()
+        try:
+            mempool = Mempool(data_dir)
+            tx = make_tx(b'\xbb' * 32, 3)
+            mempool.add_transaction(tx)
+            reloaded = Mempool(data_dir)
+            self.assertEqual(reloaded.get_spender(('bb' * 32, 3)), tx.get_hash().hex())
+        finally:
+            shutil.rmtree(data_dir)
+
+    def test_journal_replayed_without_snapshot_rewrites(self):
+        data_dir = tempfile.mkdtemp()
+        try:
+            mempool = Mempool(data_dir)
+            txs = [make_tx(bytes([i]) * 32, 0) for i in range(1, 6)]
+            for tx in txs:
+                mempool.add_transaction(tx)
+            mempool.remove_transaction(txs[1].get_hash().hex())
+            # Nothing but journal appends so far
+            self.assertFalse(os.path.exists(mempool.filename))
+            self.assertEqual(mempool.journal_records, 6)
+
+            # A torn final record (crash mid-append) is ignored
+            mempool.journal.write(b'\x01\xff\x00\x00\x00partial')
+            mempool.journal.flush()
+
+            reloaded = Mempool(data_dir)
+            expected = [tx.get_hash().hex() for tx in txs if tx is not txs[1]]
+            self.assertEqual(list(reloaded.transactions), expected)
+            # Loading compacts into a fresh snapshot
+            self.assertFalse(os.path.exists(reloaded.journal_filename))
+            self.assertEqual(list(Mempool(data_dir).transactions), expected)
+        finally:
+            shutil.rmtree(data_dir)
+
+    def test_legacy_json_mempool_loads(self):
+        data_dir = tempfile.mkdtemp()
+        try:
+            tx = make_tx(b'\xcc' * 32, 1)
+            with open(os.path.join(data_dir, "mempool.dat"), 'w') as f:
+                f.write('["%s"]' % tx.serialize().hex())
+            mempool = Mempool(data_dir)
+            self.assertIn(tx.get_hash().hex(), mempool.transactions)
+            with open(mempool.filename, 'rb') as f:
+                self.assertEqual(f.read(4), b'ICMP')
+        finally:
+            shutil.rmtree(data_dir)
+
+    def test_journal_compacts_after_threshold(self):
+        data_dir = tempfile.mkdtemp()
+        try:
+            with patch.object(mempool_module, 'MEMPOOL_JOURNAL_MAX_RECORDS', 3):
+                mempool = Mempool(data_dir)
+                for i in range(1, 5):
+                    mempool.add_transaction(make_tx(bytes([i]) * 32, 0))
+                # No event loop: the third record triggered a blocking snapshot
+                self.assertEqual(mempool.journal_records, 1)
+                self.assertEqual(len(Mempool(data_dir).transactions), 4)
+        finally:
+            shutil.rmtree(data_dir)
+
+    def test_snapshot_debounced_off_event_loop(self):
+        data_dir = tempfile.mkdtemp()
+        try:
+            async def run():
+                with patch.object(mempool_module, 'MEMPOOL_JOURNAL_MAX_RECORDS', 2), \
+                     patch.object(mempool_module, 'MEMPOOL_SNAPSHOT_DELAY', 0.05):
+                    mempool = Mempool(data_dir)
+                    for i in range(1, 6):
+                        mempool.add_transaction(make_tx(bytes([i]) * 32, 0))
+                    # Several triggers, one pending write
+                    self.assertIsNotNone(mempool._snapshot_handle)
+                    self.assertFalse(os.path.exists(mempool.filename))
+                    for _ in range(100):
+                        await asyncio.sleep(0.02)
+                        if os.path.exists(mempool.filename) and not mempool._compacting:
+                            break
+                    self.assertEqual(mempool.journal_records, 0)
+                    mempool.add_transaction(make_tx(b'\x09' * 32, 0))
+                    return mempool
+            asyncio.run(run())
+            # Snapshot plus the record journaled while it was written
+            self.assertEqual(len(Mempool(data_dir).transactions), 6)
+        finally:
+            shutil.rmtree(data_dir)
+
+    def test_revalidated_against_chain_state_on_load(self):
+        sk = SigningKey.generate(curve=SECP256k1)
+        pubkey = sk.verifying_key.to_string()
+        script = b'\x76\xa9\x14' + hashlib.new('ripemd160', hashlib.sha256(pubkey).digest()).digest() + b'\x88\xac'
+
+        def signed(prev_hash, amount):
+            tx = Transaction(vin=[TxIn(prev_hash, 0)], vout=[TxOut(amount, script)])
+            sig = sk.sign_digest(SighashCache(tx).signature_hash(0, script), sigencode=sigencode_der) + b'\x01'
+            tx.vin[0].script_sig = bytes([len(sig)]) + sig + bytes([len(pubkey)]) + pubkey
+            return tx
+
+        class FakeChainState:
+            def __init__(self):
+                self.utxos = {(bytes([i]).hex() * 32, 0): {'amount': 1000, 'script_pubkey': script,
+                                                            'block_height': 1, 'is_coinbase': False} for i in (1, 2, 3)}
+            def get_utxos(self, outpoints):
+                return {op: self.utxos[op] for op in outpoints if op in self.utxos}
+
+        data_dir = tempfile.mkdtemp()
+        try:
+            mempool = Mempool(data_dir)
+            good = signed(b'\x01' * 32, 900)
+            child = signed(good.get_hash(), 800)         # Spends an unconfirmed parent
+            bad_sig = signed(b'\x02' * 32, 900)
+            bad_sig.vout[0].amount = 950                  # Invalidates the signature
+            confirmed = signed(b'\x04' * 32, 900)        # Input no longer in the UTXO set
+            for tx in (good, child, bad_sig, confirmed):
+                mempool.transactions[tx.get_hash().hex()] = tx
+            mempool.save()
+
+            reloaded = Mempool(data_dir, FakeChainState())
+            self.assertEqual(list(reloaded.transactions), [good.get_hash().hex(), child.get_hash().hex()])
+            self.assertEqual(len(Mempool(data_dir).transactions), 2)
+        finally:
+            shutil.rmtree(data_dir)
+
+    def test_listeners_see_a_consistent_pool(self):
+        mempool = Mempool()
+        seen = []
+        mempool.listeners.append(lambda sequence: seen.append(
+            (sequence, sorted(mempool.entries), dict(mempool.spent_outpoints), [t for _, _, t in mempool.by_feerate])))
+        parent = make_tx(b'\xaa' * 32, 0)
+        child = make_tx(parent.get_hash(), 0)
+        parent_id, child_id = parent.get_hash().hex(), child.get_hash().hex()
+        mempool.add_transaction(parent, fee=1000)
+        mempool.add_transaction(child, fee=1000)
+        self.assertEqual(seen[-1][1], sorted([parent_id, child_id]))
+        self.assertEqual(seen[-1][2], {('aa' * 32, 0): parent_id, (parent_id, 0): child_id})
+        self.assertEqual(sorted(seen[-1][3]), sorted([parent_id, child_id]))
+
+        mempool.remove_transaction(child_id)
+        self.assertEqual(seen[-1][1:], ([parent_id], {('aa' * 32, 0): parent_id}, [parent_id]))
+        self.assertEqual([s[0] for s in seen], [1, 2, 3])
+
+        # A block confirming several transactions notifies once, after all of them are gone
+        mempool.add_transaction(child, fee=1000)
+        del seen[:]
+        coinbase = Transaction(vin=[TxIn(b'\x00' * 32, 0xffffffff, b'cb')], vout=[TxOut(5000, b'\x51')])
+        mempool.on_block_connected(Block(BlockHeader(), [coinbase, parent, child]))
+        self.assertEqual(seen, [(mempool.sequence, [], {}, [])])
+
+    def test_entries_carry_fee_size_and_feerate(self):
+        class FakeChainState:
+            def get_utxos(self, outpoints):
+                return {op: {'amount': 5000, 'script_pubkey': b'\x51', 'block_height': 1, 'is_coinbase': False}
+                        for op in outpoints if op[0] == 'aa' * 32}
+
+        mempool = Mempool(chain_state=FakeChainState())
+        tx = Transaction(vin=[TxIn(b'\xaa' * 32, 0), TxIn(b'\xaa' * 32, 1)], vout=[TxOut(7000, b'\x51')])
+        mempool.add_transaction(tx)
+        entry = mempool.get_entry(tx.get_hash().hex())
+        self.assertEqual(entry.fee, 3000)
+        self.assertEqual(entry.size, len(tx.serialize()))
+        self.assertAlmostEqual(entry.feerate, 3000 / entry.size)
+
+        # A child's inputs resolve from its mempool parent
+        child = Transaction(vin=[TxIn(tx.get_hash(), 0)], vout=[TxOut(6000, b'\x51')])
+        mempool.add_transaction(child)
+        child_entry = mempool.get_entry(child.get_hash().hex())
+        self.assertEqual(child_entry.fee, 1000)
+        self.assertEqual(child_entry.parents, {entry.txid})
+        self.assertEqual((child_entry.ancestor_count, child_entry.ancestor_fee), (2, 4000))
+        self.assertEqual(child_entry.ancestor_size, entry.size + child_entry.size)
+
+        # Confirming the parent leaves the child as its own package
+        mempool.remove_transaction(entry.txid)
+        self.assertEqual((child_entry.parents, child_entry.ancestor_count, child_entry.ancestor_fee), (set(), 1, 1000))
+        self.assertEqual([t for _, _, t in mempool.by_feerate], [child_entry.txid])
+
+    def test_template_selects_by_package_feerate(self):
+        mempool = Mempool()
+        low = make_tx(b'\x01' * 32, 0)
+        mid = make_tx(b'\x02' * 32, 0)
+        parent = make_tx(b'\x03' * 32, 0)                    # Pays nothing itself...
+        child = make_tx(parent.get_hash(), 0)                # ...but its child pays for both
+        mempool.add_transaction(low, fee=100)
+        mempool.add_transaction(mid, fee=2000)
+        mempool.add_transaction(parent, fee=0)
+        mempool.add_transaction(child, fee=6000)
+        size = mempool.get_entry(low.get_hash().hex()).size
+
+        order = [e.txid for e in mempool.select_transactions()]
+        expected = [parent, child, mid, low]
+        self.assertEqual(order, [tx.get_hash().hex() for tx in expected])
+
+        # With room for two transactions the parent+child package still wins over `mid`
+        order = [e.txid for e in mempool.select_transactions(max_size=2 * size)]
+        self.assertEqual(order, [parent.get_hash().hex(), child.get_hash().hex()])
+        # A package that doesn't fit is skipped, smaller ones still fill the space
+        order = [e.txid for e in mempool.select_transactions(max_size=size)]
+        self.assertEqual(order, [mid.get_hash().hex()])
+
+    def test_eviction_when_full(self):
+        from icsicoin.core.mempool import estimate_usage
+        usage = estimate_usage(make_tx(b'\x01' * 32, 0))
+        mempool = Mempool(max_bytes=4 * usage + usage // 2)
+        cheap = make_tx(b'\x01' * 32, 0)
+        cheap_child = make_tx(cheap.get_hash(), 0)
+        rescued = make_tx(b'\x02' * 32, 0)
+        rescuer = make_tx(rescued.get_hash(), 0)      # High-fee child keeps its parent in
+        for tx, fee in ((cheap, 50), (cheap_child, 60), (rescued, 10), (rescuer, 20000)):
+            self.assertTrue(mempool.add_transaction(tx, fee=fee))
+        self.assertEqual(mempool.get_min_feerate(), 0)
+
+        # A fifth transaction doesn't fit: the cheapest package goes, descendants included
+        newcomer = make_tx(b'\x03' * 32, 0)
+        self.assertTrue(mempool.add_transaction(newcomer, fee=5000))
+        self.assertEqual(set(mempool.transactions), {t.get_hash().hex() for t in (rescued, rescuer, newcomer)})
+        self.assertEqual(mempool.evicted, 2)
+        self.assertLessEqual(mempool.total_usage, mempool.max_bytes)
+        self.assertEqual(mempool.spent_outpoints.get((cheap.get_hash().hex(), 0)), None)
+
+        # The minimum fee rate now sits above the evicted package...
+        size = mempool.get_entry(newcomer.get_hash().hex()).size
+        min_feerate = mempool.get_min_feerate()
+        self.assertGreater(min_feerate, 60 / size)
+        self.assertFalse(mempool.add_transaction(make_tx(b'\x04' * 32, 0), fee=int(min_feerate * size) - 1))
+        # ...and decays back once the pressure is gone
+        mempool.remove_transaction(newcomer.get_hash().hex())
+        mempool.remove_transaction(rescuer.get_hash().hex())
+        self.assertEqual(mempool.get_min_feerate(now=time.time() + 24 * 3600), 0)
+        self.assertTrue(mempool.add_transaction(make_tx(b'\x04' * 32, 0), fee=0))
+
+    def test_expiry_drops_old_entries_and_descendants(self):
+        mempool = Mempool(expiry=3600)
+        old = make_tx(b'\x01' * 32, 0)
+        child = make_tx(old.get_hash(), 0)
+        mempool.add_transaction(old, now=1000)
+        mempool.add_transaction(child, now=4000)
+        mempool.add_transaction(make_tx(b'\x02' * 32, 0), now=4000)
+        mempool.expire(now=4700)
+        self.assertEqual(len(mempool.transactions), 1)
+        self.assertEqual(mempool.expired, 2)
+        self.assertEqual(mempool.get_stats()['transactions'], 1)
+
+    def test_chained_transaction_validates_against_mempool_view(self):
+        sk = SigningKey.generate(curve=SECP256k1)
+        pubkey = sk.verifying_key.to_string()
+        script = b'\x76\xa9\x14' + hashlib.new('ripemd160', hashlib.sha256(pubkey).digest()).digest() + b'\x88\xac'
+
+        def signed(prev_hash, amount):
+            tx = Transaction(vin=[TxIn(prev_hash, 0)], vout=[TxOut(amount, script)])
+            sig = sk.sign_digest(SighashCache(tx).signature_hash(0, script), sigencode=sigencode_der) + b'\x01'
+            tx.vin[0].script_sig = bytes([len(sig)]) + sig + bytes([len(pubkey)]) + pubkey
+            return tx
+
+        class FakeChainState:
+            def get_utxo(self, txid, vout):
+                if (txid, vout) == ('11' * 32, 0):
+                    return {'amount': 1000, 'script_pubkey': script, 'block_height': 1, 'is_coinbase': False}
+                return None
+
+        chain_state = FakeChainState()
+        mempool = Mempool(chain_state=chain_state)
+        parent = signed(b'\x11' * 32, 900)
+        child = signed(parent.get_hash(), 800)
+        grandchild = signed(child.get_hash(), 700)
+
+        # The chain state alone doesn't know the parent's outputs
+        self.assertFalse(validate_transaction(child, chain_state)[0])
+        self.assertEqual(validate_transaction(parent, mempool.get_view()), (True, "Valid"))
+        mempool.add_transaction(parent)
+        self.assertEqual(validate_transaction(child, mempool.get_view()), (True, "Valid"))
+        mempool.add_transaction(child)
+        self.assertEqual(validate_transaction(grandchild, MempoolView(chain_state, mempool)), (True, "Valid"))
+        mempool.add_transaction(grandchild)
+
+        # Outputs already spent in the pool are gone from the view
+        self.assertFalse(validate_transaction(signed(b'\x11' * 32, 500), mempool.get_view())[0])
+        self.assertIsNone(mempool.get_view().get_utxo(parent.get_hash().hex(), 0))
+
+        entry = mempool.get_entry(parent.get_hash().hex())
+        self.assertEqual((entry.fee, entry.descendant_count), (100, 3))
+        self.assertEqual(entry.descendant_size, sum(len(t.serialize()) for t in (parent, child, grandchild)))
+        self.assertEqual(mempool.get_entry(grandchild.get_hash().hex()).ancestor_count, 3)
+
+        # A block confirming a double spend of the parent takes the whole chain with it
+        confirmed = signed(b'\x11' * 32, 950)
+        removed = mempool.remove_conflicts(confirmed)
+        self.assertEqual(set(removed), {t.get_hash().hex() for t in (parent, child, grandchild)})
+        self.assertEqual((mempool.transactions, mempool.spent_outpoints, mempool.by_eviction_score), ({}, {}, []))
+
+    def test_chain_limits(self):
+        with patch.object(mempool_module, 'MEMPOOL_MAX_ANCESTORS', 3):
+            mempool = Mempool()
+            tx = make_tx(b'\x01' * 32, 0)
+            chain = [tx]
+            for _ in range(3):
+                chain.append(make_tx(chain[-1].get_hash(), 0))
+            for tx in chain[:3]:
+                self.assertTrue(mempool.add_transaction(tx))
+            self.assertIn("ancestors", mempool.check_chain_limits(chain[3]))
+            self.assertFalse(mempool.add_transaction(chain[3]))
+
+        with patch.object(mempool_module, 'MEMPOOL_MAX_DESCENDANTS', 2):
+            mempool = Mempool()
+            parent = Transaction(vin=[TxIn(b'\x02' * 32, 0)], vout=[TxOut(1, b'\x51') for _ in range(3)])
+            self.assertTrue(mempool.add_transaction(parent))
+            self.assertTrue(mempool.add_transaction(make_tx(parent.get_hash(), 0)))
+            self.assertFalse(mempool.add_transaction(make_tx(parent.get_hash(), 1)))
+
+    def test_load_50k_transactions(self):
+        mempool = Mempool()
+        count = 50000
+        txs = [make_tx(i.to_bytes(32, 'little'), i % 4) for i in range(count)]
+        start = time.perf_counter()
+        for tx in txs:
+            self.assertTrue(mempool.add_transaction(tx))
+        elapsed = time.perf_counter() - start
+        self.assertEqual(len(mempool.transactions), count)
+        self.assertEqual(len(mempool.spent_outpoints), count)
+
+        # Conflicts against a full pool are still found by lookup
+        self.assertFalse(mempool.add_transaction(make_tx((count - 1).to_bytes(32, 'little'), (count - 1) % 4, tag=1)))
+        # The old input x pool x input scan needed minutes here
+        self.assertLess(elapsed, 30)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -32,6 +32,7 @@ class TestMining(unittest.TestCase):
         
         self.mempool = MagicMock()
         self.mempool.get_all_transactions.return_value = []
+        self.mempool.select_transactions.return_value = []
         
         self.network_manager = MagicMock()
         self.network_manager.peers = []
@@ -77,6 +78,7 @@ class AsyncTestMining(unittest.IsolatedAsyncioTestCase):
         
         self.mempool = MagicMock()
         self.mempool.get_all_transactions.return_value = []
+        self.mempool.select_transactions.return_value = []
         
         self.network_manager = MagicMock()
         self.network_manager.peers = []
@@ -99,6 +101,38 @@ class AsyncTestMining(unittest.IsolatedAsyncioTestCase):
         self.assertEqual(result['previousblockhash'], '00'*32)
         self.assertEqual(len(result['transactions']), 1) # Coinbase only
 
+    async def test_rpc_getblocktemplate_longpoll(self):
+        from unittest.mock import patch
+        self.mempool.sequence = 5
+        resp = await self.rpc.handle_request(MockRequest({"method": "getblocktemplate", "id": 1}))
+        longpollid = json.loads(resp.text)['result']['longpollid']
+
+        req = MockRequest({"method": "getblocktemplate", "params": [{"longpollid": longpollid}], "id": 2})
+        poll = asyncio.create_task(self.rpc.handle_request(req))
+        await asyncio.sleep(0.05)
+        self.assertFalse(poll.done())
+
+        # A new tip ends the poll straight away
+        self.block_index.get_best_block.return_value = {'height': 101, 'block_hash': '11'*32}
+        tip = MagicMock(hash='11'*32, height=101)
+        self.rpc.notifier.on_tip_changed(tip)
+        result = json.loads((await asyncio.wait_for(poll, 1.0)).text)['result']
+        self.assertEqual(result['previousblockhash'], '11'*32)
+        self.assertNotEqual(result['longpollid'], longpollid)
+
+        # Mempool changes only after the mempool delay
+        longpollid = result['longpollid']
+        with patch('icsicoin.rpc.rpc_server.GBT_LONGPOLL_MEMPOOL_DELAY', 0.2):
+            req = MockRequest({"method": "getblocktemplate", "params": [{"longpollid": longpollid}], "id": 3})
+            poll = asyncio.create_task(self.rpc.handle_request(req))
+            await asyncio.sleep(0.05)
+            self.mempool.sequence = 6
+            self.rpc.notifier.on_mempool_changed(6)
+            await asyncio.sleep(0.05)
+            self.assertFalse(poll.done())
+            result = json.loads((await asyncio.wait_for(poll, 1.0)).text)['result']
+        self.assertEqual(result['longpollid'], '11'*32 + '6')
+
     async def test_rpc_submitblock(self):
         # Create a dummy block hex
         # Logic tries to deserialize. We need valid serialization.
@@ -114,5 +148,288 @@ class AsyncTestMining(unittest.IsolatedAsyncioTestCase):
         self.assertEqual(resp_data['result'], "accepted")
         self.chain_manager.process_block.assert_called_once()
 
+    async def test_rpc_submitsolution(self):
+        from icsicoin.mining.work import WorkTemplate
+        self.chain_manager.process_block.return_value = (True, "OK")
+        self.network_manager.announce_new_block = AsyncMock()
+        template = json.loads((await self.rpc.handle_request(MockRequest({"method": "getblocktemplate", "id": 1}))).text)['result']
+        work = WorkTemplate(template)
+        work.next_work()
+        header, coinbase = work.next_work()
+        header.nonce = 12345
+
+        req = MockRequest({"method": "submitsolution", "params": work.solution_params(header, coinbase), "id": 2})
+        resp_data = json.loads((await self.rpc.handle_request(req)).text)
+        self.assertEqual(resp_data['result'], "accepted")
+        block = self.chain_manager.process_block.call_args[0][0]
+        self.assertEqual(block.serialize(), work.build_block(header, coinbase).serialize())
+
+        req = MockRequest({"method": "submitsolution", "params": ["nope", 1, header.timestamp, "00" * 8], "id": 3})
+        resp_data = json.loads((await self.rpc.handle_request(req)).text)
+        self.assertEqual(resp_data['result'], "rejected: unknown-template")
+        req = MockRequest({"method": "submitsolution", "params": [template['template_id'], 1], "id": 4})
+        self.assertEqual(json.loads((await self.rpc.handle_request(req)).text)['error']['code'], -1)
+        req = MockRequest({"method": "submitsolution", "params": [[template['template_id']], 1, header.timestamp, "00" * 8], "id": 5})
+        self.assertEqual(json.loads((await self.rpc.handle_request(req)).text)['error']['code'], -1)
+        req = MockRequest({"method": "submitblock", "params": [], "id": 6})
+        self.assertEqual(json.loads((await self.rpc.handle_request(req)).text)['error']['code'], -1)
+
+class TestTemplateCache(unittest.TestCase):
+    def setUp(self):
+        from icsicoin.core.primitives import Transaction, TxIn, TxOut
+        from icsicoin.mining.template import TemplateCache
+        self.block_index = MagicMock()
+        self.block_index.get_best_block.return_value = {'height': 100, 'block_hash': '00'*32}
+        self.chain_manager = MagicMock()
+        self.chain_manager.block_index = self.block_index
+        self.mempool = Mempool()
+        for i in range(5):
+            tx = Transaction(vin=[TxIn(i.to_bytes(32, 'little'), 0)], vout=[TxOut(1000, b'\x51')])
+            self.mempool.add_transaction(tx, fee=100 * (i + 1))
+        self.templates = TemplateCache(self.chain_manager, self.mempool)
+
+    def block_from(self, template):
+        import io
+        from icsicoin.consensus.merkle import get_merkle_root
+        from icsicoin.core.primitives import Transaction
+        txs = [Transaction.deserialize(io.BytesIO(binascii.unhexlify(h))) for h in template['transactions']]
+        self.assertEqual(get_merkle_root(txs).hex(), template['merkle_root'])
+        return txs
+
+    def test_reused_until_tip_or_mempool_changes(self):
+        from unittest.mock import patch
+        with patch.object(self.mempool, 'select_transactions', wraps=self.mempool.select_transactions) as select:
+            a = self.templates.get_template('11'*20)
+            self.assertEqual(len(self.block_from(a)), 6)
+            self.assertEqual(a['coinbase_value'], 50*100000000 + 1500)
+            self.assertEqual(self.templates.get_template('11'*20)['merkle_root'], a['merkle_root'])
+            # Another payout address: new coinbase and root, same selection
+            b = self.templates.get_template('22'*20)
+            self.block_from(b)
+            self.assertNotEqual(b['merkle_root'], a['merkle_root'])
+            self.assertEqual(b['transactions'][1:], a['transactions'][1:])
+            self.assertEqual(select.call_count, 1)
+            self.assertEqual((self.templates.hits, self.templates.misses), (1, 2))
+
+            self.mempool.remove_transaction(self.mempool.entries[next(iter(self.mempool.entries))].txid)
+            c = self.templates.get_template('11'*20)
+            self.assertEqual(len(self.block_from(c)), 5)
+            self.block_index.get_best_block.return_value = {'height': 101, 'block_hash': '33'*32}
+            d = self.templates.get_template('11'*20)
+            self.assertEqual((d['height'], d['previousblockhash']), (102, '33'*32))
+            self.assertEqual(select.call_count, 3)
+
+    def test_work_rolls_extranonce_and_time(self):
+        from icsicoin.consensus.merkle import get_merkle_root
+        from icsicoin.mining.work import WorkTemplate
+        template = self.templates.get_template('11'*20)
+        work = WorkTemplate(template)
+        roots = set()
+        for i in range(3):
+            header, coinbase = work.next_work(now=template['curtime'] + i)
+            self.assertEqual(header.timestamp, template['curtime'] + i)
+            block = work.build_block(header, coinbase)
+            self.assertEqual(get_merkle_root(block.vtx), header.merkle_root)
+            self.assertTrue(block.vtx[0].vin[0].script_sig.endswith(i.to_bytes(8, 'little')))
+            self.assertEqual(block.vtx[0].vout[0].amount, template['coinbase_value'])
+            self.assertEqual(len(block.vtx), len(template['transactions']))
+            roots.add(header.merkle_root)
+        self.assertEqual(len(roots), 3)
+
+        # The cache rebuilds the same block from the compact solution
+        template_id, nonce, timestamp, extranonce = work.solution_params(header, coinbase)
+        rebuilt, reason = self.templates.build_block(template_id, nonce, timestamp, bytes.fromhex(extranonce))
+        self.assertIsNone(reason)
+        self.assertEqual(rebuilt.serialize(), block.serialize())
+        self.assertEqual(self.templates.build_block(template_id, nonce, timestamp, b'\x00')[1], "bad-extranonce")
+
+        # Templates without a split coinbase only roll the timestamp
+        legacy = {k: v for k, v in template.items() if k not in ('coinbase_prefix', 'coinbase_suffix', 'extranonce_size', 'merkle_branch')}
+        work = WorkTemplate(legacy)
+        first, _ = work.next_work(now=0)
+        second, coinbase = work.next_work(now=0)
+        self.assertIsNone(coinbase)
+        self.assertEqual(first.merkle_root.hex(), template['merkle_root'])
+        self.assertEqual(second.timestamp, first.timestamp + 1)
+
+class TestMinerMetrics(unittest.TestCase):
+    def test_windows_and_counters(self):
+        from icsicoin.mining.metrics import MinerMetrics
+        metrics = MinerMetrics()
+        metrics.start_session()
+        # 100 H/s for ten minutes, then 1000 H/s for the last 30 seconds
+        t, total = 1000.0, 0
+        for _ in range(300):
+            t += 2
+            total += 200
+            metrics.sample(total, [100.0], now=t)
+        for _ in range(15):
+            t += 2
+            total += 2000
+            metrics.sample(total, [1000.0], now=t)
+        self.assertAlmostEqual(metrics.hashrate(10, now=t), 1000.0)
+        self.assertAlmostEqual(metrics.hashrate(60, now=t), 550.0)
+        self.assertAlmostEqual(metrics.hashrate(600, now=t), (30 * 1000 + 570 * 100) / 600)
+        self.assertLessEqual(len(metrics.samples), 302)
+
+        metrics.template_fetched()
+        metrics.stale_work(0.004)
+        metrics.stale_work(0.002)
+        metrics.block_found(accepted=True)
+        metrics.block_found(accepted=False)
+        snap = metrics.snapshot()
+        self.assertEqual((snap['templates_fetched'], snap['stale_abandoned']), (1, 2))
+        self.assertEqual(snap['time_to_abandon_ms'], {'last': 2.0, 'median': 4.0, 'max': 4.0})
+        self.assertEqual((snap['blocks_found'], snap['blocks_accepted'], snap['blocks_rejected']), (2, 1, 1))
+        self.assertEqual(snap['worker_hashrates'], [1000.0])
+        self.assertEqual(set(snap['hashrate']), {'10s', '1m', '10m'})
+        json.dumps(snap)
+
+        metrics.end_session()
+        self.assertEqual(metrics.hashrate(10), 0.0)
+
+class AsyncTestStratum(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        from icsicoin.mining.notify import WorkNotifier
+        from icsicoin.mining.stratum import StratumServer
+        from icsicoin.mining.template import TemplateCache
+        self.test_dir = tempfile.mkdtemp()
+        self.wallet = Wallet(self.test_dir)
+        self.block_index = MagicMock()
+        self.block_index.get_best_block.return_value = {'height': 100, 'block_hash': '00'*32}
+        self.chain_manager = MagicMock()
+        self.chain_manager.block_index = self.block_index
+        self.chain_manager.process_block.return_value = (True, "Accepted")
+        self.notifier = WorkNotifier()
+        self.notifier.start()
+        self.server = StratumServer(0, self.chain_manager, TemplateCache(self.chain_manager, Mempool()), self.notifier,
+                                    self.wallet, bind_address='127.0.0.1', share_difficulty=1)
+        await self.server.start()
+        port = self.server.server.sockets[0].getsockname()[1]
+        self.reader, self.writer = await asyncio.open_connection('127.0.0.1', port)
+
+    async def asyncTearDown(self):
+        self.writer.close()
+        self.notifier.close()
+        await self.server.stop()
+        shutil.rmtree(self.test_dir)
+
+    async def call(self, method, params, request_id=1):
+        self.writer.write((json.dumps({"id": request_id, "method": method, "params": params}) + "\n").encode())
+        while True:
+            message = json.loads(await asyncio.wait_for(self.reader.readline(), 5))
+            if message.get('id') == request_id:
+                return message
+
+    async def notification(self, method):
+        while True:
+            message = json.loads(await asyncio.wait_for(self.reader.readline(), 5))
+            if message.get('method') == method:
+                return message['params']
+
+    def share(self, job, extranonce1, extranonce2, nonce):
+        from icsicoin.core.primitives import BlockHeader
+        from icsicoin.core.hashing import double_sha256
+        from icsicoin.consensus.merkle import get_merkle_root_from_branch
+        job_id, prev_hash, prefix, suffix, branch, version, bits, curtime, height, clean = job
+        coinbase = bytes.fromhex(prefix) + extranonce1 + extranonce2 + bytes.fromhex(suffix)
+        root = get_merkle_root_from_branch(double_sha256(coinbase), [bytes.fromhex(h) for h in branch])
+        return BlockHeader(version, bytes.fromhex(prev_hash), root, curtime, bits, nonce)
+
+    async def test_subscribe_submit_and_block(self):
+        from icsicoin.consensus.merkle import get_merkle_root
+        result = (await self.call('mining.subscribe', []))['result']
+        extranonce1, extranonce2_size = bytes.fromhex(result[1]), result[2]
+        self.assertEqual(len(extranonce1) + extranonce2_size, 8)
+        self.assertTrue((await self.call('mining.authorize', ['11'*20 + '.rig1', 'x'], 2))['result'])
+        self.assertEqual(await self.notification('mining.set_difficulty'), [1])
+        job = await self.notification('mining.notify')
+        self.assertTrue(job[-1])
+        job_id, curtime = job[0], job[7]
+        extranonce2 = b'\x00' * extranonce2_size
+
+        # Difficulty 1 accepts any hash; the same share twice does not count
+        ok = await self.call('mining.submit', ['w', job_id, extranonce2.hex(), curtime, 7], 3)
+        self.assertTrue(ok['result'])
+        dup = await self.call('mining.submit', ['w', job_id, extranonce2.hex(), curtime, 7], 4)
+        self.assertEqual(dup['error'][0], 22)
+        self.chain_manager.process_block.assert_not_called()
+
+        # A share meeting the block target becomes a full block paying the worker's address
+        self.server.jobs[job_id].target = 1 << 256
+        ok = await self.call('mining.submit', ['w', job_id, extranonce2.hex(), curtime, 8], 5)
+        self.assertTrue(ok['result'])
+        block = self.chain_manager.process_block.call_args[0][0]
+        self.assertEqual(block.header.serialize(), self.share(job, extranonce1, extranonce2, 8).serialize())
+        self.assertEqual(get_merkle_root(block.vtx), block.header.merkle_root)
+        self.assertEqual(block.vtx[0].vout[0].script_pubkey, b'\x76\xa9\x14' + bytes.fromhex('11'*20) + b'\x88\xac')
+
+        # A new tip pushes a clean job; shares for the old one are stale
+        self.block_index.get_best_block.return_value = {'height': 101, 'block_hash': '22'*32}
+        self.notifier.on_tip_changed(MagicMock(hash='22'*32, height=101))
+        job = await self.notification('mining.notify')
+        self.assertEqual((job[1], job[8], job[-1]), ('22'*32, 102, True))
+        stale = await self.call('mining.submit', ['w', job_id, extranonce2.hex(), curtime, 9], 6)
+        self.assertEqual(stale['error'][0], 21)
+
+        stats = self.server.get_stats()
+        self.assertEqual(stats['miners'][0]['accepted'], 2)
+        self.assertEqual(stats['miners'][0]['stale'], 1)
+        self.assertEqual(stats['blocks_found'], 1)
+
+    async def test_share_hashed_off_event_loop(self):
+        import threading
+        from unittest.mock import patch
+        from icsicoin.consensus.proof_of_work import hash_header
+        threads = []
+        def tracking_hash(header_bytes):
+            threads.append(threading.current_thread())
+            return hash_header(header_bytes)
+        result = (await self.call('mining.subscribe', []))['result']
+        await self.call('mining.authorize', ['rig', 'x'], 2)
+        job = await self.notification('mining.notify')
+        with patch('icsicoin.mining.stratum.hash_header', tracking_hash):
+            ok = await self.call('mining.submit', ['rig', job[0], '00' * result[2], job[7], 1], 3)
+        self.assertTrue(ok['result'])
+        self.assertEqual(len(threads), 1)
+        self.assertIsNot(threads[0], threading.current_thread())
+
+class TestHashWorkers(unittest.TestCase):
+    def setUp(self):
+        from icsicoin.mining.workers import HashWorkers
+        self.workers = HashWorkers(2)
+        self.workers.start()
+
+    def tearDown(self):
+        self.workers.close()
+
+    def test_finds_valid_nonce(self):
+        from icsicoin.core.primitives import BlockHeader
+        import hashlib
+        header = BlockHeader(1, b'\x00' * 32, b'\x11' * 32, 1700000000, 0x1f0fffff, 0)
+        target = 1 << 250 # ~1 in 64 hashes
+        self.workers.submit(header.serialize(), target, 0, 4096)
+        found = self.workers.wait(timeout=60)
+        self.assertIsNotNone(found)
+        nonce, pow_hash, worker = found
+        header.nonce = nonce
+        data = header.serialize()
+        # Checked with hashlib, other test modules stub out the scrypt package
+        self.assertEqual(hashlib.scrypt(data, salt=data, n=1024, r=1, p=1, dklen=32), pow_hash)
+        self.assertLessEqual(int.from_bytes(pow_hash, 'little'), target)
+        self.assertIn(worker, (0, 1))
+
+    def test_cancel_and_exhaust(self):
+        header = b'\x00' * 80
+        self.workers.submit(header, 0) # Unreachable target, full nonce space
+        self.assertIsNone(self.workers.wait(timeout=0.5))
+        self.workers.cancel()
+        self.assertTrue(self.workers.exhausted)
+        # A small range with an unreachable target runs out; stale reports are skipped
+        self.workers.submit(header, 0, 0, 20)
+        self.assertIsNone(self.workers.wait(timeout=30))
+        self.assertTrue(self.workers.exhausted)
+        self.assertGreater(self.workers.get_total_hashes(), 20)
+
 if __name__ == '__main__':
     unittest.main()
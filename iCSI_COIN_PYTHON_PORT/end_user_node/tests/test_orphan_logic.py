@@ -8,6 +8,7 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 sys.modules['scrypt'] = MagicMock()
 
 from icsicoin.core.chain import ChainManager
+from icsicoin.core.orphans import OrphanPool
 from icsicoin.core.primitives import Block, BlockHeader
 
 class TestOrphanLogic(unittest.TestCase):
@@ -117,5 +118,75 @@ class TestOrphanLogic(unittest.TestCase):
             # Since we didn't mock "connected" completely, we can verify B is now in "known_blocks" due to our side_effect
             self.assertIn(child_hash, known_blocks, "Block B should have been connected recursively")
 
+    def test_deep_orphan_chain_resolves_iteratively(self):
+        """A parent arriving after thousands of out-of-order children connects them all without recursion"""
+        genesis = '00'*32
+        known_blocks = {genesis}
+
+        def make_block(block_hash, prev_hash):
+            block = MagicMock()
+            block.get_hash.return_value.hex.return_value = block_hash
+            block.header.prev_block.hex.return_value = prev_hash
+            block.header.bits = 0x1f099996
+            block.serialize.return_value = b'\x00' * 100
+            return block
+
+        hashes = [f"{i:064x}" for i in range(1, 1501)]
+        blocks = [make_block(h, hashes[i-1] if i else genesis) for i, h in enumerate(hashes)]
+
+        def mock_get_info(h):
+            return {'status': 3, 'height': 0, 'block_hash': h} if h in known_blocks else None
+        self.mock_index.get_block_info.side_effect = mock_get_info
+
+        def side_effect_connect(blk, height):
+            known_blocks.add(blk.get_hash().hex())
+            return True, "Connected"
+        self.chain._connect_block = side_effect_connect
+
+        with unittest.mock.patch('icsicoin.core.chain.validate_block', return_value=(True, "OK")):
+            for block in reversed(blocks[1:]):
+                self.assertEqual(self.chain.process_block(block), (False, "Orphan block"))
+            self.assertEqual(self.chain.get_missing_orphan_ancestor(hashes[-1]), (hashes[1], hashes[0]))
+
+            self.chain.process_block(blocks[0])
+
+        self.assertEqual(len(self.chain.orphan_pool), 0)
+        self.assertEqual(self.chain.block_tree.tip.hash, hashes[-1])
+
+class TestOrphanPool(unittest.TestCase):
+    def make_block(self, block_hash, prev_hash, size=100):
+        block = MagicMock()
+        block.get_hash.return_value.hex.return_value = block_hash
+        block.header.prev_block.hex.return_value = prev_hash
+        block.serialize.return_value = b'\x00' * size
+        return block
+
+    def test_limits_and_expiry(self):
+        pool = OrphanPool(max_bytes=350, max_per_peer=2, expiry=60)
+        a, b, c, d = (self.make_block(h * 64, 'f' * 64) for h in 'abcd')
+
+        pool.add(a, peer='p1', now=0)
+        pool.add(b, peer='p1', now=1)
+        pool.add(c, peer='p1', now=2)     # Per-peer cap: evicts a
+        self.assertNotIn('a' * 64, pool)
+        pool.add(d, peer='p2', now=3)
+        pool.add(self.make_block('e' * 64, 'f' * 64), peer='p3', now=4) # Byte budget: evicts b
+        self.assertEqual(sorted(pool.blocks), ['c' * 64, 'd' * 64, 'e' * 64])
+        self.assertEqual(pool.total_bytes, 300)
+        self.assertEqual([blk.get_hash().hex() for blk in pool.by_prev['f' * 64]], ['c' * 64, 'd' * 64, 'e' * 64])
+
+        pool.expire(now=63.5)             # c (t=2) and d (t=3) are older than 60s
+        self.assertEqual(list(pool.blocks), ['e' * 64])
+        self.assertEqual(pool.get_stats()['expired'], 2)
+
+    def test_missing_ancestor(self):
+        pool = OrphanPool()
+        pool.add(self.make_block('c' * 64, 'b' * 64))
+        pool.add(self.make_block('b' * 64, 'a' * 64))
+        self.assertEqual(pool.get_missing_ancestor('c' * 64), ('b' * 64, 'a' * 64))
+        self.assertIsNone(pool.get_missing_ancestor('a' * 64))
+        self.assertEqual([blk.get_hash().hex() for blk in pool.take_children('a' * 64)], ['b' * 64])
+        self.assertEqual(pool.get_missing_ancestor('c' * 64), ('c' * 64, 'b' * 64))
+
 if __name__ == '__main__':
     unittest.main()
@@ -88,7 +88,73 @@ class TestPeerMetadata(unittest.TestCase):
             
             self.assertEqual(stats['height'], 12345)
             self.assertEqual(stats['user_agent'], '/Satoshi:0.1/')
+            # Its VERSION advertised binary payloads, so it gets them
+            self.assertTrue(self.manager.speaks_binary(mock_writer))
+            self.manager.note_peer_services(mock_writer, 1)
+            self.assertFalse(self.manager.speaks_binary(mock_writer))
             
+    async def async_test_wallet_broadcast_format(self):
+        """Wallet tx announcements follow each peer's negotiated format."""
+        from icsicoin.web.server import WebServer
+        from icsicoin.network.messages import InvMessage
+        from icsicoin.core.primitives import Transaction, TxIn, TxOut
+        tx = Transaction(vin=[TxIn(b'\x01' * 32, 0, b'\x51')], vout=[TxOut(1000, b'\x51' * 25)])
+        binary_writer, json_writer = MagicMock(), MagicMock()
+        binary_writer.drain = AsyncMock()
+        json_writer.drain = AsyncMock()
+        self.manager.active_connections = {('1.2.3.4', 9333): binary_writer, ('5.6.7.8', 9333): json_writer}
+        self.manager.note_peer_services(binary_writer, VersionMessage().services)
+
+        web = MagicMock(network_manager=self.manager)
+        await WebServer._broadcast_tx_task(web, tx)
+
+        for writer, binary in ((binary_writer, True), (json_writer, False)):
+            frame = writer.write.call_args[0][0]
+            _, command, length, _ = Message.parse_header(frame[:24])
+            self.assertEqual(command, 'inv')
+            items = InvMessage.parse(frame[24:24 + length], binary)
+            self.assertEqual(items, [{"type": "tx", "hash": tx.get_hash().hex()}])
+
+    def test_wallet_broadcast_format(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(self.async_test_wallet_broadcast_format())
+        loop.close()
+
+    async def async_test_headers_exchange(self):
+        """getheaders is answered from the chain; a full headers batch asks for the next one."""
+        from icsicoin.core.primitives import BlockHeader
+        from icsicoin.network.messages import GetHeadersMessage, HeadersMessage, MAX_HEADERS
+        headers = [BlockHeader(1, b'\x11' * 32, b'\x22' * 32, 1700000000, 0x1f099996, n) for n in range(MAX_HEADERS)]
+        chain_manager = MagicMock()
+        chain_manager.get_headers_after.return_value = headers[:2]
+        chain_manager.accept_headers.return_value = (True, "Headers accepted")
+        chain_manager.wants_headers.return_value = True
+        chain_manager.get_block_locator.return_value = ['00' * 32]
+        self.manager.chain_manager = chain_manager
+        self.manager.running = True
+
+        reader = asyncio.StreamReader()
+        reader.feed_data(GetHeadersMessage(['aa' * 32]).serialize() + HeadersMessage(headers).serialize())
+        reader.feed_eof()
+        writer = MagicMock()
+        writer.drain = AsyncMock()
+        self.manager.note_peer_services(writer, VersionMessage().services)
+        await self.manager.process_message_loop(reader, writer, ('1.2.3.4', 9333))
+
+        chain_manager.get_headers_after.assert_called_once_with(['aa' * 32], MAX_HEADERS)
+        chain_manager.accept_headers.assert_called_once()
+        sent = [call[0][0] for call in writer.write.call_args_list]
+        replies = {Message.parse_header(frame[:24])[1]: frame[24:] for frame in sent}
+        self.assertEqual(len(HeadersMessage.parse(replies['headers'])), 2)
+        self.assertEqual(GetHeadersMessage.parse(replies['getheaders']), [headers[-1].get_hash().hex(), '00' * 32])
+
+    def test_headers_exchange(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(self.async_test_headers_exchange())
+        loop.close()
+
     def test_metadata_capture(self):
         loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
@@ -50,5 +50,37 @@ class TestSerialization(unittest.TestCase):
         self.assertEqual(block.header.nonce, block2.header.nonce)
         self.assertEqual(len(block.vtx), 1)
 
+    def test_wire_messages(self):
+        import json
+        from icsicoin.network.messages import (Message, InvMessage, GetDataMessage, BlockMessage, TxMessage,
+                                               GetBlocksMessage, GetHeadersMessage, HeadersMessage)
+        inventory = [{"type": "block", "hash": "ab" * 32}, {"type": "tx", "hash": "cd" * 32}]
+        raw_block = Block(vtx=[Transaction(vin=[TxIn(b'\x01' * 32, 0)], vout=[TxOut(1, b'\x51')])]).serialize()
+        for binary in (True, False):
+            for cls in (InvMessage, GetDataMessage):
+                msg = cls(inventory, binary)
+                self.assertEqual(Message.parse_header(msg.serialize())[1], cls.command)
+                self.assertEqual(cls.parse(msg.payload, binary), inventory)
+            self.assertEqual(BlockMessage.parse(BlockMessage(raw_block, binary).payload, binary), raw_block)
+            self.assertEqual(TxMessage(raw_block, binary).command, 'tx')
+            locator = ["11" * 32, "22" * 32]
+            self.assertEqual(GetBlocksMessage.parse(GetBlocksMessage(locator, binary).payload, binary), locator)
+            msg = GetHeadersMessage(locator, binary)
+            self.assertEqual((msg.command, GetHeadersMessage.parse(msg.payload, binary)), ('getheaders', locator))
+            headers = [BlockHeader(1, b'\x11' * 32, b'\x22' * 32, 1700000000, 0x1f099996, n) for n in range(3)]
+            parsed = HeadersMessage.parse(HeadersMessage(headers, binary).payload, binary)
+            self.assertEqual([h.serialize() for h in parsed], [h.serialize() for h in headers])
+
+        # The JSON form is what nodes without binary support send and expect
+        self.assertEqual(json.loads(BlockMessage(raw_block, binary=False).payload),
+                         {"type": "block", "payload": raw_block.hex()})
+        self.assertEqual(json.loads(InvMessage(inventory, binary=False).payload)['inventory'], inventory)
+        self.assertEqual(BlockMessage(raw_block).payload, raw_block)
+        self.assertEqual(len(InvMessage(inventory).payload), 1 + 2 * 36)
+        with self.assertRaises(ValueError):
+            InvMessage.parse(b'\x05' + b'\x00' * 36)
+        with self.assertRaises(ValueError):
+            HeadersMessage.parse(b'\x02' + b'\x00' * 80)
+
 if __name__ == '__main__':
     unittest.main()
@@ -74,5 +74,23 @@ class TestStorage(unittest.TestCase):
         utxo = self.chain_state.get_utxo(txid, vout)
         self.assertIsNone(utxo)
 
+    def test_chain_state_batch_lookup(self):
+        from icsicoin.core.coins import UTXOView
+        for i in range(450): # Spans more than one parameter chunk
+            self.chain_state.add_utxo(f"{i:064x}", i % 3, 1000 + i, b'\x51', 7, False)
+
+        wanted = [(f"{i:064x}", i % 3) for i in range(0, 450, 2)] + [("ff"*32, 0)]
+        found = self.chain_state.get_utxos(wanted)
+        self.assertEqual(len(found), 225)
+        self.assertEqual(found[(f"{10:064x}", 1)]['amount'], 1010)
+        self.assertNotIn(("ff"*32, 0), found)
+
+        # View serves prefetched entries without touching the store again
+        view = UTXOView(self.chain_state)
+        view.prefetch(wanted)
+        self.chain_state.remove_utxo(f"{10:064x}", 1)
+        self.assertEqual(view.get_utxo(f"{10:064x}", 1)['amount'], 1010)
+        self.assertIsNone(view.get_utxo("ff"*32, 0))
+
 if __name__ == '__main__':
     unittest.main()